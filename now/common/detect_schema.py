@@ -1,7 +1,9 @@
 import itertools
 import json
 import os
-from typing import Dict, List
+import re
+from datetime import datetime
+from typing import Any, Dict, List
 
 import requests
 
@@ -21,6 +23,19 @@ from now.utils.docarray.helpers import (
 )
 from now.utils.errors.helpers import RetryException
 
+# dates are only detected in ISO 8601 format, e.g. 2023-01-31 or 2023-01-31T12:00:00Z,
+# which Elasticsearch parses by default
+DATE_PATTERN = re.compile(
+    r'^\d{4}-\d{2}-\d{2}(T\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?(Z|[+-]\d{2}:\d{2})?$'
+)
+
+# types of the tag values of a DocumentArray, which are stored as protobuf values
+PROTOBUF_VALUE_TYPES = {
+    'stringValue': 'str',
+    'numberValue': 'float',
+    'boolValue': 'bool',
+}
+
 
 def get_field_type(field_value):
     split = field_value.split('.')
@@ -31,6 +46,21 @@ def get_field_type(field_value):
         return 'txt'
 
 
+def get_filter_field_type(field_value: Any) -> str:
+    """
+    Returns the type of the value of a filter field. Numbers and booleans keep their type,
+    e.g. 'int', 'float' or 'bool', and strings in ISO 8601 date format are detected as 'date'.
+    The indexer maps the filter fields according to these types.
+    """
+    if isinstance(field_value, str) and DATE_PATTERN.match(field_value):
+        try:
+            datetime.fromisoformat(field_value.replace('Z', '+00:00'))
+            return 'date'
+        except ValueError:
+            pass
+    return field_value.__class__.__name__
+
+
 def _create_candidate_index_filter_fields(field_name_to_value):
     """
     Creates candidate index fields from the field_names for s3
@@ -52,8 +82,8 @@ def _create_candidate_index_filter_fields(field_name_to_value):
         )
     )
     for field_name, field_value in field_name_to_value.items():
-        # we determine search modality
-        file_type = get_field_type(field_value)
+        # we determine search modality, numbers and booleans can only be searched as text
+        file_type = get_field_type(str(field_value))
         index_field_candidates_to_modalities[field_name] = FILETYPE_TO_MODALITY[
             file_type
         ]
@@ -63,9 +93,9 @@ def _create_candidate_index_filter_fields(field_name_to_value):
             field_name == 'uri'
             and field_value.split('.')[-1] not in not_available_file_types_for_filter
         ) or field_name.split('.')[-1] not in not_available_file_types_for_filter:
-            filter_field_candidates_to_modalities[
-                field_name
-            ] = field_value.__class__.__name__
+            filter_field_candidates_to_modalities[field_name] = get_filter_field_type(
+                field_value
+            )
 
     if len(index_field_candidates_to_modalities.keys()) == 0:
         raise ValueError(
@@ -134,7 +164,7 @@ def _extract_field_candidates_docarray(response):
     if doc.get('tags', None):
         for el, value in doc['tags']['fields'].items():
             for val_type, val in value.items():
-                filter_modalities[el] = val_type
+                filter_modalities[el] = PROTOBUF_VALUE_TYPES.get(val_type, val_type)
 
     if len(search_modalities.keys()) == 0:
         raise ValueError(
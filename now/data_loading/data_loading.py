@@ -282,7 +282,8 @@ def create_docs_from_subdirectories(
                         json_data = flatten_dict(json.load(f))
                     for field, value in json_data.items():
                         if field in fields:
-                            kwargs[field_names_to_dataclass_fields[field]] = value
+                            # index fields are searched as text
+                            kwargs[field_names_to_dataclass_fields[field]] = str(value)
                         else:
                             tags_loaded_local[field] = value
         doc = Document(data_class(**kwargs))
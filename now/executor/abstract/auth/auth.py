@@ -1,3 +1,5 @@
+import asyncio
+import inspect
 import json
 import os
 from functools import lru_cache
@@ -21,6 +23,24 @@ def secure_request(level: int, on: str = None):
     """decorator to check the authorization of the incoming request"""
 
     def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            # async endpoints stay coroutines, such that Jina runs them concurrently
+            @requests(on=on)
+            async def async_wrapper(*args, **kwargs):
+                # the check may call hubble, which blocks
+                await asyncio.get_running_loop().run_in_executor(
+                    None,
+                    _check_user,
+                    kwargs,
+                    level,
+                    args[0].user_emails,
+                    args[0].admin_emails,
+                    args[0].api_keys,
+                )
+                return await func(*args, **kwargs)
+
+            return async_wrapper
+
         @requests(on=on)
         def wrapper(*args, **kwargs):
             _check_user(
@@ -1,4 +1,4 @@
-from typing import Dict, List
+from typing import Dict, List, Optional, Union
 
 from pydantic import BaseModel, Field
 
@@ -21,7 +21,11 @@ class TagsResponseModel(BaseModel):
 
 
 class CountRequestModel(BaseRequestModel):
-    limit: int = Field(default=10, description='Maximum count', example=10)
+    filters: Optional[Dict[str, Union[List, Dict[str, Union[int, float]]]]] = Field(
+        default={},
+        description='dictionary with filters for the counted documents',
+        example={'color': ['blue'], 'price': {'lt': 50.0}},
+    )
 
 
 class CountResponseModel(BaseModel):
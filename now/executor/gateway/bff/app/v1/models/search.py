@@ -61,6 +61,37 @@ class SearchRequestModel(BaseRequestModel):
         description='If true, the score breakdown is returned in the response tags.',
         example=True,
     )
+    fields: List[str] = Field(
+        default=[],
+        description='If given, only these text fields and tags are returned for each result. '
+        'Names which are not index fields are interpreted as tag names.',
+        example=['title', 'color'],
+    )
+    document_id: Optional[str] = Field(
+        default=None,
+        description='If given, documents similar to the indexed document with this id are searched instead of '
+        'the query, with its stored embeddings. The query fields of the score calculation are then index fields.',
+        example='123',
+    )
+    facets: List[str] = Field(
+        default=[],
+        description='Tags whose most frequent values among the results are counted in the same request. '
+        'If given, the response contains the results and the facet counts.',
+        example=['color'],
+    )
+    facet_size: Optional[int] = Field(
+        default=None,
+        description='Maximum number of values per facet. Defaults to the maximum number of values per tag '
+        'of the index.',
+        example=10,
+    )
+
+
+class FacetValueModel(BaseModel):
+    value: Any = Field(default=..., description='Value of the tag.', example='blue')
+    count: int = Field(
+        default=..., description='Number of results with this value.', example=3
+    )
 
 
 class SearchResponseModel(BaseModel):
@@ -171,6 +202,17 @@ class SearchResponseModel(BaseModel):
         arbitrary_types_allowed = True
 
 
+class SearchWithFacetsResponseModel(BaseModel):
+    matches: List[SearchResponseModel] = Field(
+        default=[], description='The matching results.'
+    )
+    facets: Dict[str, List[FacetValueModel]] = Field(
+        default={},
+        description='Maps each requested facet to the counts of its most frequent values among the results.',
+        example={'color': [{'value': 'blue', 'count': 3}]},
+    )
+
+
 class SuggestionRequestModel(BaseRequestModel):
     text: Optional[str] = Field(default=None, description='Text', example='cute cats')
 
@@ -178,3 +220,4 @@ class SuggestionRequestModel(BaseRequestModel):
 IndexRequestModel.update_forward_refs()
 SearchRequestModel.update_forward_refs()
 SearchResponseModel.update_forward_refs()
+SearchWithFacetsResponseModel.update_forward_refs()
@@ -35,7 +35,9 @@ async def get_count(data: CountRequestModel) -> CountResponseModel:
         docs=Document(),
         endpoint='/count',
         target_executor=r'\Aindexer\Z',
-        parameters={'limit': data.limit},
+        parameters={
+            'filter': {'tags__' + key: value for key, value in data.filters.items()}
+        },
     )
     return CountResponseModel(number_of_docs=response[0].tags['count'])
 
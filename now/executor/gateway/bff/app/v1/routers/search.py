@@ -1,7 +1,7 @@
 import base64
 import logging
 import os
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Union
 
 from docarray import Document
 from fastapi import APIRouter, Body
@@ -11,6 +11,7 @@ from now.executor.gateway.bff.app.settings import user_input_in_bff
 from now.executor.gateway.bff.app.v1.models.search import (
     SearchRequestModel,
     SearchResponseModel,
+    SearchWithFacetsResponseModel,
     SuggestionRequestModel,
 )
 from now.executor.gateway.bff.app.v1.routers.helper import (
@@ -64,6 +65,15 @@ search_examples = {
             'get_score_breakdown': True,
         },
     },
+    'document_id': {
+        'summary': 'An example: search similar documents',
+        'description': 'Search documents similar to an indexed document, do not run. For parameter reference only.',
+        'value': {
+            'limit': 10,
+            'document_id': '<id of an indexed document>',
+            'score_calculation': [['title', 'title', 'encoderclip', 1.0]],
+        },
+    },
     'dummy': {
         'summary': 'A dummy example',
         'description': 'A dummy example,  do not run. For parameter reference only.',
@@ -82,6 +92,8 @@ search_examples = {
             ],
             'create_temp_link': False,
             'score_calculation': [['query_text_0', 'title', 'encoderclip', 1.0]],
+            'facets': ['color'],
+            'facet_size': 10,
         },
     },
 }
@@ -110,7 +122,7 @@ router = APIRouter()
 
 @router.post(
     '/search',
-    response_model=List[SearchResponseModel],
+    response_model=Union[List[SearchResponseModel], SearchWithFacetsResponseModel],
     summary='Search data via query',
 )
 async def search(
@@ -119,10 +131,15 @@ async def search(
     logger.info(f'Got search request: {data}')
     fields_modalities_mapping = {}
     fields_values_mapping = {}
-    if len(data.query) == 0:
+    query = data.query
+    if data.document_id is not None:
+        # the flow needs a query document, but the indexer ignores it and searches with the
+        # stored embeddings of the indexed document
+        query = [{'name': 'document_id', 'modality': 'text', 'value': data.document_id}]
+    elif len(query) == 0:
         raise ValueError('Query cannot be empty')
 
-    for field in data.query:
+    for field in query:
         fields_modalities_mapping[field['name']] = modality_string_to_docarray_typing(
             field['modality']
         )
@@ -137,6 +154,11 @@ async def search(
         modalities_dict=fields_modalities_mapping,
         field_names_to_dataclass_fields=field_names_to_dataclass_fields,
     )
+    if data.document_id is not None:
+        # the query fields of the score calculation are the fields of the indexed document
+        field_names_to_dataclass_fields = (
+            user_input_in_bff.field_names_to_dataclass_fields
+        )
     score_calculation = get_score_calculation(data, field_names_to_dataclass_fields)
 
     query_filter = {}
@@ -144,16 +166,35 @@ async def search(
         key = 'tags__' + key
         query_filter[key] = value
 
+    # maps the requested field names to the fields stored in the index
+    source_fields = {}
+    for field_name in data.fields:
+        if field_name in user_input_in_bff.field_names_to_dataclass_fields:
+            source_fields[
+                user_input_in_bff.field_names_to_dataclass_fields[field_name]
+            ] = field_name
+        else:
+            source_fields[f'tags.{field_name}'] = field_name
+
+    parameters = {
+        'limit': data.limit,
+        'filter': query_filter,
+        'create_temp_link': data.create_temp_link,
+        'score_calculation': score_calculation,
+        'get_score_breakdown': data.get_score_breakdown,
+        'fields': list(source_fields.keys()),
+    }
+    if data.document_id is not None:
+        parameters['document_id'] = data.document_id
+    if data.facets:
+        parameters['facets'] = data.facets
+        if data.facet_size is not None:
+            parameters['facet_size'] = data.facet_size
+
     docs = await jina_client_post(
         endpoint='/search',
         docs=query_doc,
-        parameters={
-            'limit': data.limit,
-            'filter': query_filter,
-            'create_temp_link': data.create_temp_link,
-            'score_calculation': score_calculation,
-            'get_score_breakdown': data.get_score_breakdown,
-        },
+        parameters=parameters,
         request_model=data,
     )
     matches = []
@@ -162,6 +203,20 @@ async def search(
         scores = {}
         for score_name, named_score in doc.scores.items():
             scores[score_name] = named_score.to_dict()
+        if source_fields:
+            # only the requested fields of the stored document are returned
+            match = SearchResponseModel(
+                id=doc.id,
+                scores=scores,
+                tags=doc.tags.get('tags', {}),
+                fields={
+                    source_fields[source_field]: {'text': value}
+                    for source_field, value in doc.tags.items()
+                    if source_field in source_fields and isinstance(value, str)
+                },
+            )
+            matches.append(match)
+            continue
         # since multimodal doc is not supported, we take the first chunk
         if doc.chunks:
             field_names_and_chunks = [
@@ -199,6 +254,11 @@ async def search(
         f'Reporting search usage after successful search request for user {data.jwt.get("token")}'
     )
     report_search_usage(user_token=data.jwt.get('token'))
+    if data.facets:
+        # the facet counts are returned in the tags of the query document
+        return SearchWithFacetsResponseModel(
+            matches=matches, facets=docs[0].tags.get('facets', {})
+        )
     return matches
 
 
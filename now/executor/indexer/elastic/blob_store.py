@@ -0,0 +1,172 @@
+import hashlib
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from typing import Dict, Optional
+
+import boto3
+from docarray import DocumentArray
+
+# the tag of a document which references its blob in the blob store
+BLOB_REF_TAG = '_blob_ref'
+
+
+class BlobStore(ABC):
+    """
+    Stores the blobs of documents, e.g. image thumbnails and video frames, outside of
+    Elasticsearch. Blobs are content addressed, such that equal blobs are only stored once.
+    """
+
+    @abstractmethod
+    def put(self, key: str, blob: bytes):
+        """Stores the blob under the key."""
+
+    @abstractmethod
+    def get(self, key: str) -> bytes:
+        """Returns the blob stored under the key."""
+
+    def get_url(self, key: str) -> Optional[str]:
+        """Returns a URL of the blob which can be accessed without credentials, or `None`
+        if the store can not serve blobs by reference."""
+        return None
+
+    def externalize(self, docs: DocumentArray, traversal_paths: str = '@r,c,cc'):
+        """
+        Moves the blobs of the documents into the store and replaces them by a reference
+        in the tags of the documents.
+
+        :param docs: documents with blobs, e.g. the chunks created by the preprocessor.
+        :param traversal_paths: paths of the documents whose blobs are moved.
+        """
+        stored_keys = set()
+        for d in docs[traversal_paths]:
+            if not d.blob:
+                continue
+            key = hashlib.sha256(d.blob).hexdigest()
+            if key not in stored_keys:
+                self.put(key, d.blob)
+                stored_keys.add(key)
+            # the tags of chunks can be shared with their parent, so they are not modified in place
+            d.tags = {**d.tags, BLOB_REF_TAG: key}
+            d.blob = b''
+
+    def resolve(
+        self,
+        docs: DocumentArray,
+        traversal_paths: str = '@r,c,cc',
+        by_reference: bool = False,
+    ):
+        """
+        Restores the blobs of documents which reference the store.
+
+        :param docs: documents returned from Elasticsearch.
+        :param traversal_paths: paths of the documents whose blobs are restored.
+        :param by_reference: if possible, the URI of the blob is set instead of loading it.
+        """
+        for d in docs[traversal_paths]:
+            key = d.tags.get(BLOB_REF_TAG, None)
+            if key is None:
+                continue
+            url = self.get_url(key) if by_reference else None
+            if url is not None:
+                d.uri = url
+            else:
+                d.blob = self.get(key)
+            d.tags = {k: v for k, v in d.tags.items() if k != BLOB_REF_TAG}
+
+
+class LocalBlobStore(BlobStore):
+    """Stores blobs as files in a local directory, e.g. on a volume shared by all replicas."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _get_file_path(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key)
+
+    def put(self, key: str, blob: bytes):
+        file_path = self._get_file_path(key)
+        if os.path.exists(file_path):
+            return
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        # the blob is written to a temporary file first, so that readers never see a partial blob.
+        # The name of the temporary file is unique, since threads and replicas may write the same
+        # blob concurrently
+        with tempfile.NamedTemporaryFile(
+            dir=os.path.dirname(file_path), suffix='.tmp', delete=False
+        ) as f:
+            f.write(blob)
+        # temporary files are only readable by their owner, but other replicas read the blob
+        os.chmod(f.name, 0o644)
+        os.replace(f.name, file_path)
+
+    def get(self, key: str) -> bytes:
+        with open(self._get_file_path(key), 'rb') as f:
+            return f.read()
+
+
+class S3BlobStore(BlobStore):
+    """Stores blobs in an S3 compatible bucket. Blobs can be served by reference with presigned URLs."""
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = '',
+        endpoint_url: Optional[str] = None,
+        aws_access_key_id: Optional[str] = None,
+        aws_secret_access_key: Optional[str] = None,
+        region_name: Optional[str] = None,
+        url_expires_in: int = 3600,
+    ):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.url_expires_in = url_expires_in
+        session = boto3.session.Session(
+            aws_access_key_id=aws_access_key_id,
+            aws_secret_access_key=aws_secret_access_key,
+            region_name=region_name,
+        )
+        self.s3_client = session.client('s3', endpoint_url=endpoint_url)
+
+    def _get_object_key(self, key: str) -> str:
+        return f'{self.prefix}{key}'
+
+    def put(self, key: str, blob: bytes):
+        self.s3_client.put_object(
+            Bucket=self.bucket, Key=self._get_object_key(key), Body=blob
+        )
+
+    def get(self, key: str) -> bytes:
+        return self.s3_client.get_object(
+            Bucket=self.bucket, Key=self._get_object_key(key)
+        )['Body'].read()
+
+    def get_url(self, key: str) -> Optional[str]:
+        return self.s3_client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': self._get_object_key(key)},
+            ExpiresIn=self.url_expires_in,
+        )
+
+
+def create_blob_store(config: Optional[Dict]) -> Optional[BlobStore]:
+    """
+    Creates the blob store from its configuration, e.g. `{'type': 'local', 'path': '/data/blobs'}`
+    or `{'type': 's3', 'bucket': 'my-bucket', 'prefix': 'blobs/'}`.
+
+    :param config: configuration of the blob store. All keys except `type` are passed to the store.
+    :return: the blob store, or `None` if no configuration is given.
+    """
+    if not config:
+        return None
+    config = dict(config)
+    store_type = config.pop('type', 'local')
+    if store_type == 'local':
+        if not config.get('path', None):
+            raise ValueError(
+                'The local blob store requires a path, which must be shared by all replicas'
+            )
+        return LocalBlobStore(**config)
+    elif store_type == 's3':
+        return S3BlobStore(**config)
+    raise ValueError(f'Invalid blob store type {store_type}. Choose local or s3')
@@ -0,0 +1,92 @@
+from threading import Lock
+from time import monotonic
+from typing import Callable, Dict
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of sending a request while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker around the requests to Elasticsearch. After `failure_threshold` consecutive
+    failed requests, the circuit opens and requests fail immediately with a `CircuitOpenError`
+    instead of waiting for the client timeout. After `reset_timeout` seconds, a single trial
+    request is let through, which closes the circuit again if it succeeds.
+
+    It is used as a context manager around the requests, both in sync and async code::
+
+        with circuit_breaker:
+            es.msearch(...)
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30,
+        is_failure: Callable[[BaseException], bool] = lambda e: True,
+    ):
+        """
+        :param failure_threshold: number of consecutive failures which open the circuit.
+        :param reset_timeout: time in seconds after which an open circuit lets a trial request through.
+        :param is_failure: decides whether an exception counts as a failure of the backend. Other
+            exceptions, e.g. invalid queries, are raised without affecting the circuit.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.is_failure = is_failure
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._trial_running = False
+        self._lock = Lock()
+
+    def __enter__(self):
+        with self._lock:
+            if (
+                self.state == OPEN
+                and monotonic() - self.opened_at >= self.reset_timeout
+            ):
+                self.state = HALF_OPEN
+            if self.state == OPEN or (self.state == HALF_OPEN and self._trial_running):
+                self.rejected += 1
+                raise CircuitOpenError(
+                    f'Elasticsearch is unavailable after {self.consecutive_failures} failed '
+                    f'requests, retrying in {self._get_retry_in():.1f} seconds'
+                )
+            if self.state == HALF_OPEN:
+                self._trial_running = True
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        with self._lock:
+            self._trial_running = False
+            if exc_value is None or not self.is_failure(exc_value):
+                self.state = CLOSED
+                self.consecutive_failures = 0
+                return False
+            self.consecutive_failures += 1
+            if (
+                self.state == HALF_OPEN
+                or self.consecutive_failures >= self.failure_threshold
+            ):
+                self.state = OPEN
+                self.opened_at = monotonic()
+        return False
+
+    def _get_retry_in(self) -> float:
+        return max(0.0, self.reset_timeout - (monotonic() - self.opened_at))
+
+    def get_state(self) -> Dict:
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'rejected': self.rejected,
+                'retry_in': self._get_retry_in() if self.state == OPEN else 0.0,
+            }
@@ -1,13 +1,35 @@
+import asyncio
+import base64
+import hashlib
+import json
 import os
+import re
 import traceback
 from collections import namedtuple
-from time import sleep
-from typing import Any, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from functools import partial
+from threading import Lock, RLock
+from time import sleep, time
+from typing import Any, Callable, Dict, Generator, Iterable, List, Optional, Tuple
 
 import boto3
+import numpy as np
 from docarray import Document, DocumentArray
-from elasticsearch import Elasticsearch
-from elasticsearch.helpers import bulk
+from elasticsearch import (
+    ApiError,
+    AsyncElasticsearch,
+    ConflictError,
+    Elasticsearch,
+    NotFoundError,
+    TransportError,
+)
+from elasticsearch.helpers import (
+    async_streaming_bulk,
+    parallel_bulk,
+    scan,
+    streaming_bulk,
+)
 
 from now.constants import DatasetTypes
 from now.executor.abstract.auth import (
@@ -15,26 +37,137 @@ from now.executor.abstract.auth import (
     get_auth_executor_class,
     secure_request,
 )
+from now.executor.indexer.elastic.blob_store import create_blob_store
+from now.executor.indexer.elastic.circuit_breaker import CircuitBreaker
 from now.executor.indexer.elastic.es_converter import (
-    convert_doc_map_to_es,
+    FULL_PRECISION_EMBEDDING,
+    QUANTIZATION_MODES,
+    SERIALIZED_DOC_FIELD,
     convert_es_results_to_matches,
     convert_es_to_da,
+    iter_doc_map_to_es,
 )
 from now.executor.indexer.elastic.es_query_building import (
+    NORMALIZE_EMBEDDINGS_SCRIPT,
+    build_es_knn_queries,
     build_es_queries,
+    build_score_breakdown_script_fields,
     generate_score_calculation,
+    get_pinned_query,
+    get_scoring_embedding_field,
     process_filter,
+    stored_scripts,
+    vector_script_id,
 )
+from now.executor.indexer.elastic.projection import Projection, create_projections
+from now.executor.indexer.elastic.result_cache import ResultCache
+from now.utils.docarray.helpers import get_chunk_by_field_name
 
 FieldEmbedding = namedtuple(
     'FieldEmbedding',
-    ['encoder', 'embedding_size', 'fields'],
+    ['encoder', 'embedding_size', 'fields', 'quantization'],
+    defaults=[None],
 )
 
 Executor = get_auth_executor_class()
 
 TIMEOUT = 60
 
+# `int8_hnsw` index options are supported since this Elasticsearch version
+INT8_HNSW_MIN_VERSION = (8, 12)
+
+# key of the original index settings during a bulk load in the `_meta` of the index mapping
+BULK_LOAD_META_KEY = 'bulk_load'
+
+# the health check at startup is retried with exponential backoff up to this delay in seconds
+MAX_HEALTH_CHECK_BACKOFF = 30
+
+RETRIEVAL_MODES = ['script_score', 'knn', 'two_stage']
+
+EMBEDDING_AGGREGATIONS = ['mean', 'max', 'weighted']
+
+# search parameters which change the results and are therefore part of the result cache key
+RESULT_CACHE_PARAMETERS = [
+    'document_id',
+    'filter',
+    'get_score_breakdown',
+    'retrieval_mode',
+    'knn_k',
+    'knn_num_candidates',
+    'rescore_window',
+    'rescore_quantized',
+    'fields',
+    'facets',
+    'facet_size',
+]
+
+TAG_AGGREGATION_SIZE = 100
+
+# tag fields which can be aggregated by their type and the suffix of the aggregated field
+TAG_AGGREGATION_FIELD_SUFFIXES = {
+    'text': '.keyword',
+    'keyword': '',
+    'float': '',
+    'double': '',
+    'long': '',
+    'integer': '',
+    'boolean': '',
+    'date': '',
+}
+
+# Elasticsearch types of the filter fields by the type detected in the schema, other
+# filter fields are mapped as keyword. Numeric and date fields are indexed in BKD trees,
+# which serve range filters efficiently. The type is detected from a single value, so all
+# numbers are mapped as double, otherwise a field whose first value is `10` would truncate `12.99`.
+FILTER_FIELD_TYPE_TO_ES_TYPE = {
+    'int': 'double',
+    'float': 'double',
+    'bool': 'boolean',
+    'date': 'date',
+}
+# a malformed value of a filter field of these types, e.g. 'N/A' in a numeric tag, is not indexed
+# instead of failing the whole bulk request. Booleans do not support `ignore_malformed`, their
+# values are coerced when the documents are converted
+IGNORE_MALFORMED_TYPES = ['float', 'double', 'long', 'integer', 'date']
+
+# maximum number of documents pinned by one filter of a curated query
+CURATED_IDS_PER_FILTER = 100
+
+# the curation rules are stored in the index with this suffix, such that all replicas share them
+CURATION_INDEX_SUFFIX = '-curation'
+CURATION_INDEX_MAPPING = {
+    'properties': {
+        'query': {'type': 'keyword'},
+        # the filters are only stored, since they have arbitrary fields
+        'filters': {'type': 'object', 'enabled': False},
+    }
+}
+# every change of the curation rules re-indexes this empty document, its `_version` tells the
+# replicas whether they need to reload the rules
+CURATION_VERSION_ID = 'version'
+
+# the fitted projections are stored in the index with this suffix, one document per encoder
+PROJECTION_INDEX_SUFFIX = '-projections'
+PROJECTION_INDEX_MAPPING = {
+    'properties': {
+        'method': {'type': 'keyword'},
+        'dims': {'type': 'integer'},
+        'matrix': {'type': 'binary'},
+    }
+}
+# until the projections are fitted, indexed documents are staged in the index with this suffix,
+# one document per request with the number of its embeddings per encoder
+PROJECTION_SAMPLE_INDEX_SUFFIX = '-projection-samples'
+PROJECTION_SAMPLE_INDEX_MAPPING = {
+    'properties': {
+        # the serialized documents per encoder are only stored
+        'docs': {'type': 'object', 'enabled': False},
+        'num_embeddings': {'type': 'object'},
+    }
+}
+
+LIST_KEEP_ALIVE = '5m'
+
 
 class NOWElasticIndexer(Executor):
     """
@@ -46,56 +179,296 @@ class NOWElasticIndexer(Executor):
 
     def __init__(
         self,
-        document_mappings: List[Tuple[str, int, List[str]]],
+        document_mappings: List[Tuple[str, int, List[str], Optional[str]]],
         metric: str = 'cosine',
         limit: int = 10,
         max_values_per_tag: int = 10,
         es_mapping: Dict = None,
         es_config: Optional[Dict[str, Any]] = None,
+        retrieval_mode: str = 'script_score',
+        knn_k: Optional[int] = None,
+        knn_num_candidates: int = 100,
+        rescore_window: int = 100,
+        bulk_chunk_size: int = 500,
+        bulk_max_chunk_bytes: int = 100 * 1024 * 1024,
+        bulk_thread_count: int = 1,
+        tags_max_staleness: float = 600,
+        filter_field_types: Optional[Dict[str, str]] = None,
+        curation_check_interval: float = 1,
+        blob_store: Optional[Dict] = None,
+        exclude_embeddings_from_source: bool = False,
+        normalize_embeddings: bool = False,
+        rescore_quantized: bool = False,
+        projections: Optional[Dict[str, Dict]] = None,
+        embedding_aggregation: str = 'mean',
+        result_cache_size: int = 0,
+        result_cache_max_bytes: int = 64 * 1024 * 1024,
+        result_cache_ttl: float = 300,
+        async_client: bool = False,
+        es_connections_per_node: int = 10,
+        health_check_timeout: float = 300,
+        search_timeout: Optional[float] = None,
+        bulk_timeout: Optional[float] = None,
+        circuit_breaker_failure_threshold: int = 5,
+        circuit_breaker_reset_timeout: float = 30,
         *args,
         **kwargs,
     ):
         """
         :param document_mappings: list of FieldEmbedding tuples that define which encoder
-            encodes which fields, and the embedding size of the encoder.
+            encodes which fields, the embedding size of the encoder and optionally the quantization
+            of its embedding fields. With `byte` quantization, the vector index stores the embeddings
+            as bytes and the original embeddings are stored in a field that is not indexed, which
+            scripts use for exact scores. `int8_hnsw` lets Elasticsearch quantize the vector index
+            and requires Elasticsearch 8.12 or later.
         :param metric: Distance metric type. Can be 'euclidean', 'inner_product', or 'cosine'
         :param limit: Number of results to get for each query document in search
-        :param max_values_per_tag: Maximum number of values per tag
+        :param max_values_per_tag: Maximum number of values per tag, which are returned as facets
+            by default
         :param es_mapping: Mapping for new index. If none is specified, this will be
             generated from `document_mappings` and `metric`.
         :param hosts: host configuration of the Elasticsearch node or cluster
         :param es_config: Elasticsearch cluster configuration object
         :param index_name: ElasticSearch Index name used for the storage
+        :param retrieval_mode: How documents are retrieved in search. 'script_score' scores
+            every document exactly, 'knn' uses the approximate kNN (HNSW) index of the
+            embedding fields and 'two_stage' scores the kNN and bm25 candidates exactly.
+        :param knn_k: Number of nearest neighbours retrieved per embedding field in 'knn'
+            mode. Defaults to the search limit.
+        :param knn_num_candidates: Number of candidates considered per shard in 'knn' mode.
+        :param rescore_window: Number of candidates retrieved per score calculation term in
+            the first stage of 'two_stage' mode.
+        :param bulk_chunk_size: Number of documents sent to Elasticsearch in one bulk request.
+        :param bulk_max_chunk_bytes: Maximum size of one bulk request in bytes.
+        :param bulk_thread_count: Number of threads sending bulk requests in parallel.
+        :param tags_max_staleness: Maximum time in seconds between two aggregations of the tag
+            values over the whole index. In between, tag values of newly indexed documents are
+            added incrementally. Deleting documents always triggers an aggregation.
+        :param filter_field_types: Maps filter fields to their Elasticsearch type, e.g.
+            `{'stock': 'long'}`, instead of the type detected from a sampled value.
+        :param curation_check_interval: Minimum time in seconds between two checks whether another
+            replica changed the curation rules. The check is done before searches.
+        :param blob_store: If given, blobs of the documents, e.g. thumbnails and video frames,
+            are stored in this blob store instead of Elasticsearch. Either
+            `{'type': 'local', 'path': ...}` with a directory shared by all replicas, or
+            `{'type': 's3', 'bucket': ..., 'prefix': ..., 'endpoint_url': ...}`.
+        :param exclude_embeddings_from_source: If true, the embeddings are only stored in the
+            vector index, but not in the `_source` of new indices. The score breakdown is computed
+            from the vector index in any case.
+        :param normalize_embeddings: If true, embeddings are L2-normalized when they are indexed
+            and the embedding fields use the `dot_product` similarity, which gives the same results
+            as `cosine`. Only valid for the `cosine` metric. Existing `cosine` indices keep their
+            similarity until they are migrated with `/admin/normalizeEmbeddings`.
+        :param rescore_quantized: If true, the kNN candidates in 'knn' mode are rescored with the
+            original embeddings if an encoder uses `byte` quantization, as in 'two_stage' mode.
+        :param projections: Maps encoder to the configuration of a projection of its embeddings
+            to fewer dimensions, e.g. `{'clip': {'method': 'pca', 'dims': 128, 'num_samples': 1000}}`.
+            The projection is applied to the embeddings of indexed and query documents. The methods
+            are 'pca' and the seeded 'random_projection', which only depends on the dimensions. PCA is
+            fitted once `num_samples` embeddings are indexed, or on the indexed embeddings at
+            `/bulk_load/end`, and then stored in Elasticsearch for all replicas. Until then, the
+            indexed documents are staged and can not be searched yet.
+        :param embedding_aggregation: How the embeddings of the sentences or frames of a field are
+            aggregated into the embedding of the field. 'mean', 'max' for max-pooling, or 'weighted'
+            for the mean weighted by the `weight` of the sentence or frame documents.
+        :param result_cache_size: Maximum number of search results kept in an in-process cache.
+            The cache is disabled by default. Cached results are invalidated when this replica
+            indexes, deletes or curates documents, changes by other replicas only after `result_cache_ttl`.
+        :param result_cache_max_bytes: Maximum total size of the cached search results in bytes.
+        :param result_cache_ttl: Time in seconds after which a cached search result expires.
+        :param async_client: If true, `/search` and `/index` requests are sent with the
+            `AsyncElasticsearch` client on the event loop, such that searches run concurrently with
+            each other and with ingestion. Otherwise, they are sent with the synchronous client in
+            a worker thread.
+        :param es_connections_per_node: Size of the connection pool to each Elasticsearch node,
+            which bounds the number of concurrent requests. Can be overridden in `es_config`.
+        :param health_check_timeout: Maximum time in seconds to wait for Elasticsearch at startup.
+            The health check is retried with exponential backoff.
+        :param search_timeout: Timeout in seconds of the search requests and of the check of the
+            curation rules before them. Defaults to the request timeout of the client, which can be
+            set in `es_config`.
+        :param bulk_timeout: Timeout in seconds of the bulk requests when indexing and of the check
+            of the bulk load and the refresh after them. Defaults to the request timeout of the client.
+        :param circuit_breaker_failure_threshold: Number of consecutive failed requests of searches
+            and index requests, including the checks of the curation rules and of the bulk load
+            before them, after which requests fail immediately, until Elasticsearch recovers.
+        :param circuit_breaker_reset_timeout: Time in seconds after which a trial request is sent
+            to Elasticsearch while the circuit breaker is open.
         """
 
         super().__init__(*args, **kwargs)
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(
+                f'Invalid retrieval mode {retrieval_mode}. Choose one of {RETRIEVAL_MODES}'
+            )
+        if normalize_embeddings and metric != 'cosine':
+            raise ValueError('Embeddings can only be normalized for the cosine metric')
+        if embedding_aggregation not in EMBEDDING_AGGREGATIONS:
+            raise ValueError(
+                f'Invalid embedding aggregation {embedding_aggregation}. Choose one of {EMBEDDING_AGGREGATIONS}'
+            )
+        self.embedding_aggregation = embedding_aggregation
         self.metric = metric
+        self.normalize_embeddings = normalize_embeddings
+        # the similarity of the embedding fields in the index
+        self.similarity = 'dot_product' if normalize_embeddings else metric
+        self.retrieval_mode = retrieval_mode
+        self.knn_k = knn_k
+        self.knn_num_candidates = knn_num_candidates
+        self.rescore_window = rescore_window
+        self.bulk_chunk_size = bulk_chunk_size
+        self.bulk_max_chunk_bytes = bulk_max_chunk_bytes
+        self.bulk_thread_count = bulk_thread_count
         self.limit = limit
         self.max_values_per_tag = max_values_per_tag
+        self.filter_field_types = filter_field_types or {}
+        for field, es_type in self.filter_field_types.items():
+            if es_type not in TAG_AGGREGATION_FIELD_SUFFIXES or es_type == 'text':
+                raise ValueError(
+                    f'Invalid type {es_type} of filter field {field}. Choose one of '
+                    f'{[t for t in TAG_AGGREGATION_FIELD_SUFFIXES if t != "text"]}'
+                )
         self._check_env_vars()
         self.hosts = os.getenv('ES_HOSTS', 'http://localhost:9200')
         self.api_key = os.getenv('ES_API_KEY', 'TestApiKey')
         self.index_name = os.getenv('ES_INDEX_NAME', 'now-index')
         self.query_to_curated_ids = {}
+        # the filters of each curated query and the IDs of the documents pinned by each filter
+        self.query_to_filters = {}
+        self.query_to_filter_ids = {}
+        self.curation_version = None
+        # `/index` and `/search` run concurrently in worker threads, this lock guards the index
+        # generation, the tag values, the curation state and the script statistics
+        self._state_lock = RLock()
+        # guards fitting and loading the projections
+        self._projection_lock = Lock()
+        self.curation_check_interval = curation_check_interval
+        self.curation_checked_at = 0.0
         self.doc_id_tags = {}
+        # bumped whenever the index or the curation changes, which invalidates cached results
+        self.index_generation = 0
+        self.result_cache = (
+            ResultCache(result_cache_size, result_cache_max_bytes, result_cache_ttl)
+            if result_cache_size > 0
+            else None
+        )
+        self.tags_max_staleness = tags_max_staleness
+        self.tags_aggregated_at = 0.0
         self.document_mappings = [FieldEmbedding(*dm) for dm in document_mappings]
+        self.encoder_to_quantization = {
+            document_mapping.encoder: document_mapping.quantization
+            for document_mapping in self.document_mappings
+            if document_mapping.quantization
+        }
+        for quantization in self.encoder_to_quantization.values():
+            if quantization not in QUANTIZATION_MODES:
+                raise ValueError(
+                    f'Invalid quantization {quantization}. Choose one of {QUANTIZATION_MODES}'
+                )
+            if quantization == 'byte' and metric != 'cosine':
+                raise ValueError('Byte quantization requires the cosine metric')
+        self.rescore_quantized = rescore_quantized
+        self.projections = create_projections(projections)
+        for dm in self.document_mappings:
+            projection = self.projections.get(dm.encoder, None)
+            if projection is not None and projection.method == 'random_projection':
+                projection.fit_random_projection(dm.embedding_size)
         self.encoder_to_fields = {
             document_mapping.encoder: document_mapping.fields
             for document_mapping in self.document_mappings
         }
         self.es_config = es_config or {'verify_certs': False}
+        self.blob_store = create_blob_store(blob_store)
         self.es_mapping = es_mapping or self.generate_es_mapping()
-        self.es = Elasticsearch(
-            hosts=self.hosts,
-            api_key=self.api_key,
+        # the serialized document is only stored, but not indexed
+        self.es_mapping.setdefault('properties', {}).setdefault(
+            SERIALIZED_DOC_FIELD, {'type': 'binary'}
+        )
+        if exclude_embeddings_from_source:
+            self.es_mapping['_source'] = {'excludes': self._get_embedding_fields()}
+        if normalize_embeddings:
+            self.es_mapping = self._get_mapping_with_similarity(
+                self.es_mapping, self.similarity
+            )
+        es_client_config = {
+            'hosts': self.hosts,
+            'api_key': self.api_key,
+            'connections_per_node': es_connections_per_node,
             **self.es_config,
-            ssl_show_warn=False,
+            'ssl_show_warn': False,
+        }
+        self.es = Elasticsearch(**es_client_config)
+        # the sync client is still used for the setup and the administrative endpoints
+        self.async_es = AsyncElasticsearch(**es_client_config) if async_client else None
+        self.search_timeout = search_timeout
+        self.bulk_timeout = bulk_timeout
+        self.circuit_breaker = CircuitBreaker(
+            failure_threshold=circuit_breaker_failure_threshold,
+            reset_timeout=circuit_breaker_reset_timeout,
+            is_failure=is_es_unavailable,
         )
-        self._do_health_check()
+        self._do_health_check(health_check_timeout)
+        self._check_server_version()
         if not self.es.indices.exists(index=self.index_name):
             self.es.indices.create(index=self.index_name, mappings=self.es_mapping)
         else:
-            self.es.indices.put_mapping(index=self.index_name, body=self.es_mapping)
+            index_similarity = self._get_index_similarity()
+            if index_similarity and index_similarity != self.similarity:
+                self.logger.warning(
+                    f'The embedding fields of index {self.index_name} use the {index_similarity} '
+                    f'similarity, migrate the index with /admin/normalizeEmbeddings to use {self.similarity}'
+                )
+                self.similarity = index_similarity
+            self._keep_existing_tag_types()
+            # the `_source` and the similarity of an existing index can not be changed
+            self.es.indices.put_mapping(
+                index=self.index_name,
+                body=self._get_mapping_with_similarity(
+                    {k: v for k, v in self.es_mapping.items() if k != '_source'},
+                    self.similarity,
+                ),
+            )
+        self._put_stored_scripts()
+        self.projection_index_name = f'{self.index_name}{PROJECTION_INDEX_SUFFIX}'
+        self.projection_sample_index_name = (
+            f'{self.index_name}{PROJECTION_SAMPLE_INDEX_SUFFIX}'
+        )
+        if self.projections:
+            for index_name, mappings in [
+                (self.projection_index_name, PROJECTION_INDEX_MAPPING),
+                (self.projection_sample_index_name, PROJECTION_SAMPLE_INDEX_MAPPING),
+            ]:
+                if not self.es.indices.exists(index=index_name):
+                    self.es.indices.create(index=index_name, mappings=mappings)
+        self._load_projections()
+        self.curation_index_name = f'{self.index_name}{CURATION_INDEX_SUFFIX}'
+        if not self.es.indices.exists(index=self.curation_index_name):
+            self.es.indices.create(
+                index=self.curation_index_name, mappings=CURATION_INDEX_MAPPING
+            )
+        self.maybe_reload_curation_rules()
+        self.logger.info(f'Vector configuration: {self.get_vector_config()}')
+
+    def _keep_existing_tag_types(self):
+        """The type of a field can not be changed, so tags which are already mapped in the
+        existing index, e.g. as keyword before typed tag mappings, keep their type."""
+        existing_tags = (
+            self._get_index_mappings()
+            .get('properties', {})
+            .get('tags', {})
+            .get('properties', {})
+        )
+        tags = (
+            self.es_mapping.get('properties', {}).get('tags', {}).get('properties', {})
+        )
+        for tag, tag_mapping in tags.items():
+            existing_type = existing_tags.get(tag, {}).get('type', None)
+            if existing_type and existing_type != tag_mapping.get('type', None):
+                self.logger.warning(
+                    f'Tag {tag} keeps the type {existing_type} of index {self.index_name}, '
+                    f'reindex to map it as {tag_mapping.get("type", None)}'
+                )
+                tags[tag] = existing_tags[tag]
 
     def _check_env_vars(self):
         while not all(
@@ -112,21 +485,100 @@ class NOWElasticIndexer(Executor):
                 )
                 raise Exception('Elasticsearch environment variables not set')
 
-    def _do_health_check(self):
-        """Checks that Elasticsearch is up and running with state 'yellow'. The default timeout
-        on the health check is 30 seconds."""
+    def _do_health_check(self, timeout: float):
+        """Checks that Elasticsearch is up and running with state 'yellow'. Failed checks are
+        retried with exponential backoff until `timeout` seconds have passed."""
+        deadline = time() + timeout
+        backoff = 1
         while True:
             try:
                 self.es.cluster.health(wait_for_status='yellow')
-                break
-            except Exception:
-                self.logger.info(traceback.format_exc())
+                return
+            except Exception as e:
+                remaining = deadline - time()
+                if remaining <= 0:
+                    raise RuntimeError(
+                        f'Elasticsearch is not healthy after {timeout} seconds'
+                    ) from e
+                delay = min(backoff, remaining)
+                self.logger.info(
+                    f'Elasticsearch is not healthy yet ({e!r}), retrying in {delay:.0f} seconds'
+                )
+                sleep(delay)
+                backoff = min(backoff * 2, MAX_HEALTH_CHECK_BACKOFF)
+
+    def _bump_index_generation(self):
+        with self._state_lock:
+            self.index_generation += 1
+
+    def _get_curated_queries(self) -> List[str]:
+        with self._state_lock:
+            return list(self.query_to_filters)
+
+    def _check_server_version(self):
+        """Checks that the Elasticsearch cluster supports the quantization of the encoders, such
+        that the indexer fails at startup instead of with a bad request to create the index."""
+        if 'int8_hnsw' not in self.encoder_to_quantization.values():
+            return
+        version = self.es.info()['version']['number']
+        if tuple(int(v) for v in version.split('.')[:2]) < INT8_HNSW_MIN_VERSION:
+            raise ValueError(
+                f'int8_hnsw quantization requires Elasticsearch '
+                f'{".".join(map(str, INT8_HNSW_MIN_VERSION))} or later, but the cluster runs {version}'
+            )
+
+    def close(self):
+        """Closes the connections of the Elasticsearch clients when the executor shuts down."""
+        if self.async_es is not None:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                # no event loop is running anymore
+                asyncio.run(self.async_es.close())
+            else:
+                # Jina closes the executor synchronously on its running event loop, which can't
+                # await the close without blocking itself, so a worker thread awaits it
+                with ThreadPoolExecutor(max_workers=1) as pool:
+                    pool.submit(asyncio.run, self.async_es.close()).result()
+        self.es.close()
+        super().close()
+
+    def _get_client(self, client, timeout: Optional[float]):
+        """Returns the client with the request timeout of an operation, if it is configured."""
+        return client.options(request_timeout=timeout) if timeout else client
+
+    def _put_stored_scripts(self):
+        """Registers the score scripts as stored scripts, such that Elasticsearch compiles them
+        only once instead of compiling a new script source for every query."""
+        for script_id, source in stored_scripts.items():
+            self.es.put_script(
+                id=script_id, script={'lang': 'painless', 'source': source}
+            )
+        self.num_stored_script_queries = 0
+        self.script_compilations_at_start = self._get_script_compilations()
+
+    def _get_script_compilations(self) -> int:
+        """Returns the number of compilations of score scripts on all Elasticsearch nodes. The
+        compilations of other script contexts, e.g. ingest or update scripts, are not counted, if
+        the nodes report them per context."""
+        node_stats = self.es.nodes.stats(metric='script')['nodes']
+        compilations = 0
+        for node in node_stats.values():
+            context_compilations = {
+                context['context']: context['compilations']
+                for context in node['script'].get('contexts', [])
+            }
+            compilations += context_compilations.get(
+                'score', node['script']['compilations']
+            )
+        return compilations
 
     def generate_es_mapping(self) -> Dict:
         """Creates Elasticsearch mapping for the defined document fields."""
         es_mapping = {
             'properties': {
                 'id': {'type': 'keyword'},
+                SERIALIZED_DOC_FIELD: {'type': 'binary'},
             }
         }
 
@@ -139,31 +591,338 @@ class NOWElasticIndexer(Executor):
         if self.user_input.filter_fields:
             es_mapping['properties']['tags'] = {'type': 'object', 'properties': {}}
             for field in self.user_input.filter_fields:
-                es_mapping['properties']['tags']['properties'][field] = {
-                    'type': 'keyword'
-                }
+                field_type = (
+                    self.user_input.filter_field_candidates_to_modalities or {}
+                ).get(field, None)
+                es_type = self.filter_field_types.get(
+                    field, FILTER_FIELD_TYPE_TO_ES_TYPE.get(field_type, 'keyword')
+                )
+                field_mapping = {'type': es_type}
+                if es_type in IGNORE_MALFORMED_TYPES:
+                    field_mapping['ignore_malformed'] = True
+                es_mapping['properties']['tags']['properties'][field] = field_mapping
 
-        for encoder, embedding_size, fields in self.document_mappings:
+        for encoder, embedding_size, fields, quantization in self.document_mappings:
+            if encoder in self.projections:
+                embedding_size = self.projections[encoder].dims
             for field in fields:
-                es_mapping['properties'][f'{field}-{encoder}'] = {
-                    'properties': {
-                        f'embedding': {
-                            'type': 'dense_vector',
-                            'dims': str(embedding_size),
-                            'similarity': self.metric,
-                            'index': 'true',
-                        }
+                embedding_mapping = {
+                    'type': 'dense_vector',
+                    'dims': str(embedding_size),
+                    'similarity': self.similarity,
+                    'index': 'true',
+                }
+                field_mapping = {'embedding': embedding_mapping}
+                if quantization == 'byte':
+                    # byte vectors are scaled, so only the cosine similarity is meaningful for them
+                    embedding_mapping['element_type'] = 'byte'
+                    embedding_mapping['similarity'] = 'cosine'
+                    field_mapping[FULL_PRECISION_EMBEDDING] = {
+                        'type': 'dense_vector',
+                        'dims': str(embedding_size),
+                        'index': 'false',
                     }
+                elif quantization == 'int8_hnsw':
+                    embedding_mapping['index_options'] = {'type': 'int8_hnsw'}
+                es_mapping['properties'][f'{field}-{encoder}'] = {
+                    'properties': field_mapping
                 }
         return es_mapping
 
+    def _get_mapping_with_similarity(self, es_mapping: Dict, similarity: str) -> Dict:
+        """Returns a copy of the mapping where all float embedding fields use the given similarity."""
+        es_mapping = deepcopy(es_mapping)
+        for embedding_field in self._get_embedding_fields(quantized=False):
+            field, _ = embedding_field.rsplit('.', 1)
+            embedding_mapping = (
+                es_mapping.get('properties', {})
+                .get(field, {})
+                .get('properties', {})
+                .get('embedding', None)
+            )
+            if embedding_mapping is not None and 'similarity' in embedding_mapping:
+                embedding_mapping['similarity'] = similarity
+        return es_mapping
+
+    def _get_index_mappings(self, es: Optional[Elasticsearch] = None) -> Dict:
+        """Returns the mappings of the index. After a migration, the index name is an alias of a
+        versioned index, so the response is keyed by the name of the versioned index."""
+        mapping = (es or self.es).indices.get_mapping(index=self.index_name)
+        return next(iter(mapping.values()))['mappings']
+
+    def _get_index_similarity(self) -> Optional[str]:
+        """Returns the similarity of the float embedding fields of the existing index, or `None` if
+        the index has no such fields yet."""
+        properties = self._get_index_mappings().get('properties', {})
+        for embedding_field in self._get_embedding_fields(quantized=False):
+            field, _ = embedding_field.rsplit('.', 1)
+            embedding_mapping = (
+                properties.get(field, {}).get('properties', {}).get('embedding', None)
+            )
+            if embedding_mapping is not None and 'similarity' in embedding_mapping:
+                return embedding_mapping['similarity']
+        return None
+
+    @secure_request(on='/admin/normalizeEmbeddings', level=SecurityLevel.ADMIN)
+    def migrate_to_normalized_embeddings(self, **kwargs):
+        """
+        Endpoint to migrate an existing `cosine` index to normalized embeddings and the
+        `dot_product` similarity. Since the similarity of a field can not be changed, the documents
+        are reindexed with normalized embeddings into a new versioned index, e.g. `<index>-v1`.
+        Only if it holds as many documents as the existing index, the index name is atomically
+        switched to an alias of the new index and the existing index is deleted. Searches use the
+        existing index until then, and a failed migration leaves it unchanged.
+        Note, that the embeddings must be stored in the `_source` of the existing index and that
+        documents indexed during the migration fail the document count check. With
+        `exclude_embeddings_from_source`, they are only excluded from the `_source` of the new index.
+        """
+        if not self.normalize_embeddings:
+            raise ValueError('The indexer is not configured to normalize embeddings')
+        if self.similarity == 'dot_product':
+            return DocumentArray(
+                [Document(text='normalize_embeddings', tags={'migrated': 0})]
+            )
+        mappings = self._get_index_mappings()
+        if mappings.get('_source', {}).get('excludes', None):
+            raise ValueError(
+                f'The embeddings of index {self.index_name} are not stored in the _source, '
+                f'the documents need to be indexed again'
+            )
+        es = self.es.options(request_timeout=3600)
+        source_index_name = next(iter(es.indices.get_alias(index=self.index_name)))
+        version_match = re.fullmatch(
+            rf'{re.escape(self.index_name)}-v(\d+)', source_index_name
+        )
+        version = int(version_match.group(1)) + 1 if version_match else 1
+        target_index_name = f'{self.index_name}-v{version}'
+        if es.indices.exists(index=target_index_name):
+            # left over from a failed migration, it is not used by the alias
+            es.indices.delete(index=target_index_name)
+        # the state of a bulk load in the `_meta` is kept
+        es.indices.create(
+            index=target_index_name,
+            mappings={**self.es_mapping, '_meta': mappings.get('_meta', {})},
+        )
+        es.reindex(
+            source={'index': source_index_name},
+            dest={'index': target_index_name},
+            script={
+                'lang': 'painless',
+                'source': NORMALIZE_EMBEDDINGS_SCRIPT,
+                'params': {'fields': self._get_embedding_fields(quantized=False)},
+            },
+            refresh=True,
+            wait_for_completion=True,
+        )
+        es.indices.refresh(index=source_index_name)
+        num_docs = es.count(index=source_index_name)['count']
+        if es.count(index=target_index_name)['count'] != num_docs:
+            es.indices.delete(index=target_index_name)
+            raise RuntimeError(
+                f'Reindexing {self.index_name} into {target_index_name} failed, '
+                f'the index is not changed'
+            )
+        actions = [{'add': {'index': target_index_name, 'alias': self.index_name}}]
+        if source_index_name == self.index_name:
+            # the index is replaced by an alias with its name in the same atomic operation
+            actions.append({'remove_index': {'index': source_index_name}})
+        else:
+            actions.append(
+                {'remove': {'index': source_index_name, 'alias': self.index_name}}
+            )
+        es.indices.update_aliases(actions=actions)
+        if source_index_name != self.index_name:
+            es.indices.delete(index=source_index_name)
+        self.similarity = 'dot_product'
+        self._bump_index_generation()
+        self.update_tags()
+        self.logger.info(
+            f'Migrated {num_docs} documents of index {self.index_name} to normalized embeddings'
+        )
+        return DocumentArray(
+            [Document(text='normalize_embeddings', tags={'migrated': num_docs})]
+        )
+
+    def _has_unfitted_projections(self) -> bool:
+        return any(not projection.is_fitted for projection in self.projections.values())
+
+    def _load_projections(self):
+        """Loads the projections which are not fitted yet from Elasticsearch, e.g. after another
+        replica fitted them."""
+        for encoder, projection in self.projections.items():
+            if projection.is_fitted:
+                continue
+            try:
+                with self.circuit_breaker:
+                    stored = self._get_client(self.es, self.search_timeout).get(
+                        index=self.projection_index_name, id=encoder
+                    )['_source']
+            except NotFoundError:
+                continue
+            if (
+                stored['method'] != projection.method
+                or stored['dims'] != projection.dims
+            ):
+                raise ValueError(
+                    f'The {stored["method"]} projection of encoder {encoder} to {stored["dims"]} '
+                    f'dimensions is stored, it can not be changed to the configured '
+                    f'{projection.method} projection to {projection.dims} dimensions'
+                )
+            projection.from_bytes(base64.b64decode(stored['matrix']))
+
+    def _load_projections_locked(self):
+        with self._projection_lock:
+            self._load_projections()
+
+    def _stage_docs(self, docs_map: Dict[str, DocumentArray]):
+        """Stages the documents of an index request until the projections are fitted, such that
+        all replicas fit them on the same sample."""
+        self.es.index(
+            index=self.projection_sample_index_name,
+            document={
+                'docs': {
+                    encoder: docs.to_base64(protocol='protobuf', compress='zlib')
+                    for encoder, docs in docs_map.items()
+                },
+                'num_embeddings': {
+                    encoder: sum(
+                        c.embedding is not None for doc in docs for c in doc.chunks
+                    )
+                    for encoder, docs in docs_map.items()
+                },
+            },
+            refresh=True,
+        )
+
+    def _iter_staged_docs(self) -> Iterable[Tuple[str, Dict[str, DocumentArray]]]:
+        for hit in scan(
+            self.es, index=self.projection_sample_index_name, query={'match_all': {}}
+        ):
+            yield hit['_id'], {
+                encoder: DocumentArray.from_base64(
+                    docs, protocol='protobuf', compress='zlib'
+                )
+                for encoder, docs in hit['_source']['docs'].items()
+            }
+
+    def _fit_projections(self, min_samples: bool = True):
+        """Fits the projections which are not fitted yet on the embeddings of the staged documents,
+        stores them for all replicas and indexes the staged documents. Must be called with the
+        projection lock held.
+
+        :param min_samples: if true, the projections are only fitted once `num_samples` embeddings
+            of each encoder are staged, otherwise on all staged embeddings.
+        """
+        unfitted_encoders = [
+            encoder
+            for encoder, projection in self.projections.items()
+            if not projection.is_fitted
+        ]
+        if unfitted_encoders:
+            num_embeddings = self.es.search(
+                index=self.projection_sample_index_name,
+                size=0,
+                aggs={
+                    encoder: {'sum': {'field': f'num_embeddings.{encoder}'}}
+                    for encoder in unfitted_encoders
+                },
+            )['aggregations']
+            for encoder in unfitted_encoders:
+                num_staged = num_embeddings[encoder]['value']
+                if num_staged == 0 or (
+                    min_samples and num_staged < self.projections[encoder].num_samples
+                ):
+                    return
+            if self.es.count(index=self.index_name)['count'] > 0:
+                # a new projection would not match the embeddings in the index
+                raise RuntimeError(
+                    f'The projections of encoders {unfitted_encoders} are not stored in '
+                    f'{self.projection_index_name}, but index {self.index_name} is not empty'
+                )
+            embeddings = {encoder: [] for encoder in unfitted_encoders}
+            for _, docs_map in self._iter_staged_docs():
+                for encoder in unfitted_encoders:
+                    embeddings[encoder].extend(
+                        c.embedding
+                        for doc in docs_map.get(encoder, [])
+                        for c in doc.chunks
+                        if c.embedding is not None
+                    )
+            for encoder in unfitted_encoders:
+                self._fit_projection(encoder, np.stack(embeddings[encoder]))
+        self._index_staged_docs()
+
+    def _fit_projection(self, encoder: str, embeddings: np.ndarray):
+        """Fits the projection of an encoder and stores it for all replicas. The projection is only
+        fitted once for the index, if another replica stored it first, its projection is used."""
+        # the projection is fitted on a copy, such that concurrent searches only use it once stored
+        projection = deepcopy(self.projections[encoder])
+        projection.fit(embeddings)
+        try:
+            self.es.index(
+                index=self.projection_index_name,
+                id=encoder,
+                document={
+                    'method': projection.method,
+                    'dims': projection.dims,
+                    'matrix': base64.b64encode(projection.to_bytes()).decode(),
+                },
+                op_type='create',
+                refresh=True,
+            )
+            self.projections[encoder] = projection
+        except ConflictError:
+            # another replica stored its projection first
+            self._load_projections()
+
+    def _index_staged_docs(self):
+        """Projects the embeddings of the staged documents and indexes them. Staged documents are
+        only deleted once they are indexed, indexing them again on another replica is idempotent."""
+        staged_ids = []
+        staged_docs_map = {}
+        for staged_id, docs_map in self._iter_staged_docs():
+            staged_ids.append(staged_id)
+            for encoder, docs in docs_map.items():
+                staged_docs_map.setdefault(encoder, DocumentArray()).extend(docs)
+        if not staged_ids:
+            return
+        for encoder, docs in staged_docs_map.items():
+            projection = self.projections.get(encoder, None)
+            chunks = [c for doc in docs for c in doc.chunks if c.embedding is not None]
+            if projection is None or not chunks:
+                continue
+            embeddings = projection.transform(np.stack([c.embedding for c in chunks]))
+            for c, embedding in zip(chunks, embeddings):
+                c.embedding = embedding
+        self._bulk_index(staged_docs_map)
+        for staged_id in staged_ids:
+            self.es.options(ignore_status=404).delete(
+                index=self.projection_sample_index_name, id=staged_id, refresh=True
+            )
+        self.logger.info(
+            f'Indexed {len(staged_ids)} staged requests after fitting the projections'
+        )
+
     def _handle_no_docs_map(self, docs: DocumentArray):
         if docs and len(self.encoder_to_fields) == 1:
             return {list(self.encoder_to_fields.keys())[0]: docs}
         else:
             return {}
 
+    async def _run_in_thread(self, func: Callable, *args, **kwargs) -> Any:
+        """Runs a blocking function in a worker thread without blocking the event loop."""
+        return await asyncio.get_running_loop().run_in_executor(
+            None, partial(func, *args, **kwargs)
+        )
+
     @secure_request(on='/index', level=SecurityLevel.USER)
+    async def handle_index(self, **kwargs) -> DocumentArray:
+        """Endpoint to index documents, see `index`. With the async client, the documents are
+        sent with `aindex`, otherwise `index` runs in a worker thread."""
+        if self.async_es is None:
+            return await self._run_in_thread(self.index, **kwargs)
+        return await self.aindex(**kwargs)
+
     def index(
         self,
         docs_map: Dict[str, DocumentArray] = None,  # encoder to docarray
@@ -177,24 +936,220 @@ class NOWElasticIndexer(Executor):
         :param docs: DocumentArray to index
         :return: empty `DocumentArray`.
         """
+        docs_map = self._prepare_index(docs_map, docs)
+        if docs_map:
+            self._bulk_index(docs_map)
+        return DocumentArray([])
+
+    def _bulk_index(self, docs_map: Dict[str, DocumentArray]):
+        """Sends the prepared documents to Elasticsearch with the sync client."""
+        es = self._get_client(self.es, self.bulk_timeout)
+        es_docs = self._iter_es_docs(docs_map)
+        bulk_kwargs = self._get_bulk_kwargs()
+        with self.circuit_breaker:
+            if self.bulk_thread_count > 1:
+                results = parallel_bulk(
+                    es, es_docs, thread_count=self.bulk_thread_count, **bulk_kwargs
+                )
+            else:
+                results = streaming_bulk(es, es_docs, **bulk_kwargs)
+            success = sum(ok for ok, _ in results)
+        self._finish_index(docs_map, success)
+        # during a bulk load, the index is refreshed once at the end
+        if self._get_bulk_load_settings() is None:
+            self._refresh_index()
+            self.maybe_update_tags()
+            self._add_curated_ids(docs_map)
+
+    async def aindex(
+        self,
+        docs_map: Dict[str, DocumentArray] = None,
+        docs: Optional[DocumentArray] = None,
+        **kwargs,
+    ) -> DocumentArray:
+        """
+        Same as `index`, but sends the bulk requests with the async client, such that searches
+        are not blocked during ingestion. The documents are prepared in a worker thread.
+
+        :param docs_map: map of encoder to DocumentArray
+        :param docs: DocumentArray to index
+        :return: empty `DocumentArray`.
+        """
+        docs_map = await self._run_in_thread(self._prepare_index, docs_map, docs)
+        if not docs_map:
+            return DocumentArray()
+        success = 0
+        with self.circuit_breaker:
+            async for ok, _ in async_streaming_bulk(
+                self._get_client(self.async_es, self.bulk_timeout),
+                self._iter_es_docs(docs_map),
+                **self._get_bulk_kwargs(),
+            ):
+                success += ok
+        self._finish_index(docs_map, success)
+        if await self._run_in_thread(self._get_bulk_load_settings) is None:
+            with self.circuit_breaker:
+                await self._get_client(
+                    self.async_es, self.bulk_timeout
+                ).indices.refresh(index=self.index_name)
+            await self._run_in_thread(self.maybe_update_tags)
+            await self._run_in_thread(self._add_curated_ids, docs_map)
+        return DocumentArray([])
+
+    def _prepare_index(
+        self,
+        docs_map: Optional[Dict[str, DocumentArray]],
+        docs: Optional[DocumentArray],
+    ) -> Dict[str, DocumentArray]:
+        """Aggregates the embeddings of the documents to index and moves their blobs to the
+        blob store.
+
+        :return: map of encoder to the prepared DocumentArray, empty if there is nothing to index.
+        """
         if docs_map is None:
             docs_map = self._handle_no_docs_map(docs)
             if len(docs_map) == 0:
-                return DocumentArray()
-        aggregate_embeddings(docs_map)
-        es_docs = convert_doc_map_to_es(
-            docs_map, self.index_name, self.encoder_to_fields
+                return {}
+        if self._has_unfitted_projections():
+            # concurrent requests must not fit different projections
+            with self._projection_lock:
+                self._load_projections()
+                if self._has_unfitted_projections():
+                    # the embeddings are staged unprojected and projected when they are indexed
+                    aggregate_embeddings(
+                        docs_map, aggregation=self.embedding_aggregation
+                    )
+                    self._externalize_blobs(docs_map)
+                    self._stage_docs(docs_map)
+                    self._fit_projections()
+                    return {}
+        aggregate_embeddings(
+            docs_map, self.projections, aggregation=self.embedding_aggregation
         )
-        success, _ = bulk(self.es, es_docs)
-        self.es.indices.refresh(index=self.index_name)
+        self._externalize_blobs(docs_map)
+        return docs_map
+
+    def _externalize_blobs(self, docs_map: Dict[str, DocumentArray]):
+        if self.blob_store:
+            for documents in docs_map.values():
+                self.blob_store.externalize(documents)
+
+    def _iter_es_docs(self, docs_map: Dict[str, DocumentArray]) -> Iterable[Dict]:
+        return iter_doc_map_to_es(
+            docs_map,
+            self.index_name,
+            self.encoder_to_fields,
+            normalize_embeddings=self.normalize_embeddings,
+            encoder_to_quantization=self.encoder_to_quantization,
+            boolean_tags=[
+                tag
+                for tag in self.es_mapping.get('properties', {})
+                .get('tags', {})
+                .get('properties', {})
+                if self._get_tag_type(tag) == 'boolean'
+            ],
+        )
+
+    def _get_bulk_kwargs(self) -> Dict:
+        return {
+            'chunk_size': self.bulk_chunk_size,
+            'max_chunk_bytes': self.bulk_max_chunk_bytes,
+        }
+
+    def _finish_index(self, docs_map: Dict[str, DocumentArray], success: int):
         if success:
             self.logger.info(
                 f'Inserted {success} documents into Elasticsearch index {self.index_name}'
             )
+        self._bump_index_generation()
+        self.add_tags(next(iter(docs_map.values())))
+
+    @secure_request(on='/bulk_load/start', level=SecurityLevel.USER)
+    def start_bulk_load(self, **kwargs):
+        """
+        Endpoint to prepare the index for loading many documents. It disables the periodic
+        refresh and the replicas of the index and stops refreshing it after each `/index` request,
+        until `/bulk_load/end` is called.
+        The original settings are stored in the `_meta` of the index mapping, such that every
+        executor replica knows about the bulk load and any of them can end it, also after a restart.
+        """
+        meta = self._get_index_meta()
+        if BULK_LOAD_META_KEY in meta:
+            return DocumentArray()
+        index_settings = next(
+            iter(self.es.indices.get_settings(index=self.index_name).values())
+        )['settings']['index']
+        meta[BULK_LOAD_META_KEY] = {
+            'refresh_interval': index_settings.get('refresh_interval', None),
+            'number_of_replicas': index_settings.get('number_of_replicas', None),
+        }
+        self.es.indices.put_mapping(index=self.index_name, meta=meta)
+        self.es.indices.put_settings(
+            index=self.index_name,
+            settings={'index': {'refresh_interval': '-1', 'number_of_replicas': 0}},
+        )
+        self.logger.info(f'Started bulk load into index {self.index_name}')
+        return DocumentArray()
+
+    @secure_request(on='/bulk_load/end', level=SecurityLevel.USER)
+    def end_bulk_load(self, **kwargs):
+        """
+        Endpoint to finish a bulk load. It restores the refresh interval and the replicas of
+        the index and refreshes it once. Projections which are not fitted yet are fitted on the
+        staged documents, which are then indexed, also without a bulk load.
+        """
+        meta = self._get_index_meta()
+        bulk_load_settings = meta.pop(BULK_LOAD_META_KEY, None)
+        if bulk_load_settings is None:
+            self._fit_projections_on_staged_docs()
+            return DocumentArray()
+        # a refresh interval of None resets it to the Elasticsearch default
+        settings = {'refresh_interval': bulk_load_settings['refresh_interval']}
+        if bulk_load_settings['number_of_replicas'] is not None:
+            settings['number_of_replicas'] = bulk_load_settings['number_of_replicas']
+        self.es.indices.put_settings(
+            index=self.index_name, settings={'index': settings}
+        )
+        self.es.indices.put_mapping(index=self.index_name, meta=meta)
+        self.es.indices.refresh(index=self.index_name)
+        self._bump_index_generation()
         self.update_tags()
-        return DocumentArray([])
+        self._resolve_curated_ids(self._get_curated_queries())
+        self.logger.info(f'Finished bulk load into index {self.index_name}')
+        self._fit_projections_on_staged_docs()
+        return DocumentArray()
+
+    def _fit_projections_on_staged_docs(self):
+        if self.projections:
+            with self._projection_lock:
+                self._load_projections()
+                self._fit_projections(min_samples=False)
+
+    def _get_index_meta(self) -> Dict:
+        with self.circuit_breaker:
+            mappings = self._get_index_mappings(
+                self._get_client(self.es, self.bulk_timeout)
+            )
+        return mappings.get('_meta', {})
+
+    def _refresh_index(self):
+        with self.circuit_breaker:
+            self._get_client(self.es, self.bulk_timeout).indices.refresh(
+                index=self.index_name
+            )
+
+    def _get_bulk_load_settings(self) -> Optional[Dict]:
+        """Returns the original settings of the index during a bulk load, otherwise `None`."""
+        return self._get_index_meta().get(BULK_LOAD_META_KEY, None)
 
     @secure_request(on='/search', level=SecurityLevel.USER)
+    async def handle_search(self, **kwargs) -> DocumentArray:
+        """Endpoint to search documents, see `search`. With the async client, the queries are
+        sent with `asearch`, otherwise `search` runs in a worker thread."""
+        if self.async_es is None:
+            return await self._run_in_thread(self.search, **kwargs)
+        return await self.asearch(**kwargs)
+
     def search(
         self,
         docs_map: Dict[str, DocumentArray] = None,
@@ -204,6 +1159,9 @@ class NOWElasticIndexer(Executor):
     ):
         """Perform traditional bm25 + vector search.
 
+        The queries of all documents in the request are sent to Elasticsearch in a single
+        `_msearch` round-trip.
+
         Search can be performed with candidate filtering. Filters are a triplet (column,operator,value).
         More than a filter can be applied during search. Therefore, conditions for a filter are specified as a list triplets.
         Each triplet contains:
@@ -221,13 +1179,109 @@ class NOWElasticIndexer(Executor):
                 - 'score_calculation' (List[List]): list of tuples of (query_field, document_field, matching_method,
                     linear_weight) to show how to calculate the score. Note, that the matching_method is the name of the
                     encoder or `bm25`.
+                - 'retrieval_mode' (str): Overrides the retrieval mode of the indexer, 'script_score', 'knn' or
+                    'two_stage'.
+                - 'knn_k' (int): Number of nearest neighbours per embedding field in 'knn' mode.
+                - 'knn_num_candidates' (int): Number of candidates per shard in 'knn' and 'two_stage' mode.
+                - 'rescore_window' (int): Number of candidates per score calculation term which are rescored in
+                    'two_stage' mode.
+                - 'rescore_quantized' (bool): Overrides whether kNN candidates of quantized encoders are rescored.
+                - 'fields' (List[str]): If given, only these fields of the stored documents, e.g. `title` or
+                    `tags.color`, are returned in the tags of the matches instead of the full documents.
+                    Only then the stored documents are not decoded and their blobs are not loaded.
+                - 'create_temp_link' (bool): If true, blobs in an S3 blob store are returned as presigned URLs
+                    instead of being loaded.
+                - 'facets' (List[str]): Tags whose most frequent values among the results of a query are counted
+                    in the same request. The counts are returned in `tags['facets']` of the query document, as a
+                    dictionary mapping each tag to a list of `{'value': ..., 'count': ...}`.
+                - 'facet_size' (int): Maximum number of values per facet, defaults to `max_values_per_tag`.
+                - 'document_id' (str): Searches documents similar to the indexed document with this id
+                    instead of the query documents. Its stored embeddings are used as query embeddings,
+                    such that it is not encoded again. The query fields of the score calculation are the
+                    fields of the indexed document. The document itself is not returned as a match.
         :param docs: DocumentArray to search
         """
-        if docs_map is None:
-            docs_map = self._handle_no_docs_map(docs)
-            if len(docs_map) == 0:
-                return DocumentArray()
-        aggregate_embeddings(docs_map)
+        self.maybe_reload_curation_rules()
+        if self._has_unfitted_projections():
+            self._load_projections_locked()
+        results = self._run_search_requests(self._search(docs_map, parameters, docs))
+        self._finish_search(results, parameters)
+        return results
+
+    async def asearch(
+        self,
+        docs_map: Dict[str, DocumentArray] = None,
+        parameters: dict = {},
+        docs: Optional[DocumentArray] = None,
+        **kwargs,
+    ) -> DocumentArray:
+        """Same as `search`, but sends the queries with the async client, such that concurrent
+        searches do not block each other. Blobs are resolved in a worker thread.
+        """
+        if time() - self.curation_checked_at >= self.curation_check_interval:
+            await self._run_in_thread(self.maybe_reload_curation_rules)
+        if self._has_unfitted_projections():
+            await self._run_in_thread(self._load_projections_locked)
+        results = await self._arun_search_requests(
+            self._search(docs_map, parameters, docs)
+        )
+        if self.blob_store or parameters.get('create_temp_link', False):
+            await self._run_in_thread(self._finish_search, results, parameters)
+        return results
+
+    def _run_search_requests(
+        self, steps: Generator[List[Dict], List[Dict], DocumentArray]
+    ) -> DocumentArray:
+        """Runs the steps of a search, sending each multi-search it yields with the sync client."""
+        try:
+            bodies = next(steps)
+            while True:
+                bodies = steps.send(self._msearch(bodies))
+        except StopIteration as stop:
+            return stop.value
+
+    async def _arun_search_requests(
+        self, steps: Generator[List[Dict], List[Dict], DocumentArray]
+    ) -> DocumentArray:
+        """Runs the steps of a search, sending each multi-search it yields with the async client."""
+        try:
+            bodies = next(steps)
+            while True:
+                bodies = steps.send(await self._amsearch(bodies))
+        except StopIteration as stop:
+            return stop.value
+
+    def _search(
+        self,
+        docs_map: Optional[Dict[str, DocumentArray]],
+        parameters: dict,
+        docs: Optional[DocumentArray],
+    ) -> Generator[List[Dict], List[Dict], DocumentArray]:
+        """The steps of a search, independent of the Elasticsearch client. Each multi-search
+        is yielded as the list of its search bodies and the list of responses is sent back.
+
+        :return: the query documents with their matches.
+        """
+        document_id = parameters.get('document_id', None)
+        if document_id is not None:
+            # the stored embeddings are already aggregated, normalized and projected
+            docs_map = yield from self._get_stored_docs_map(document_id)
+        else:
+            if docs_map is None:
+                docs_map = self._handle_no_docs_map(docs)
+                if len(docs_map) == 0:
+                    return DocumentArray()
+            if any(
+                not self.projections[encoder].is_fitted
+                for encoder in docs_map
+                if encoder in self.projections
+            ):
+                # projections are fitted when the first documents are indexed
+                self.logger.info('Nothing indexed yet, the projections are not fitted')
+                return DocumentArray(next(iter(docs_map.values())))
+            aggregate_embeddings(
+                docs_map, self.projections, aggregation=self.embedding_aggregation
+            )
 
         filter = parameters.get('filter', {})
         limit = parameters.get('limit', self.limit)
@@ -238,32 +1292,127 @@ class NOWElasticIndexer(Executor):
                 docs_map, self.encoder_to_fields
             )
 
-        es_queries = build_es_queries(
-            docs_map=docs_map,
-            get_score_breakdown=get_score_breakdown,
-            score_calculation=score_calculation,
-            metric=self.metric,
-            filter=filter,
-            query_to_curated_ids=self.query_to_curated_ids,
+        use_cache = self.result_cache is not None and not parameters.get(
+            'create_temp_link', False
         )
-        for doc, query in es_queries:
-            result = self.es.search(
-                index=self.index_name,
-                query=query,
-                source=True,
-                size=limit,
-            )['hits']['hits']
-            doc.matches = convert_es_results_to_matches(
-                query_doc=doc,
-                es_results=result,
+        generation = self.index_generation
+        query_docs = {}
+        for da in docs_map.values():
+            for doc in da:
+                query_docs.setdefault(doc.id, doc)
+        cache_keys = {}
+        if use_cache:
+            cache_keys = self._get_result_cache_keys(
+                docs_map, parameters, limit, score_calculation
+            )
+            cached_ids = set()
+            for doc_id, cache_key in cache_keys.items():
+                cached = self.result_cache.get(cache_key, generation)
+                if cached is not None:
+                    query_docs[doc_id].matches = cached.matches
+                    if 'facets' in cached.tags:
+                        query_docs[doc_id].tags['facets'] = cached.tags['facets']
+                    cached_ids.add(doc_id)
+            # only the queries which are not cached are sent to Elasticsearch
+            docs_map = {
+                encoder: DocumentArray([d for d in da if d.id not in cached_ids])
+                for encoder, da in docs_map.items()
+            }
+            docs_map = {encoder: da for encoder, da in docs_map.items() if len(da)}
+            for doc_id in cached_ids:
+                cache_keys.pop(doc_id)
+        if docs_map:
+            yield from self._search_matches(
+                docs_map=docs_map,
+                parameters=parameters,
+                filter=filter,
+                # the indexed document is its own best match and is removed below
+                limit=limit if document_id is None else limit + 1,
                 get_score_breakdown=get_score_breakdown,
-                metric=self.metric,
                 score_calculation=score_calculation,
             )
-            doc.tags.pop('embeddings')
+        results = DocumentArray(list(query_docs.values()))
+        for doc in results:
+            if document_id is not None:
+                doc.matches = DocumentArray(
+                    [m for m in doc.matches if m.id != document_id][:limit]
+                )
+            doc.tags.pop('embeddings', None)
             for c in doc.chunks:
                 c.embedding = None
-        results = DocumentArray(list(zip(*es_queries))[0])
+        for doc_id, cache_key in cache_keys.items():
+            doc = query_docs[doc_id]
+            self.result_cache.put(
+                cache_key,
+                Document(
+                    matches=doc.matches,
+                    tags={k: v for k, v in doc.tags.items() if k == 'facets'},
+                ),
+                generation,
+            )
+        return results
+
+    def _get_stored_docs_map(
+        self, document_id: str
+    ) -> Generator[List[Dict], List[Dict], Dict[str, DocumentArray]]:
+        """Loads an indexed document with the stored embeddings of its fields. The embeddings are
+        read from the doc values by script fields, so they are also loaded if they are excluded
+        from the `_source`.
+
+        :param document_id: id of the indexed document.
+        :return: dictionary mapping encoder to the document with the embeddings of that encoder.
+        """
+        embedding_fields = {
+            (encoder, field): get_scoring_embedding_field(
+                field, encoder, self.encoder_to_quantization
+            )
+            for encoder, fields in self.encoder_to_fields.items()
+            for field in fields
+        }
+        responses = yield [
+            {
+                'query': {'ids': {'values': [document_id]}},
+                'size': 1,
+                '_source': self._get_source_filter(),
+                'script_fields': {
+                    es_field: {
+                        'script': {
+                            'id': vector_script_id,
+                            'params': {'field': es_field},
+                        }
+                    }
+                    for es_field in embedding_fields.values()
+                },
+            }
+        ]
+        hits = responses[0]['hits']['hits']
+        if not hits:
+            raise ValueError(f'No document with id {document_id} is indexed')
+        stored_embeddings = hits[0].get('fields', {})
+        docs_map = {}
+        for encoder, fields in self.encoder_to_fields.items():
+            # each encoder gets its own copy, such that it only has the embeddings of the encoder
+            doc = convert_es_to_da(hits[0], get_score_breakdown=False)[0]
+            has_embeddings = False
+            for field in fields:
+                embedding = stored_embeddings.get(embedding_fields[(encoder, field)])
+                if embedding:
+                    get_chunk_by_field_name(doc, field).embedding = np.asarray(
+                        embedding, dtype=np.float32
+                    )
+                    has_embeddings = True
+            if has_embeddings:
+                docs_map[encoder] = DocumentArray([doc])
+        return docs_map
+
+    def _finish_search(self, results: DocumentArray, parameters: dict):
+        """Restores the blobs of the matches or creates temporary links to them."""
+        if self.blob_store and not parameters.get('fields', None):
+            self.blob_store.resolve(
+                results,
+                traversal_paths='@m,mc,mcc',
+                by_reference=parameters.get('create_temp_link', False),
+            )
 
         if (
             parameters.get('create_temp_link', False)
@@ -271,7 +1420,270 @@ class NOWElasticIndexer(Executor):
         ):
             self._create_temporary_links(results)
 
-        return results
+    def _search_matches(
+        self,
+        docs_map: Dict[str, DocumentArray],
+        parameters: dict,
+        filter: Dict,
+        limit: int,
+        get_score_breakdown: bool,
+        score_calculation: List[List],
+    ) -> Generator[List[Dict], List[Dict], None]:
+        """Searches the matches of the query documents in Elasticsearch with the retrieval mode
+        of the request and sets them as the matches of the query documents.
+        """
+        retrieval_mode = parameters.get('retrieval_mode', self.retrieval_mode)
+        if (
+            retrieval_mode == 'knn'
+            and parameters.get('rescore_quantized', self.rescore_quantized)
+            and 'byte' in self.encoder_to_quantization.values()
+        ):
+            # the kNN candidates are rescored with the original embeddings
+            retrieval_mode = 'two_stage'
+        num_candidates = int(
+            parameters.get('knn_num_candidates', self.knn_num_candidates)
+        )
+        if retrieval_mode == 'knn':
+            k = max(int(parameters.get('knn_k', self.knn_k or limit)), limit)
+            es_queries = build_es_knn_queries(
+                docs_map=docs_map,
+                get_score_breakdown=get_score_breakdown,
+                score_calculation=score_calculation,
+                k=k,
+                num_candidates=num_candidates,
+                filter=filter,
+                query_to_curated_ids=self.query_to_curated_ids,
+                metric=self.similarity,
+                encoder_to_quantization=self.encoder_to_quantization,
+            )
+        else:
+            candidate_ids = None
+            if retrieval_mode == 'two_stage':
+                candidate_ids = yield from self._get_candidate_ids(
+                    docs_map=docs_map,
+                    score_calculation=score_calculation,
+                    filter=filter,
+                    rescore_window=max(
+                        int(parameters.get('rescore_window', self.rescore_window)),
+                        limit,
+                    ),
+                    num_candidates=num_candidates,
+                )
+            es_queries = [
+                (doc, {'query': query})
+                for doc, query in build_es_queries(
+                    docs_map=docs_map,
+                    get_score_breakdown=get_score_breakdown,
+                    score_calculation=score_calculation,
+                    metric=self.similarity,
+                    filter=filter,
+                    query_to_curated_ids=self.query_to_curated_ids,
+                    candidate_ids=candidate_ids,
+                    encoder_to_quantization=self.encoder_to_quantization,
+                )
+            ]
+            with self._state_lock:
+                self.num_stored_script_queries += len(es_queries)
+        source = self._get_source_filter(parameters.get('fields', None))
+        facets = parameters.get('facets', None)
+        bodies = []
+        for doc, body in es_queries:
+            body = {**body, 'size': limit, '_source': source}
+            if facets:
+                body['aggs'] = self._get_facet_aggregations(
+                    facets, parameters.get('facet_size', self.max_values_per_tag)
+                )
+            if get_score_breakdown:
+                body['script_fields'] = build_score_breakdown_script_fields(
+                    doc,
+                    score_calculation,
+                    self.similarity,
+                    self.encoder_to_quantization,
+                )
+            bodies.append(body)
+        responses = yield bodies
+        for (doc, _), response in zip(es_queries, responses):
+            doc.matches = convert_es_results_to_matches(
+                query_doc=doc,
+                es_results=response['hits']['hits'],
+                get_score_breakdown=get_score_breakdown,
+                metric=self.metric,
+                score_calculation=score_calculation,
+            )
+            if facets:
+                doc.tags['facets'] = self._get_facet_counts(response['aggregations'])
+
+    def _get_tag_type(self, tag: str) -> str:
+        """Returns the type of a tag in the mapping. Tags which are not mapped explicitly are
+        assumed to be strings, which Elasticsearch maps dynamically as text."""
+        return (
+            self.es_mapping.get('properties', {})
+            .get('tags', {})
+            .get('properties', {})
+            .get(tag, {})
+            .get('type', 'text')
+        )
+
+    def _get_facet_aggregations(self, facets: List[str], size: int) -> Dict:
+        """Returns the terms aggregations counting the values of the facets."""
+        aggs = {}
+        for tag in facets:
+            tag_type = self._get_tag_type(tag)
+            if tag_type not in TAG_AGGREGATION_FIELD_SUFFIXES:
+                raise ValueError(f'Facet {tag} of type {tag_type} can not be counted')
+            suffix = TAG_AGGREGATION_FIELD_SUFFIXES[tag_type]
+            aggs[tag] = {'terms': {'field': f'tags.{tag}{suffix}', 'size': size}}
+        return aggs
+
+    def _get_facet_counts(self, aggregations: Dict) -> Dict[str, List[Dict]]:
+        return {
+            tag: [
+                {
+                    'value': self._get_bucket_value(self._get_tag_type(tag), bucket),
+                    'count': bucket['doc_count'],
+                }
+                for bucket in agg['buckets']
+            ]
+            for tag, agg in aggregations.items()
+        }
+
+    def _get_result_cache_keys(
+        self,
+        docs_map: Dict[str, DocumentArray],
+        parameters: dict,
+        limit: int,
+        score_calculation: List[List],
+    ) -> Dict[str, str]:
+        """Returns the result cache key of each query document. It is a hash of the embeddings and
+        texts of the query, its pinned IDs and the search parameters which change the results.
+
+        :return: dictionary mapping query document id to its cache key.
+        """
+        search_parameters = json.dumps(
+            {
+                'limit': limit,
+                'score_calculation': score_calculation,
+                **{key: parameters.get(key, None) for key in RESULT_CACHE_PARAMETERS},
+            },
+            sort_keys=True,
+            default=str,
+        )
+        hashes = {}
+        for encoder, da in docs_map.items():
+            for doc in da:
+                if doc.id not in hashes:
+                    hashes[doc.id] = hashlib.sha256(search_parameters.encode())
+                    pinned_query = get_pinned_query(doc, self.query_to_curated_ids)
+                    hashes[doc.id].update(json.dumps(pinned_query).encode())
+                doc_hash = hashes[doc.id]
+                doc_hash.update(encoder.encode())
+                for c in doc.chunks:
+                    if c.embedding is not None:
+                        doc_hash.update(np.asarray(c.embedding).tobytes())
+                    if c.text:
+                        doc_hash.update(c.text.encode())
+        return {doc_id: doc_hash.hexdigest() for doc_id, doc_hash in hashes.items()}
+
+    def _get_embedding_fields(self, quantized: bool = True) -> List[str]:
+        """Returns the paths of the embedding fields in the Elasticsearch documents.
+
+        :param quantized: whether to include the byte embedding fields of encoders with `byte` quantization.
+        :return: the paths of the embedding fields.
+        """
+        embedding_fields = []
+        for encoder, _, encoded_fields, quantization in self.document_mappings:
+            for field in encoded_fields:
+                if quantization != 'byte' or quantized:
+                    embedding_fields.append(f'{field}-{encoder}.embedding')
+                if quantization == 'byte':
+                    embedding_fields.append(
+                        f'{field}-{encoder}.{FULL_PRECISION_EMBEDDING}'
+                    )
+        return embedding_fields
+
+    def _get_source_filter(self, fields: Optional[List[str]] = None):
+        """Returns the source filter of a search request. Embeddings are never returned, since
+        the score breakdown is computed by script fields.
+
+        :param fields: if given, only these fields of the stored documents are returned.
+        :return: the `_source` parameter of the search request.
+        """
+        if fields:
+            return {'includes': fields}
+        return {'excludes': self._get_embedding_fields()}
+
+    def _get_candidate_ids(
+        self,
+        docs_map: Dict[str, DocumentArray],
+        score_calculation: List[List],
+        filter: Dict,
+        rescore_window: int,
+        num_candidates: int,
+    ) -> Generator[List[Dict], List[Dict], Dict[str, List[str]]]:
+        """First stage of the two-stage retrieval. Gathers the top `rescore_window` candidates
+        of each vector field with kNN and the top bm25 candidates for each query document.
+        Only the IDs are fetched, the candidates are scored exactly in the second stage.
+
+        :return: dictionary mapping query document id to the candidate ids.
+        """
+        es_queries = build_es_knn_queries(
+            docs_map=docs_map,
+            get_score_breakdown=False,
+            score_calculation=score_calculation,
+            k=rescore_window,
+            num_candidates=num_candidates,
+            filter=filter,
+            metric=self.similarity,
+            encoder_to_quantization=self.encoder_to_quantization,
+        )
+        responses = yield [
+            {
+                **body,
+                'size': rescore_window * len(score_calculation),
+                '_source': False,
+            }
+            for _, body in es_queries
+        ]
+        return {
+            doc.id: [hit['_id'] for hit in response['hits']['hits']]
+            for (doc, _), response in zip(es_queries, responses)
+        }
+
+    def _msearch(self, bodies: List[Dict]) -> List[Dict]:
+        """Sends all search bodies to Elasticsearch in a single `_msearch` request.
+
+        :param bodies: list of search request bodies, one per query document.
+        :return: list of search responses, in the same order as `bodies`.
+        """
+        with self.circuit_breaker:
+            responses = self._get_client(self.es, self.search_timeout).msearch(
+                index=self.index_name, searches=self._get_msearch_searches(bodies)
+            )['responses']
+        return self._check_msearch_responses(responses)
+
+    async def _amsearch(self, bodies: List[Dict]) -> List[Dict]:
+        """Same as `_msearch`, but with the async client."""
+        with self.circuit_breaker:
+            responses = (
+                await self._get_client(self.async_es, self.search_timeout).msearch(
+                    index=self.index_name, searches=self._get_msearch_searches(bodies)
+                )
+            )['responses']
+        return self._check_msearch_responses(responses)
+
+    def _get_msearch_searches(self, bodies: List[Dict]) -> List[Dict]:
+        searches = []
+        for body in bodies:
+            searches.extend([{'index': self.index_name}, body])
+        return searches
+
+    def _check_msearch_responses(self, responses: List[Dict]) -> List[Dict]:
+        for response in responses:
+            if 'error' in response:
+                raise RuntimeError(
+                    f'Elasticsearch multi-search failed: {response["error"]}'
+                )
+        return responses
 
     def _create_temporary_links(self, docs: DocumentArray):
         """For every match, it replaces the URI with a temporary link such that no credentials are needed for access."""
@@ -313,56 +1725,121 @@ class NOWElasticIndexer(Executor):
     def list(self, parameters: dict = {}, **kwargs):
         """List all indexed documents.
 
-        Note: this implementation is naive and does not
-        consider the default maximum documents in a page returned by `Elasticsearch`.
-        Should be addressed in future with `scroll`.
+        Without a `cursor`, documents are paged with `offset` and `limit`, which Elasticsearch
+        limits to the first 10,000 documents. To enumerate larger indices, pass `cursor` (an empty
+        string for the first page). The documents are then read from a point-in-time view of the index
+        with `search_after`, and the result is a single document with the page as matches and the cursor
+        of the next page in its tags. The cursor is `None` after the last page. Following the cursors
+        exports the whole index page by page, e.g. for audits or re-embedding jobs, without holding
+        more than one page in memory.
 
         :param parameters: dictionary with limit and offset
         - offset (int): number of documents to skip
         - limit (int): number of retrieved documents
+        - cursor (str): opaque cursor returned by the previous page
+        - fields (List[str]): if given, only these fields of the stored documents are returned as tags,
+            without decoding the stored documents
         """
         limit = int(parameters.get('limit', self.limit))
+        fields = parameters.get('fields', None)
+        if 'cursor' in parameters:
+            page, cursor = self._list_page(
+                cursor=parameters['cursor'], limit=limit, fields=fields
+            )
+            return DocumentArray(
+                [Document(text='list', tags={'cursor': cursor}, matches=page)]
+            )
         offset = int(parameters.get('offset', 0))
         try:
             result = self.es.search(
-                index=self.index_name, size=limit, from_=offset, query={'match_all': {}}
+                index=self.index_name,
+                size=limit,
+                from_=offset,
+                query={'match_all': {}},
+                source=fields if fields else True,
             )['hits']['hits']
         except Exception:
             result = None
             self.logger.info(traceback.format_exc())
         if result:
-            return convert_es_to_da(result, get_score_breakdown=False)
+            return self._resolve_blobs(
+                convert_es_to_da(result, get_score_breakdown=False), fields
+            )
         else:
             return DocumentArray()
 
+    def _list_page(
+        self, cursor: str, limit: int, fields: Optional[List[str]] = None
+    ) -> Tuple[DocumentArray, Optional[str]]:
+        """Reads one page of documents from a point-in-time view of the index.
+
+        :param cursor: cursor of the page, an empty string for the first page
+        :param limit: number of documents in the page
+        :param fields: if given, only these fields of the stored documents are returned as tags
+        :return: the documents of the page and the cursor of the next page, `None` after the last page
+        """
+        if cursor:
+            state = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        else:
+            pit_id = self.es.open_point_in_time(
+                index=self.index_name, keep_alive=LIST_KEEP_ALIVE
+            )['id']
+            state = {'pit': pit_id, 'search_after': None}
+        search_kwargs = {}
+        if state['search_after'] is not None:
+            search_kwargs['search_after'] = state['search_after']
+        resp = self.es.search(
+            pit={'id': state['pit'], 'keep_alive': LIST_KEEP_ALIVE},
+            size=limit,
+            sort=[{'_shard_doc': 'asc'}],
+            query={'match_all': {}},
+            source=fields if fields else True,
+            **search_kwargs,
+        )
+        hits = resp['hits']['hits']
+        page = self._resolve_blobs(
+            convert_es_to_da(hits, get_score_breakdown=False), fields
+        )
+        if len(hits) < limit:
+            self.es.close_point_in_time(id=resp['pit_id'])
+            return page, None
+        state = {'pit': resp['pit_id'], 'search_after': hits[-1]['sort']}
+        return page, base64.urlsafe_b64encode(json.dumps(state).encode()).decode()
+
+    def _resolve_blobs(
+        self, docs: DocumentArray, fields: Optional[List[str]] = None
+    ) -> DocumentArray:
+        """Loads the blobs of listed documents from the blob store, unless only some fields are listed."""
+        if self.blob_store and not fields:
+            self.blob_store.resolve(docs)
+        return docs
+
     @secure_request(on='/count', level=SecurityLevel.USER)
     def count(self, parameters: dict = {}, **kwargs):
-        """Count all indexed documents.
+        """Count the indexed documents with the Elasticsearch `_count` API.
 
-        Note: this implementation is naive and does not
-        consider the default maximum documents in a page returned by `Elasticsearch`.
-        Should be addressed in future with `scroll`.
-
-        :param parameters: dictionary with limit and offset
-        - offset (int): number of documents to skip
-        - limit (int): number of retrieved documents
+        :param parameters: dictionary with
+        - filter (dict): optional filter conditions on the documents, in the same format as for `/search`
         """
-        limit = int(parameters.get('limit', self.limit))
-        offset = int(parameters.get('offset', 0))
+        search_filter = parameters.get('filter', None)
+        query = (
+            {'bool': {'filter': process_filter(search_filter)}}
+            if search_filter
+            else {'match_all': {}}
+        )
         try:
-            result = self.es.search(
-                index=self.index_name, size=limit, from_=offset, query={'match_all': {}}
-            )['hits']['hits']
+            count = self.es.count(index=self.index_name, query=query)['count']
         except Exception:
-            result = []
+            count = 0
             self.logger.info(traceback.format_exc())
-        return DocumentArray([Document(text='count', tags={'count': len(result)})])
+        return DocumentArray([Document(text='count', tags={'count': count})])
 
     @secure_request(on='/delete', level=SecurityLevel.USER)
     def delete(self, parameters: dict = {}, **kwargs):
         """
         Endpoint to delete documents from an index. Either delete documents by filter condition
-        or by specifying a list of document IDs.
+        or by specifying a list of document IDs. IDs are deleted with bulk requests and the
+        result of each ID is returned in the tags of the response document.
 
         :param parameters: dictionary with filter conditions or list of IDs to select
             documents for deletion.
@@ -374,37 +1851,133 @@ class NOWElasticIndexer(Executor):
                 'query': {'bool': {'filter': process_filter(search_filter)}}
             }
             try:
-                resp = self.es.delete_by_query(
-                    index=self.index_name, body=es_search_filter
-                )
+                resp = {
+                    'deleted': self.es.delete_by_query(
+                        index=self.index_name, body=es_search_filter
+                    )['deleted']
+                }
                 self.es.indices.refresh(index=self.index_name)
                 self.update_tags()
+                self._resolve_curated_ids(self._get_curated_queries())
             except Exception:
                 self.logger.info(traceback.format_exc())
                 raise
         elif ids:
-            resp = {'deleted': 0}
+            resp = {'deleted': 0, 'results': {}}
             try:
-                for id in ids:
-                    r = self.es.delete(index=self.index_name, id=id)
-                    self.es.indices.refresh(index=self.index_name)
-                    resp['deleted'] += r['result'] == 'deleted'
-            except Exception as e:
-                self.logger.info(traceback.format_exc(), e)
+                for _, info in streaming_bulk(
+                    self.es,
+                    (
+                        {'_op_type': 'delete', '_index': self.index_name, '_id': id}
+                        for id in ids
+                    ),
+                    chunk_size=self.bulk_chunk_size,
+                    max_chunk_bytes=self.bulk_max_chunk_bytes,
+                    raise_on_error=False,
+                ):
+                    r = info['delete']
+                    resp['results'][r['_id']] = r.get('result', 'error')
+                    resp['deleted'] += r.get('result') == 'deleted'
+                self.es.indices.refresh(index=self.index_name)
+                self.update_tags()
+                self._remove_curated_ids(ids)
+            except Exception:
+                self.logger.info(traceback.format_exc())
+                raise
         else:
             raise ValueError('No filter or IDs provided for deletion.')
+        self._bump_index_generation()
         if resp:
             self.logger.info(
                 f"Deleted {resp['deleted']} documents in Elasticsearch index {self.index_name}"
             )
-        return DocumentArray()
+        return DocumentArray([Document(text='delete', tags=resp)])
 
     @secure_request(on='/tags', level=SecurityLevel.USER)
-    def tags(self, **kwargs):
+    def tags(self, parameters: dict = {}, **kwargs):
         """
         Endpoint to get all tags and their possible values in the index.
+        Besides the tags, the response contains the number of seconds since the tag values
+        were last aggregated over the whole index, and the maximum staleness of the tag values.
+
+        :param parameters: dictionary with
+        - refresh (bool): whether to aggregate the tag values over the whole index first
+        """
+        if parameters.get('refresh', False):
+            self.update_tags()
+        return DocumentArray(
+            [
+                Document(
+                    text='tags',
+                    tags={
+                        'tags': self.doc_id_tags,
+                        'seconds_since_aggregation': time() - self.tags_aggregated_at,
+                        'max_staleness': self.tags_max_staleness,
+                    },
+                )
+            ]
+        )
+
+    def get_vector_config(self) -> Dict:
+        """Returns the similarity, quantization and rescoring of the embedding fields of each encoder."""
+        return {
+            encoder: {
+                'embedding_size': embedding_size,
+                'fields': fields,
+                'similarity': 'cosine' if quantization == 'byte' else self.similarity,
+                'quantization': quantization or 'float',
+                'rescore': quantization == 'byte' and self.rescore_quantized,
+            }
+            for encoder, embedding_size, fields, quantization in self.document_mappings
+        }
+
+    @secure_request(on='/vector_config', level=SecurityLevel.USER)
+    def vector_config(self, **kwargs):
+        """Endpoint to report the active vector storage mode of each encoder, i.e. its similarity,
+        quantization and whether kNN candidates are rescored with the original embeddings."""
+        return DocumentArray(
+            [Document(text='vector_config', tags=self.get_vector_config())]
+        )
+
+    @secure_request(on='/cache_stats', level=SecurityLevel.USER)
+    def cache_stats(self, **kwargs):
+        """Endpoint to report the hits, misses, evictions and size of the search result cache."""
+        stats = self.result_cache.get_stats() if self.result_cache else {}
+        return DocumentArray(
+            [
+                Document(
+                    text='cache_stats',
+                    tags={**stats, 'index_generation': self.index_generation},
+                )
+            ]
+        )
+
+    @secure_request(on='/circuit_breaker', level=SecurityLevel.USER)
+    def circuit_breaker_state(self, **kwargs):
+        """Endpoint to report the state of the circuit breaker around the search and bulk
+        requests, i.e. 'closed', 'open' or 'half_open', and the number of rejected requests."""
+        return DocumentArray(
+            [Document(text='circuit_breaker', tags=self.circuit_breaker.get_state())]
+        )
+
+    @secure_request(on='/script_stats', level=SecurityLevel.USER)
+    def script_stats(self, **kwargs):
+        """
+        Endpoint to get the script compilation cache statistics. Every script-score query
+        uses one of the stored scripts, so every compilation of a score script since the start
+        of the indexer counts as a cache miss and all other script-score queries as cache hits.
+        Note, that Elasticsearch only reports compilations per node and not per index, so score
+        scripts compiled for other indices or clients of the cluster count as misses as well.
+        kNN searches without rescoring run no score script and are not counted.
         """
-        return DocumentArray([Document(text='tags', tags={'tags': self.doc_id_tags})])
+        cache_misses = (
+            self._get_script_compilations() - self.script_compilations_at_start
+        )
+        stats = {
+            'cache_hits': max(self.num_stored_script_queries - cache_misses, 0),
+            'cache_misses': cache_misses,
+        }
+        return DocumentArray([Document(text='script_stats', tags=stats)])
 
     @secure_request(on='/curate', level=SecurityLevel.USER)
     def curate(self, parameters: dict = {}, **kwargs):
@@ -434,18 +2007,290 @@ class NOWElasticIndexer(Executor):
             raise ValueError('No filter provided for curating.')
 
     def update_curated_ids(self, search_filter):
-        for query, filters in search_filter.items():
-            if query not in self.query_to_curated_ids:
-                self.query_to_curated_ids[query] = []
+        """
+        Adds the filters to the curation rules of the queries, persists the rules in the curation
+        index and resolves the pinned IDs of the queries with a single `_msearch`. The stored rules
+        are merged with optimistic concurrency control, such that concurrent curations on different
+        replicas do not overwrite each other.
+
+        :param search_filter: dictionary mapping query to a list of filters.
+        """
+        for filters in search_filter.values():
             for filter in filters:
-                es_query = {'query': {'bool': {'filter': process_filter(filter)}}}
+                # invalid filters raise before anything is stored
+                process_filter(filter)
+        for query, filters in search_filter.items():
+            merged_filters = self._save_curation_rule(query, filters)
+            with self._state_lock:
+                self.query_to_filters[query] = merged_filters
+        self.es.index(
+            index=self.curation_index_name,
+            id=CURATION_VERSION_ID,
+            document={},
+            refresh=True,
+        )
+        self._resolve_curated_ids(list(search_filter))
 
-                resp = self.es.search(index=self.index_name, body=es_query, size=100)
-                self.es.indices.refresh(index=self.index_name)
-                ids = [r['_id'] for r in resp['hits']['hits']]
-                self.query_to_curated_ids[query] += [
-                    id for id in ids if id not in self.query_to_curated_ids[query]
+    def maybe_reload_curation_rules(self):
+        """Reloads the curation rules if they were changed, e.g. by another replica. The version
+        of the rules is checked at most every `curation_check_interval` seconds."""
+        with self._state_lock:
+            if time() - self.curation_checked_at < self.curation_check_interval:
+                return
+            self.curation_checked_at = time()
+        try:
+            with self.circuit_breaker:
+                version = self._get_client(self.es, self.search_timeout).get(
+                    index=self.curation_index_name, id=CURATION_VERSION_ID
+                )['_version']
+        except NotFoundError:
+            version = 0
+        if version == self.curation_version:
+            return
+        query_to_filters = self._load_curation_rules()
+        with self._state_lock:
+            changed_queries = [
+                query
+                for query, filters in query_to_filters.items()
+                if self.query_to_filters.get(query, None) != filters
+            ]
+            self.query_to_filters = query_to_filters
+            self.curation_version = version
+        self._resolve_curated_ids(changed_queries)
+
+    def _load_curation_rules(self) -> Dict[str, List[Dict]]:
+        """Loads the curation rules from the curation index.
+
+        :return: dictionary mapping curated query to its filters.
+        """
+        with self.circuit_breaker:
+            return {
+                hit['_source']['query']: hit['_source']['filters']
+                for hit in scan(
+                    self._get_client(self.es, self.search_timeout),
+                    index=self.curation_index_name,
+                    query={'query': {'exists': {'field': 'query'}}},
+                )
+            }
+
+    def _save_curation_rule(self, query: str, filters: List[Dict]) -> List[Dict]:
+        """Adds the filters to the stored curation rule of the query. The rule is read again before
+        the filters are merged and it is only written if nobody changed it in the meantime.
+
+        :return: the filters of the stored rule.
+        """
+        rule_id = hashlib.sha256(query.encode()).hexdigest()
+        while True:
+            try:
+                rule = self.es.get(index=self.curation_index_name, id=rule_id)
+                stored_filters = rule['_source']['filters']
+                write_condition = {
+                    'if_seq_no': rule['_seq_no'],
+                    'if_primary_term': rule['_primary_term'],
+                }
+            except NotFoundError:
+                stored_filters = []
+                write_condition = {'op_type': 'create'}
+            merged_filters = stored_filters + [
+                f for f in filters if f not in stored_filters
+            ]
+            try:
+                self.es.index(
+                    index=self.curation_index_name,
+                    id=rule_id,
+                    document={'query': query, 'filters': merged_filters},
+                    **write_condition,
+                )
+                return merged_filters
+            except ConflictError:
+                # the rule was changed concurrently, the filters are merged into the new rule
+                continue
+
+    def _resolve_curated_ids(self, queries: List[str]):
+        """
+        Resolves the filters of the curated queries to the IDs of the documents they pin. All
+        filters are sent in a single `_msearch`.
+
+        :param queries: the curated queries to resolve.
+        """
+        with self._state_lock:
+            rules = [
+                (query, position, filter)
+                for query in queries
+                for position, filter in enumerate(self.query_to_filters[query])
+            ]
+        if not rules:
+            return
+        bodies = [
+            {
+                'query': {'bool': {'filter': process_filter(filter)}},
+                'size': CURATED_IDS_PER_FILTER,
+                '_source': False,
+            }
+            for _, _, filter in rules
+        ]
+        responses = self._msearch(bodies)
+        self._store_filter_ids(
+            rules,
+            [[hit['_id'] for hit in r['hits']['hits']] for r in responses],
+            add=False,
+        )
+
+    def _add_curated_ids(self, docs_map: Dict[str, DocumentArray]):
+        """
+        Pins the newly indexed documents to the curated queries whose filters they match. A filter
+        can only match if the batch sets all its tag fields, the other filters are skipped. The
+        remaining filters are checked against the batch in a single search, with one bucket of a
+        `filters` aggregation per filter.
+        """
+        docs = next(iter(docs_map.values()))
+        batch_fields = {f'tags__{tag}' for doc in docs for tag in doc.tags}
+        with self._state_lock:
+            rules = [
+                (query, position, filter)
+                for query, filters in self.query_to_filters.items()
+                for position, filter in enumerate(filters)
+                if all(
+                    field in batch_fields or not field.startswith('tags__')
+                    for field in filter
+                )
+            ]
+        if not rules:
+            return
+        doc_ids = docs[:, 'id']
+        body = {
+            'query': {'ids': {'values': doc_ids}},
+            'size': 0,
+            'aggs': {
+                'curation_filters': {
+                    'filters': {
+                        'filters': [
+                            {'bool': {'filter': process_filter(filter)}}
+                            for _, _, filter in rules
+                        ]
+                    },
+                    'aggs': {
+                        'pinned': {
+                            'top_hits': {
+                                'size': min(len(doc_ids), CURATED_IDS_PER_FILTER),
+                                '_source': False,
+                            }
+                        }
+                    },
+                }
+            },
+        }
+        buckets = self._msearch([body])[0]['aggregations']['curation_filters'][
+            'buckets'
+        ]
+        self._store_filter_ids(
+            rules,
+            [[hit['_id'] for hit in b['pinned']['hits']['hits']] for b in buckets],
+            add=True,
+        )
+
+    def _store_filter_ids(
+        self, rules: List[Tuple[str, int, Dict]], rule_ids: List[List[str]], add: bool
+    ):
+        """Stores the IDs matched by the filters of the curated queries and updates their pinned
+        IDs.
+
+        :param rules: the query, the position and the filter of each matched filter.
+        :param rule_ids: the matched IDs of each filter.
+        :param add: whether the IDs are added to the stored IDs of the filter instead of
+            replacing them.
+        """
+        with self._state_lock:
+            for (query, position, _), ids in zip(rules, rule_ids):
+                filter_ids = self.query_to_filter_ids.setdefault(query, [])
+                filter_ids += [[] for _ in range(position + 1 - len(filter_ids))]
+                if add:
+                    ids = filter_ids[position] + [
+                        id for id in ids if id not in filter_ids[position]
+                    ]
+                filter_ids[position] = ids[:CURATED_IDS_PER_FILTER]
+            for query in {query for query, _, _ in rules}:
+                self._update_pinned_ids(query)
+            self.index_generation += 1
+
+    def _remove_curated_ids(self, ids: List[str]):
+        """Removes deleted documents from the pinned IDs. Queries with a filter which pinned the
+        maximum number of documents are resolved again, since other documents may match now."""
+        ids = set(ids)
+        queries_to_resolve = []
+        with self._state_lock:
+            for query, filter_ids in self.query_to_filter_ids.items():
+                if ids.isdisjoint(self.query_to_curated_ids.get(query, [])):
+                    continue
+                if max(map(len, filter_ids)) >= CURATED_IDS_PER_FILTER:
+                    queries_to_resolve.append(query)
+                self.query_to_filter_ids[query] = [
+                    [id for id in ids_of_filter if id not in ids]
+                    for ids_of_filter in filter_ids
                 ]
+                self._update_pinned_ids(query)
+        self._resolve_curated_ids(queries_to_resolve)
+
+    def _update_pinned_ids(self, query: str):
+        pinned_ids = []
+        for ids_of_filter in self.query_to_filter_ids.get(query, []):
+            pinned_ids += [id for id in ids_of_filter if id not in pinned_ids]
+        self.query_to_curated_ids[query] = pinned_ids
+
+    def add_tags(self, docs: DocumentArray):
+        """
+        Adds the tag values of newly indexed documents to self.doc_id_tags. This keeps the
+        tag values up to date during indexing without aggregating over the whole index.
+
+        :param docs: the indexed documents
+        """
+        with self._state_lock:
+            for tag in self.user_input.filter_fields or []:
+                values = self.doc_id_tags.get(tag, [])
+                for doc in docs:
+                    value = doc.tags.get(tag, None)
+                    for v in value if isinstance(value, list) else [value]:
+                        v = self._to_aggregated_tag_value(tag, v)
+                        if (
+                            v is not None
+                            and v not in values
+                            and len(values) < TAG_AGGREGATION_SIZE
+                        ):
+                            values.append(v)
+                if values:
+                    self.doc_id_tags[tag] = values
+
+    def _to_aggregated_tag_value(self, tag: str, value: Any) -> Any:
+        """Converts a tag value to the form an aggregation over its field returns."""
+        field_type = (
+            self.es_mapping.get('properties', {})
+            .get('tags', {})
+            .get('properties', {})
+            .get(tag, {})
+            .get('type', 'keyword')
+        )
+        if value is not None and field_type == 'boolean':
+            return value in [True, 'true']
+        if value is None or field_type != 'keyword':
+            return value
+        if isinstance(value, bool):
+            return str(value).lower()
+        return str(value)
+
+    def _get_bucket_value(self, field_type: str, bucket: Dict) -> Any:
+        """Returns the tag value of a bucket of a terms aggregation. The keys of boolean and
+        date buckets are numbers, so the value is taken from their string representation."""
+        if field_type == 'boolean':
+            return bucket['key_as_string'] == 'true'
+        if field_type == 'date':
+            return bucket['key_as_string']
+        return bucket['key']
+
+    def maybe_update_tags(self):
+        """Aggregates the tag values over the whole index if they are older than
+        `tags_max_staleness` seconds."""
+        if time() - self.tags_aggregated_at > self.tags_max_staleness:
+            self.update_tags()
 
     def update_tags(self):
         """
@@ -456,10 +2301,8 @@ class NOWElasticIndexer(Executor):
         inside this field, and updates the self.doc_id_tags dictionary with tags as keys,
         and values as values in the dictionary.
         """
-        es_mapping = self.es.indices.get_mapping(index=self.index_name)
         tag_categories = (
-            es_mapping.get(self.index_name, {})
-            .get('mappings', {})
+            self._get_index_mappings()
             .get('properties', {})
             .get('tags', {})
             .get('properties', {})
@@ -471,39 +2314,92 @@ class NOWElasticIndexer(Executor):
         }
         aggs = {'aggs': {}, 'size': 0}
         for tag, map in tag_categories.items():
-            for tag_type, extension in [
-                ['text', '.keyword'],
-                ['keyword', ''],
-                ['float', ''],
-            ]:
-                if map['type'] == tag_type:
-                    aggs['aggs'][tag] = {
-                        'terms': {'field': f'tags.{tag}{extension}', 'size': 100}
+            if map['type'] in TAG_AGGREGATION_FIELD_SUFFIXES:
+                extension = TAG_AGGREGATION_FIELD_SUFFIXES[map['type']]
+                aggs['aggs'][tag] = {
+                    'terms': {
+                        'field': f'tags.{tag}{extension}',
+                        'size': TAG_AGGREGATION_SIZE,
                     }
+                }
 
         try:
             if not aggs['aggs']:
+                self.tags_aggregated_at = time()
                 return
             result = self.es.search(index=self.index_name, body=aggs)
             aggregations = result['aggregations']
             updated_tags = {}
             for tag, agg in aggregations.items():
-                updated_tags[tag] = [bucket['key'] for bucket in agg['buckets']]
-            self.doc_id_tags = updated_tags
+                updated_tags[tag] = [
+                    self._get_bucket_value(tag_categories[tag]['type'], bucket)
+                    for bucket in agg['buckets']
+                ]
+            with self._state_lock:
+                self.doc_id_tags = updated_tags
+                self.tags_aggregated_at = time()
         except Exception:
             self.logger.info(traceback.format_exc())
 
 
-def aggregate_embeddings(docs_map: Dict[str, DocumentArray]):
-    """Aggregate embeddings of cc level to c level.
+def aggregate_embeddings(
+    docs_map: Dict[str, DocumentArray],
+    projections: Dict[str, Projection] = {},
+    aggregation: str = 'mean',
+):
+    """Aggregate embeddings of cc level to c level. The embeddings of all cc level documents of an
+    encoder are gathered into one contiguous array, which is aggregated per c level document in a
+    single `reduceat` pass. If an encoder has a fitted projection, the aggregated embeddings are projected.
 
     :param docs_map: a dictionary of `DocumentArray`s, where the key is the embedding space aka encoder name.
+    :param projections: a dictionary mapping encoder name to the projection of its embeddings.
+    :param aggregation: 'mean', 'max' or 'weighted', which weights the cc level embeddings by the
+        `weight` of their documents. Documents without weight have the weight 1.
     """
-    for docs in docs_map.values():
+    for encoder, docs in docs_map.items():
+        chunks = []
+        segments = []
+        weights = []
         for doc in docs:
             for c in doc.chunks:
                 if c.chunks.embeddings is not None:
-                    c.embedding = c.chunks.embeddings.mean(axis=0)
+                    chunks.append(c)
+                    segments.append(c.chunks.embeddings)
+                    if aggregation == 'weighted':
+                        weights.extend(cc.weight or 1.0 for cc in c.chunks)
                 if c.chunks[0].text or not c.uri:
                     c.content = c.chunks[0].content
                 c.chunks = DocumentArray()
+        if not chunks:
+            continue
+        lengths = np.array([len(segment) for segment in segments])
+        offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        embeddings = np.concatenate(segments)
+        if aggregation == 'max':
+            aggregated = np.maximum.reduceat(embeddings, offsets, axis=0)
+        elif aggregation == 'weighted':
+            weights = np.asarray(weights, dtype=embeddings.dtype)
+            aggregated = (
+                np.add.reduceat(embeddings * weights[:, None], offsets, axis=0)
+                / np.add.reduceat(weights, offsets)[:, None]
+            )
+        else:
+            aggregated = np.add.reduceat(embeddings, offsets, axis=0) / lengths[:, None]
+        aggregated = aggregated.astype(embeddings.dtype, copy=False)
+        projection = projections.get(encoder, None)
+        if projection is not None and projection.is_fitted:
+            aggregated = projection.transform(aggregated)
+        for c, embedding in zip(chunks, aggregated):
+            c.embedding = embedding
+
+
+def is_es_unavailable(e: BaseException) -> bool:
+    """Whether an exception of the Elasticsearch client means that Elasticsearch is unavailable
+    or overloaded, as opposed to an invalid request. Only these failures open the circuit breaker.
+
+    :param e: exception raised by the client.
+    """
+    if isinstance(e, TransportError):
+        # connection errors and timeouts
+        return True
+    return isinstance(e, ApiError) and (e.meta.status == 429 or e.meta.status >= 500)
@@ -1,5 +1,6 @@
-from typing import Dict, List, Union
+from typing import Any, Dict, Iterable, Iterator, List, Union
 
+import numpy as np
 from docarray import Document, DocumentArray
 from docarray.score import NamedScore
 from numpy import dot
@@ -7,6 +8,16 @@ from numpy.linalg import norm
 
 from now.utils.docarray.helpers import get_chunk_by_field_name
 
+# documents are stored as zlib compressed protobuf, documents indexed before are stored as pickle
+SERIALIZED_DOC_FIELD = 'serialized_doc_v2'
+LEGACY_SERIALIZED_DOC_FIELD = 'serialized_doc'
+SERIALIZED_DOC_FIELDS = [SERIALIZED_DOC_FIELD, LEGACY_SERIALIZED_DOC_FIELD]
+
+# quantization modes of the embedding fields of an encoder
+QUANTIZATION_MODES = [None, 'byte', 'int8_hnsw']
+# encoders with `byte` quantization keep their original embeddings in this field, which is not indexed
+FULL_PRECISION_EMBEDDING = 'embedding_full'
+
 
 def convert_es_to_da(
     result: Union[Dict, List[Dict]], get_score_breakdown: bool
@@ -14,16 +25,30 @@ def convert_es_to_da(
     """
     Transform Elasticsearch documents into DocumentArray. Assumes that all Elasticsearch
     documents have a 'text' field. It returns embeddings as part of the tags for each field that is encoded.
+    If the serialized document is not part of the returned source fields, the returned
+    source fields are stored in the tags of the document. Otherwise the document is always
+    decoded from it, since the other source fields can not restore its chunks.
 
     :param result: results from an Elasticsearch query.
-    :param get_score_breakdown: whether to return the embeddings as tags for each document.
+    :param get_score_breakdown: whether to return the embeddings and the similarities of the
+        script fields as tags for each document.
     :return: a DocumentArray containing all results.
     """
     if isinstance(result, Dict):
         result = [result]
     da = DocumentArray()
     for es_doc in result:
-        doc = Document.from_base64(es_doc['_source']['serialized_doc'])
+        if any(field in es_doc['_source'] for field in SERIALIZED_DOC_FIELDS):
+            doc = deserialize_doc(es_doc['_source'])
+        else:
+            doc = Document(
+                id=es_doc['_id'],
+                tags={
+                    k: v
+                    for k, v in es_doc['_source'].items()
+                    if not k.endswith('embedding')
+                },
+            )
         for k, v in es_doc['_source'].items():
             if (
                 k.startswith('embedding') or k.endswith('embedding')
@@ -31,6 +56,11 @@ def convert_es_to_da(
                 if 'embeddings' not in doc.tags:
                     doc.tags['embeddings'] = {}
                 doc.tags['embeddings'][k] = v
+        if get_score_breakdown and 'fields' in es_doc:
+            # similarities computed by the score breakdown script fields
+            doc.tags['similarities'] = {
+                k: v[0] for k, v in es_doc['fields'].items() if v
+            }
         da.append(doc)
     return da
 
@@ -39,6 +69,8 @@ def convert_doc_map_to_es(
     docs_map: Dict[str, DocumentArray],
     index_name: str,
     encoder_to_fields: dict,
+    normalize_embeddings: bool = False,
+    encoder_to_quantization: Dict[str, str] = {},
 ) -> List[Dict]:
     """
     Transform a dictionary (mapping encoder to DocumentArray) into a list of Elasticsearch documents.
@@ -52,28 +84,149 @@ def convert_doc_map_to_es(
     :param docs_map: dictionary mapping encoder to DocumentArray.
     :param index_name: name of the index to be used in Elasticsearch.
     :param encoder_to_fields: dictionary mapping encoder to fields.
+    :param normalize_embeddings: whether to L2-normalize the embeddings.
+    :param encoder_to_quantization: dictionary mapping encoder to its quantization mode.
     :return: a list of Elasticsearch documents as dictionaries ready to be indexed.
     """
-    es_docs = {}
-    for executor_name, documents in docs_map.items():
-        for doc in documents:
-            if doc.id not in es_docs:
-                es_docs[doc.id] = get_base_es_doc(doc, index_name)
-                _doc = DocumentArray(Document(doc, copy=True))
-                # remove embeddings from serialized doc
-                _doc[..., 'embedding'] = None
-                es_docs[doc.id]['serialized_doc'] = _doc[0].to_base64()
-            es_doc = es_docs[doc.id]
+    return list(
+        iter_doc_map_to_es(
+            docs_map,
+            index_name,
+            encoder_to_fields,
+            normalize_embeddings,
+            encoder_to_quantization,
+        )
+    )
+
+
+def iter_doc_map_to_es(
+    docs_map: Dict[str, DocumentArray],
+    index_name: str,
+    encoder_to_fields: dict,
+    normalize_embeddings: bool = False,
+    encoder_to_quantization: Dict[str, str] = {},
+    boolean_tags: Iterable[str] = (),
+) -> Iterator[Dict]:
+    """
+    Lazily transform a dictionary (mapping encoder to DocumentArray) into Elasticsearch documents.
+    Each Elasticsearch document is only created when it is consumed, e.g. by a streaming bulk request,
+    such that the converted documents of a batch never need to be held in memory at the same time.
+
+    :param docs_map: dictionary mapping encoder to DocumentArray.
+    :param index_name: name of the index to be used in Elasticsearch.
+    :param encoder_to_fields: dictionary mapping encoder to fields.
+    :param normalize_embeddings: whether to L2-normalize the embeddings, e.g. for the
+        `dot_product` similarity.
+    :param encoder_to_quantization: dictionary mapping encoder to its quantization mode. Embeddings
+        of encoders with `byte` quantization are quantized, the original embeddings are stored
+        in a separate field.
+    :param boolean_tags: tags which are mapped as `boolean`. Elasticsearch can not ignore malformed
+        booleans, so their values are coerced and values which are no booleans are not indexed.
+    :return: a generator of Elasticsearch documents as dictionaries ready to be indexed.
+    """
+    doc_ids = dict.fromkeys(
+        doc.id for documents in docs_map.values() for doc in documents
+    )
+    for doc_id in doc_ids:
+        es_doc = None
+        for executor_name, documents in docs_map.items():
+            if doc_id not in documents:
+                continue
+            doc = documents[doc_id]
+            if es_doc is None:
+                es_doc = get_base_es_doc(doc, index_name)
+                if boolean_tags and 'tags' in es_doc:
+                    es_doc['tags'] = coerce_boolean_tags(es_doc['tags'], boolean_tags)
+                es_doc[SERIALIZED_DOC_FIELD] = serialize_doc(doc)
             for encoded_field in encoder_to_fields[executor_name]:
                 field_doc = get_chunk_by_field_name(doc, encoded_field)
-                es_doc[
-                    f'{encoded_field}-{executor_name}.embedding'
-                ] = field_doc.embedding
+                embedding = (
+                    normalize_embedding(field_doc.embedding)
+                    if normalize_embeddings
+                    else field_doc.embedding
+                )
+                if encoder_to_quantization.get(executor_name, None) == 'byte':
+                    es_doc[
+                        f'{encoded_field}-{executor_name}.{FULL_PRECISION_EMBEDDING}'
+                    ] = embedding
+                    embedding = quantize_embedding(embedding)
+                es_doc[f'{encoded_field}-{executor_name}.embedding'] = embedding
                 if hasattr(field_doc, 'text') and field_doc.text:
                     es_doc[f'{encoded_field}'] = field_doc.text
                 if hasattr(field_doc, 'uri') and field_doc.uri:
                     es_doc['uri'] = field_doc.uri
-    return list(es_docs.values())
+        yield es_doc
+
+
+def coerce_boolean_tags(tags: Dict[str, Any], boolean_tags: Iterable[str]) -> Dict:
+    """Returns a copy of the tags where the values of boolean tags are booleans. The strings 'true'
+    and 'false' are converted, other values are removed, e.g. 'N/A'."""
+    tags = dict(tags)
+    for tag in boolean_tags:
+        value = tags.get(tag, None)
+        if value is None or isinstance(value, bool):
+            continue
+        if isinstance(value, str) and value.lower() in ('true', 'false'):
+            tags[tag] = value.lower() == 'true'
+        else:
+            del tags[tag]
+    return tags
+
+
+def normalize_embedding(embedding):
+    """Returns the embedding scaled to unit length. Embeddings of length zero are returned as they are."""
+    embedding_norm = norm(embedding)
+    if embedding_norm == 0:
+        return embedding
+    return np.asarray(embedding) / embedding_norm
+
+
+def quantize_embedding(embedding) -> List[int]:
+    """Quantizes the embedding for a `byte` vector field. The embedding is scaled such that its largest
+    absolute value is 127, which keeps its direction for the cosine similarity."""
+    embedding = np.asarray(embedding, dtype=float)
+    max_abs = np.abs(embedding).max()
+    if max_abs > 0:
+        embedding = embedding * (127 / max_abs)
+    return np.round(embedding).astype(np.int8).tolist()
+
+
+def serialize_doc(doc: Document) -> str:
+    """
+    Serialize a document without its embeddings, which are stored in separate fields.
+    The embeddings are removed from the document and its chunks only for the time of
+    serialization, so that the document does not need to be copied.
+
+    :param doc: the document to serialize.
+    :return: the base64 encoded, zlib compressed protobuf bytes of the document.
+    """
+    removed_embeddings = []
+    docs = [doc]
+    while docs:
+        d = docs.pop()
+        if d.embedding is not None:
+            removed_embeddings.append((d, d.embedding))
+            d.embedding = None
+        docs.extend(d.chunks)
+    try:
+        return doc.to_base64(protocol='protobuf', compress='zlib')
+    finally:
+        for d, embedding in removed_embeddings:
+            d.embedding = embedding
+
+
+def deserialize_doc(source: Dict) -> Document:
+    """
+    Deserialize the stored document from the source of an Elasticsearch document.
+
+    :param source: the `_source` of an Elasticsearch document.
+    :return: the stored document.
+    """
+    if SERIALIZED_DOC_FIELD in source:
+        return Document.from_base64(
+            source[SERIALIZED_DOC_FIELD], protocol='protobuf', compress='zlib'
+        )
+    return Document.from_base64(source[LEGACY_SERIALIZED_DOC_FIELD])
 
 
 def get_base_es_doc(doc: Document, index_name: str) -> Dict:
@@ -106,14 +259,13 @@ def convert_es_results_to_matches(
 
     :return: `DocumentArray` that holds all matches in the form of `Document`s.
     """
-    matches = DocumentArray()
-    for result in es_results:
-        d = convert_es_to_da(result, get_score_breakdown)[0]
+    matches = convert_es_to_da(es_results, get_score_breakdown)
+    for d, result in zip(matches, es_results):
         d.scores[metric] = NamedScore(value=result['_score'])
-        if get_score_breakdown:
-            d = calculate_score_breakdown(query_doc, d, score_calculation, metric)
+    if get_score_breakdown and matches:
+        calculate_score_breakdowns(query_doc, matches, score_calculation, metric)
+    for d in matches:
         d.embedding = None
-        matches.append(d)
     return matches
 
 
@@ -132,9 +284,32 @@ def calculate_score_breakdown(
 
     :return: List of integers representing the score breakdown.
     """
-    retrieved_doc.scores['total'] = retrieved_doc.scores.pop(
-        metric
-    )  # save the final script score as total
+    return calculate_score_breakdowns(
+        query_doc, [retrieved_doc], score_calculation, metric
+    )[0]
+
+
+def calculate_score_breakdowns(
+    query_doc: Document, retrieved_docs: List[Document], score_calculation, metric
+) -> List[Document]:
+    """
+    Calculate the score breakdown for all retrieved documents of a query at once. If Elasticsearch
+    already computed the similarities of a score calculation in script fields, they are used.
+    Otherwise, the embeddings of the retrieved documents are stacked into a matrix,
+    such that their similarities to the query embedding are computed with a single matrix product.
+
+    :param query_doc: The query document. Contains embeddings for the score calculation at tag level.
+    :param retrieved_docs: The Elasticsearch results, containing similarities or embeddings at tag level.
+    :param score_calculation: The score calculation used for the score breakdown.
+    :param metric: The metric to be used for the score breakdown.
+
+    :return: the retrieved documents with the score breakdown in their scores.
+    """
+    for retrieved_doc in retrieved_docs:
+        retrieved_doc.scores['total'] = retrieved_doc.scores.pop(
+            metric
+        )  # save the final script score as total
+    vector_totals = np.zeros(len(retrieved_docs))
     add_bm25 = False
     for (
         query_field,
@@ -145,47 +320,73 @@ def calculate_score_breakdown(
         if encoder == 'bm25':
             add_bm25 = True
             continue
-        q_emb = query_doc.tags['embeddings'][f'{query_field}-{encoder}']
-        d_emb = retrieved_doc.tags['embeddings'][
-            f'{document_field}-{encoder}.embedding'
-        ]
-        if metric == 'cosine':
-            score = calculate_cosine(d_emb, q_emb) * linear_weight
-        elif metric == 'l2_norm':
-            score = calculate_l2_norm(d_emb, q_emb) * linear_weight
+        similarity_name = f'{query_field}-{document_field}-{encoder}'
+        if all(
+            similarity_name in retrieved_doc.tags.get('similarities', {})
+            for retrieved_doc in retrieved_docs
+        ):
+            scores = (
+                np.array(
+                    [
+                        retrieved_doc.tags['similarities'][similarity_name]
+                        for retrieved_doc in retrieved_docs
+                    ],
+                    dtype=float,
+                )
+                * linear_weight
+            )
         else:
-            raise ValueError(f'Invalid metric {metric}')
-        retrieved_doc.scores[
-            '-'.join(
+            q_emb = np.asarray(query_doc.tags['embeddings'][f'{query_field}-{encoder}'])
+            d_embs = np.stack(
                 [
-                    query_field,
-                    document_field,
-                    encoder,
-                    str(linear_weight),
+                    np.asarray(
+                        retrieved_doc.tags['embeddings'][
+                            f'{document_field}-{encoder}.embedding'
+                        ]
+                    )
+                    for retrieved_doc in retrieved_docs
                 ]
             )
-        ] = NamedScore(value=round(score, 6))
-
-    if add_bm25:
-        # calculate bm25 score
-        vector_total = sum(
-            [v.value for k, v in retrieved_doc.scores.items() if k != 'total']
-        )
-        bm25_normalized = retrieved_doc.scores['total'].value - vector_total - 1
-        bm25_raw = bm25_normalized * 10
-        retrieved_doc.scores['bm25_normalized'] = NamedScore(
-            value=round(bm25_normalized, 6)
+            if metric == 'cosine':
+                scores = calculate_cosine(d_embs, q_emb) * linear_weight
+            elif metric == 'l2_norm':
+                scores = calculate_l2_norm(d_embs, q_emb) * linear_weight
+            else:
+                raise ValueError(f'Invalid metric {metric}')
+        score_name = '-'.join(
+            [
+                query_field,
+                document_field,
+                encoder,
+                str(linear_weight),
+            ]
         )
-        retrieved_doc.scores['bm25_raw'] = NamedScore(value=round(bm25_raw, 6))
+        scores = np.round(scores, 6)
+        vector_totals += scores
+        for retrieved_doc, score in zip(retrieved_docs, scores):
+            retrieved_doc.scores[score_name] = NamedScore(value=float(score))
+
+    for retrieved_doc, vector_total in zip(retrieved_docs, vector_totals):
+        if add_bm25:
+            # calculate bm25 score
+            bm25_normalized = retrieved_doc.scores['total'].value - vector_total - 1
+            bm25_raw = bm25_normalized * 10
+            retrieved_doc.scores['bm25_normalized'] = NamedScore(
+                value=round(float(bm25_normalized), 6)
+            )
+            retrieved_doc.scores['bm25_raw'] = NamedScore(
+                value=round(float(bm25_raw), 6)
+            )
 
-    # remove embeddings from document
-    retrieved_doc.tags.pop('embeddings', None)
-    return retrieved_doc
+        # remove embeddings and similarities from document
+        retrieved_doc.tags.pop('embeddings', None)
+        retrieved_doc.tags.pop('similarities', None)
+    return retrieved_docs
 
 
 def calculate_l2_norm(d_emb, q_emb):
-    return norm(q_emb - d_emb)
+    return norm(q_emb - d_emb, axis=-1)
 
 
 def calculate_cosine(d_emb, q_emb):
-    return dot(q_emb, d_emb) / (norm(q_emb) * norm(d_emb))
+    return dot(d_emb, q_emb) / (norm(q_emb) * norm(d_emb, axis=-1))
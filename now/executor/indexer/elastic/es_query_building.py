@@ -2,12 +2,160 @@ from collections import defaultdict
 from typing import Any, Dict, List, Optional, Tuple, Union
 
 from docarray import Document, DocumentArray
+from numpy.linalg import norm
 
+from now.executor.indexer.elastic.es_converter import (
+    FULL_PRECISION_EMBEDDING,
+    normalize_embedding,
+    quantize_embedding,
+)
 from now.utils.docarray.helpers import get_chunk_by_field_name
 
-metrics_mapping = {
+# generic score script, which loops over any number of vector terms
+_SCORE_SCRIPT_TEMPLATE = '''
+double score = params.bm25 ? 1.0 + _score / (_score + 10.0) : 1.0;
+for (int i = 0; i < params.fields.size(); ++i) {
+    def values = doc[params.fields.get(i)];
+    if (values.size() == 0) {
+        continue;
+    }
+    float[] vector = values.vectorValue;
+    String query_name = params.query_names.get(i);
+    List query = params.queries.get(query_name);
+    double similarity = 0.0;
+    %s
+    score += params.weights.get(i) * similarity;
+}
+return score;
+'''
+
+_SIMILARITY_SCRIPT_TEMPLATE = '''
+def values = doc[params.field];
+if (values.size() == 0) {
+    return null;
+}
+float[] vector = values.vectorValue;
+String query_name = params.query_name;
+List query = params.queries.get(query_name);
+double similarity = 0.0;
+%s
+return similarity;
+'''
+
+_SIMILARITY_SOURCES = {
+    'cosine': '''for (int j = 0; j < vector.length; ++j) {
+        similarity += vector[j] * query.get(j);
+    }
+    similarity /= values.magnitude * params.query_norms.get(query_name);''',
+    'l2_norm': '''for (int j = 0; j < vector.length; ++j) {
+        double diff = vector[j] - query.get(j);
+        similarity += diff * diff;
+    }
+    similarity = Math.sqrt(similarity);''',
+    # for normalized embeddings, the dot product equals the cosine similarity
+    'dot_product': '''for (int j = 0; j < vector.length; ++j) {
+        similarity += vector[j] * query.get(j);
+    }''',
+}
+
+# the native vector functions of script-score queries. They are class bindings, which Painless
+# instantiates once per call site with the field and query vector of the first call, so every
+# term of the score calculation needs its own call site and the terms are unrolled
+_NATIVE_SIMILARITY_FUNCTIONS = {
     'cosine': 'cosineSimilarity',
     'l2_norm': 'l2norm',
+    'dot_product': 'dotProduct',
+}
+
+_UNROLLED_SCORE_TERM_TEMPLATE = '''
+if (doc[params.f{i}].size() != 0) {{
+    score += params.w{i} * {function}(params.q{i}, params.f{i});
+}}'''
+
+# score calculations with up to this many vector terms are scored by a script with one native
+# function call per term, longer ones by the generic script
+MAX_UNROLLED_SCORE_TERMS = 16
+
+
+def _get_unrolled_score_script(function: str, num_terms: int) -> str:
+    terms = ''.join(
+        _UNROLLED_SCORE_TERM_TEMPLATE.format(i=i, function=function)
+        for i in range(num_terms)
+    )
+    return (
+        'double score = params.bm25 ? 1.0 + _score / (_score + 10.0) : 1.0;'
+        f'{terms}\nreturn score;'
+    )
+
+
+# normalizes the embeddings of the `_source` when reindexing into a `dot_product` index
+NORMALIZE_EMBEDDINGS_SCRIPT = '''
+for (String field : params.fields) {
+    List vector = ctx._source[field];
+    if (vector == null) {
+        continue;
+    }
+    double squared_norm = 0.0;
+    for (def value : vector) {
+        squared_norm += value * value;
+    }
+    if (squared_norm == 0.0) {
+        continue;
+    }
+    double vector_norm = Math.sqrt(squared_norm);
+    for (int i = 0; i < vector.size(); ++i) {
+        vector.set(i, vector.get(i) / vector_norm);
+    }
+}
+'''
+
+# returns the stored embedding of a document, e.g. to search similar documents without encoding it
+_VECTOR_SCRIPT = '''
+def values = doc[params.field];
+if (values.size() == 0) {
+    return null;
+}
+List vector = new ArrayList();
+for (float value : values.vectorValue) {
+    vector.add(value);
+}
+return vector;
+'''
+
+
+# stored scripts are compiled once by Elasticsearch, queries only pass fields and weights as params
+stored_script_ids = {
+    metric: f'now-{metric.replace("_", "-")}-score-v1' for metric in _SIMILARITY_SOURCES
+}
+unrolled_score_script_ids = {
+    metric: [
+        f'now-{metric.replace("_", "-")}-score-{num_terms}-v2'
+        for num_terms in range(MAX_UNROLLED_SCORE_TERMS + 1)
+    ]
+    for metric in _SIMILARITY_SOURCES
+}
+similarity_script_ids = {
+    metric: f'now-{metric.replace("_", "-")}-similarity-v1'
+    for metric in _SIMILARITY_SOURCES
+}
+vector_script_id = 'now-vector-v1'
+stored_scripts = {
+    **{
+        stored_script_ids[metric]: _SCORE_SCRIPT_TEMPLATE % source
+        for metric, source in _SIMILARITY_SOURCES.items()
+    },
+    **{
+        similarity_script_ids[metric]: _SIMILARITY_SCRIPT_TEMPLATE % source
+        for metric, source in _SIMILARITY_SOURCES.items()
+    },
+    **{
+        script_id: _get_unrolled_score_script(
+            _NATIVE_SIMILARITY_FUNCTIONS[metric], num_terms
+        )
+        for metric, script_ids in unrolled_score_script_ids.items()
+        for num_terms, script_id in enumerate(script_ids)
+    },
+    vector_script_id: _VECTOR_SCRIPT,
 }
 
 
@@ -59,11 +207,14 @@ def build_es_queries(
     metric: Optional[str] = 'cosine',
     filter: dict = {},
     query_to_curated_ids: Dict[str, list] = {},
+    candidate_ids: Optional[Dict[str, List[str]]] = None,
+    encoder_to_quantization: Dict[str, str] = {},
 ) -> Dict:
     """
     Build script-score query used in Elasticsearch. To do this, we extract
-    embeddings from the query document and pass them in the script-score
-    query together with the fields to search on in the Elasticsearch index.
+    embeddings from the query document and pass them as params of the stored
+    score script together with the fields to search on in the Elasticsearch index
+    and their linear weights, see `get_score_script`.
     The query document will be returned with all of its embeddings as tags with
     their corresponding field+encoder as key.
 
@@ -73,16 +224,23 @@ def build_es_queries(
         of a query document.
     :param score_calculation: list of nested lists containing (query_field, document_field, matching_method, linear_weight) which define
         how to calculate the score. Note, that the matching_method is the name of the encoder or `bm25`.
-    :param metric: metric to use for vector search.
+    :param metric: metric to use for vector search. For `dot_product`, the query embeddings
+        are normalized once, such that the results equal the cosine similarity.
     :param filter: dictionary of filters to apply to the search.
     :param query_to_curated_ids: dictionary mapping query text to list of curated ids.
+    :param candidate_ids: dictionary mapping query document id to the ids of the documents
+        that should be scored. If not given, all documents are scored.
+    :param encoder_to_quantization: dictionary mapping encoder to its quantization mode. Documents
+        are scored with the original embeddings of encoders with `byte` quantization.
     :return: a dictionary containing query and filter.
     """
     queries = {}
     pinned_queries = {}
     docs = {}
-    sources = {}
-    script_params = defaultdict(dict)
+    script_terms = {}
+    bm25 = any(
+        matching_method == 'bm25' for (_, _, matching_method, _) in score_calculation
+    )
     for executor_name, da in docs_map.items():
         for doc in da:
             if doc.id not in docs:
@@ -94,19 +252,14 @@ def build_es_queries(
                     doc,
                     score_calculation,
                     filter,
+                    candidate_ids[doc.id] if candidate_ids is not None else None,
                 )
                 pinned_queries[doc.id] = get_pinned_query(
                     doc,
                     query_to_curated_ids,
                 )
 
-                if any(
-                    _matching_method == 'bm25'
-                    for (_, _, _matching_method, _) in score_calculation
-                ):
-                    sources[doc.id] = '1.0 + _score / (_score + 10.0)'
-                else:
-                    sources[doc.id] = '1.0'
+                script_terms[doc.id] = []
 
             for (
                 query_field,
@@ -120,16 +273,16 @@ def build_es_queries(
                         f'{query_field}-{matching_method}'
                     ] = field_doc.embedding
 
-                query_string = f'params.query_{query_field}_{executor_name}'
-                document_string = f'{document_field}-{matching_method}'
-
-                sources[
-                    doc.id
-                ] += f" + {float(linear_weight)}*{metrics_mapping[metric]}({query_string}, '{document_string}.embedding')"
-
-                script_params[doc.id][
-                    f'query_{query_field}_{executor_name}'
-                ] = field_doc.embedding
+                script_terms[doc.id].append(
+                    (
+                        get_scoring_embedding_field(
+                            document_field, matching_method, encoder_to_quantization
+                        ),
+                        f'query_{query_field}_{executor_name}',
+                        get_query_embedding(field_doc.embedding, metric),
+                        float(linear_weight),
+                    )
+                )
 
     es_queries = []
 
@@ -139,10 +292,7 @@ def build_es_queries(
                 'query': {
                     'bool': query['bool'],
                 },
-                'script': {
-                    'source': sources[doc_id],
-                    'params': script_params[doc_id],
-                },
+                'script': get_score_script(script_terms[doc_id], bm25, metric),
             },
         }
         if pinned_queries[doc_id]:
@@ -154,10 +304,224 @@ def build_es_queries(
     return es_queries
 
 
+def get_score_script(
+    terms: List[Tuple[str, str, Any, float]], bm25: bool, metric: str = 'cosine'
+) -> Dict:
+    """
+    Returns the stored score script for the vector terms of a query. Up to `MAX_UNROLLED_SCORE_TERMS`
+    terms are scored with the native vector functions of the script with this number of terms,
+    which takes the field, query vector and weight of term `i` as params `fi`, `qi` and `wi`.
+    Longer score calculations use the generic script.
+
+    :param terms: list of (field, query_name, query_embedding, linear_weight) tuples.
+    :param bm25: whether the bm25 score is added.
+    :param metric: the similarity of the embedding fields.
+    :return: the `script` of the script-score query.
+    """
+    if len(terms) <= MAX_UNROLLED_SCORE_TERMS:
+        params = {'bm25': bm25}
+        for i, (field, _, query_embedding, linear_weight) in enumerate(terms):
+            params[f'f{i}'] = field
+            params[f'q{i}'] = query_embedding
+            params[f'w{i}'] = linear_weight
+        return {'id': unrolled_score_script_ids[metric][len(terms)], 'params': params}
+    params = {
+        'bm25': bm25,
+        'fields': [],
+        'query_names': [],
+        'weights': [],
+        'queries': {},
+        'query_norms': {},
+    }
+    for field, query_name, query_embedding, linear_weight in terms:
+        params['fields'].append(field)
+        params['query_names'].append(query_name)
+        params['weights'].append(linear_weight)
+        params['queries'][query_name] = query_embedding
+        params['query_norms'][query_name] = float(norm(query_embedding))
+    return {'id': stored_script_ids[metric], 'params': params}
+
+
+def get_scoring_embedding_field(
+    document_field: str, encoder: str, encoder_to_quantization: Dict[str, str] = {}
+) -> str:
+    """Returns the field with the embeddings that scripts score documents with. For encoders with `byte`
+    quantization, this is the field with the original embeddings."""
+    if encoder_to_quantization.get(encoder, None) == 'byte':
+        return f'{document_field}-{encoder}.{FULL_PRECISION_EMBEDDING}'
+    return f'{document_field}-{encoder}.embedding'
+
+
+def get_query_embedding(embedding, metric: Optional[str] = 'cosine'):
+    """Returns the query embedding for the metric. Indices with the `dot_product` similarity
+    store normalized embeddings, so the query embedding is normalized as well."""
+    if metric == 'dot_product':
+        return normalize_embedding(embedding)
+    return embedding
+
+
+def build_es_knn_queries(
+    docs_map,
+    get_score_breakdown: bool,
+    score_calculation: List[Tuple],
+    k: int,
+    num_candidates: int,
+    filter: dict = {},
+    query_to_curated_ids: Dict[str, list] = {},
+    metric: Optional[str] = 'cosine',
+    encoder_to_quantization: Dict[str, str] = {},
+) -> List[Tuple[Document, Dict]]:
+    """
+    Build approximate kNN search requests used in Elasticsearch. Instead of scoring every
+    document with a script, each (query_field, document_field, encoder) combination in the
+    score calculation becomes a `knn` clause on the HNSW index of the corresponding
+    `dense_vector` field, boosted by its linear weight. Elasticsearch sums the boosted kNN
+    scores with the bm25 score of the `query` part of the request.
+    Note, that more than one `knn` clause per request requires Elasticsearch 8.7 or later.
+
+    :param docs_map: dictionary mapping encoder to DocumentArray.
+    :param get_score_breakdown: whether to return the embeddings of a query document.
+    :param score_calculation: list of nested lists containing (query_field, document_field, matching_method, linear_weight) which define
+        how to calculate the score. Note, that the matching_method is the name of the encoder or `bm25`.
+    :param k: number of nearest neighbours to retrieve per `knn` clause.
+    :param num_candidates: number of candidates to consider per shard for each `knn` clause.
+    :param filter: dictionary of filters to apply to the search.
+    :param query_to_curated_ids: dictionary mapping query text to list of curated ids.
+    :param metric: similarity of the embedding fields. For `dot_product`, the query
+        embeddings are normalized.
+    :param encoder_to_quantization: dictionary mapping encoder to its quantization mode. The query
+        embeddings of encoders with `byte` quantization are quantized.
+    :return: a list of tuples of query document and the body of its search request.
+    """
+    docs = {}
+    knn_clauses = defaultdict(list)
+    es_search_filter = process_filter(filter) if filter else []
+    for executor_name, da in docs_map.items():
+        for doc in da:
+            if doc.id not in docs:
+                docs[doc.id] = doc
+                docs[doc.id].tags['embeddings'] = {}
+
+            for (
+                query_field,
+                document_field,
+                matching_method,
+                linear_weight,
+            ) in get_scores(executor_name, score_calculation):
+                field_doc = get_chunk_by_field_name(doc, query_field)
+                if get_score_breakdown:
+                    docs[doc.id].tags['embeddings'][
+                        f'{query_field}-{matching_method}'
+                    ] = field_doc.embedding
+                query_vector = get_query_embedding(field_doc.embedding, metric)
+                if encoder_to_quantization.get(matching_method, None) == 'byte':
+                    query_vector = quantize_embedding(query_vector)
+                knn_clause = {
+                    'field': f'{document_field}-{matching_method}.embedding',
+                    'query_vector': query_vector,
+                    'k': k,
+                    'num_candidates': max(num_candidates, k),
+                    'boost': float(linear_weight),
+                }
+                if es_search_filter:
+                    knn_clause['filter'] = es_search_filter
+                knn_clauses[doc.id].append(knn_clause)
+
+    es_queries = []
+    for doc_id, doc in docs.items():
+        body = {}
+        if len(knn_clauses[doc_id]) == 1:
+            body['knn'] = knn_clauses[doc_id][0]
+        elif knn_clauses[doc_id]:
+            body['knn'] = knn_clauses[doc_id]
+        query = get_bm25_query(doc, score_calculation, filter)
+        pinned_query = get_pinned_query(doc, query_to_curated_ids)
+        if pinned_query:
+            pinned_query['pinned']['organic'] = query or {'match_none': {}}
+            query = pinned_query
+        if query:
+            body['query'] = query
+        es_queries.append((doc, body))
+    return es_queries
+
+
+def build_score_breakdown_script_fields(
+    doc: Document,
+    score_calculation: List[Tuple],
+    metric: str = 'cosine',
+    encoder_to_quantization: Dict[str, str] = {},
+) -> Dict:
+    """
+    Build the script fields which compute the similarity of each vector term of the score
+    calculation on the doc values of the matches. This way, the score breakdown does not
+    need the embeddings of the matches in their `_source`.
+    Expects the query embeddings in the tags of the query document, as set by the query builders
+    with `get_score_breakdown`.
+
+    :param doc: the query document.
+    :param score_calculation: list of nested lists containing (query_field, document_field, matching_method, linear_weight).
+    :param metric: metric to use for the similarities.
+    :param encoder_to_quantization: dictionary mapping encoder to its quantization mode.
+    :return: the `script_fields` of the search request, named `{query_field}-{document_field}-{encoder}`.
+    """
+    script_fields = {}
+    for (query_field, document_field, matching_method, _) in score_calculation:
+        if matching_method == 'bm25':
+            continue
+        query_embedding = get_query_embedding(
+            doc.tags['embeddings'][f'{query_field}-{matching_method}'], metric
+        )
+        script_fields[f'{query_field}-{document_field}-{matching_method}'] = {
+            'script': {
+                'id': similarity_script_ids[metric],
+                'params': {
+                    'field': get_scoring_embedding_field(
+                        document_field, matching_method, encoder_to_quantization
+                    ),
+                    'query_name': query_field,
+                    'queries': {query_field: query_embedding},
+                    'query_norms': {query_field: float(norm(query_embedding))},
+                },
+            }
+        }
+    return script_fields
+
+
+def get_bm25_query(
+    doc: Document,
+    score_calculation: List[Tuple],
+    filter: Dict = {},
+) -> Dict:
+    """
+    Build the bm25 part of a kNN search request. Other than in the script-score query,
+    it does not match all documents, so that only the kNN results and the bm25 matches
+    are retrieved.
+    """
+    should = []
+    for (query_field, index_field, matching_method, linear_weight) in score_calculation:
+        if matching_method == 'bm25':
+            text = get_chunk_by_field_name(doc, query_field).text
+            should.append(
+                {
+                    'multi_match': {
+                        'query': text,
+                        'fields': [f"{index_field}^{linear_weight}"],
+                    }
+                }
+            )
+    if not should:
+        return {}
+    query = {'bool': {'should': should, 'minimum_should_match': 1}}
+    if filter:
+        query['bool']['filter'] = process_filter(filter)
+    return query
+
+
 def get_default_query(
     doc: Document,
     score_calculation: List[Tuple],
     filter: Dict = {},
+    candidate_ids: Optional[List[str]] = None,
 ):
     query = {
         'bool': {
@@ -185,6 +549,12 @@ def get_default_query(
         es_search_filter = process_filter(filter)
         query['bool']['filter'] = es_search_filter
 
+    # restrict scoring to the candidates of a previous retrieval stage
+    if candidate_ids is not None:
+        query['bool'].setdefault('filter', []).append(
+            {'ids': {'values': candidate_ids}}
+        )
+
     return query
 
 
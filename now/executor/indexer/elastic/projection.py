@@ -0,0 +1,113 @@
+import io
+from typing import Dict, Optional
+
+import numpy as np
+
+PROJECTION_METHODS = ['pca', 'random_projection']
+
+
+class Projection:
+    """
+    Linear projection of the embeddings of an encoder to fewer dimensions. The projection is
+    either fitted with PCA on a sample of embeddings or drawn as a seeded random projection.
+    The fitted matrix is persisted, such that documents and queries are always projected alike.
+    The random projection only depends on the seed and the dimensions, so it can be fitted
+    without embeddings.
+    """
+
+    def __init__(
+        self,
+        method: str,
+        dims: int,
+        num_samples: int = 1000,
+        seed: int = 0,
+    ):
+        """
+        :param method: either 'pca' or 'random_projection'.
+        :param dims: number of dimensions after the projection.
+        :param num_samples: maximum number of embeddings PCA is fitted on.
+        :param seed: seed of the random projection and of the sampling.
+        """
+        if method not in PROJECTION_METHODS:
+            raise ValueError(
+                f'Invalid projection method {method}. Choose one of {PROJECTION_METHODS}'
+            )
+        self.method = method
+        self.dims = dims
+        self.num_samples = num_samples
+        self.seed = seed
+        self.mean: Optional[np.ndarray] = None
+        self.components: Optional[np.ndarray] = None
+
+    @property
+    def is_fitted(self) -> bool:
+        return self.components is not None
+
+    def fit(self, embeddings: np.ndarray):
+        """Fits the projection on a sample of the given embeddings.
+
+        :param embeddings: matrix with one embedding per row.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        input_dims = embeddings.shape[1]
+        if self.method == 'random_projection':
+            self.fit_random_projection(input_dims)
+            return
+        self._check_input_dims(input_dims)
+        rng = np.random.default_rng(self.seed)
+        if len(embeddings) > self.num_samples:
+            embeddings = embeddings[
+                rng.choice(len(embeddings), self.num_samples, replace=False)
+            ]
+        self.mean = embeddings.mean(axis=0)
+        _, _, vt = np.linalg.svd(embeddings - self.mean, full_matrices=False)
+        components = vt[: self.dims]
+        if len(components) < self.dims:
+            # too few samples for all components, they are completed by an orthonormal random basis
+            random_basis = rng.standard_normal((self.dims, input_dims))
+            q, _ = np.linalg.qr(np.concatenate([components, random_basis]).T)
+            components = q.T[: self.dims]
+        self.components = components.astype(np.float32)
+
+    def fit_random_projection(self, input_dims: int):
+        """Draws the seeded random projection of embeddings with `input_dims` dimensions."""
+        self._check_input_dims(input_dims)
+        rng = np.random.default_rng(self.seed)
+        self.mean = np.zeros(input_dims, dtype=np.float32)
+        self.components = rng.standard_normal((self.dims, input_dims)).astype(
+            np.float32
+        ) / np.sqrt(self.dims)
+
+    def _check_input_dims(self, input_dims: int):
+        if self.dims > input_dims:
+            raise ValueError(
+                f'Can not project {input_dims} dimensional embeddings to {self.dims} dimensions'
+            )
+
+    def transform(self, embeddings: np.ndarray) -> np.ndarray:
+        """Projects a single embedding or a matrix with one embedding per row."""
+        return (np.asarray(embeddings) - self.mean) @ self.components.T
+
+    def to_bytes(self) -> bytes:
+        buffer = io.BytesIO()
+        np.savez(buffer, mean=self.mean, components=self.components)
+        return buffer.getvalue()
+
+    def from_bytes(self, data: bytes):
+        with np.load(io.BytesIO(data)) as arrays:
+            self.mean = arrays['mean']
+            self.components = arrays['components']
+
+
+def create_projections(config: Optional[Dict[str, Dict]]) -> Dict[str, Projection]:
+    """
+    Creates the projections of the encoders from their configuration, e.g.
+    `{'clip': {'method': 'pca', 'dims': 128}}`.
+
+    :param config: dictionary mapping encoder to the arguments of its `Projection`.
+    :return: dictionary mapping encoder to its projection.
+    """
+    return {
+        encoder: Projection(**projection_config)
+        for encoder, projection_config in (config or {}).items()
+    }
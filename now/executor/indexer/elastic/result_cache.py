@@ -0,0 +1,87 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Dict, Optional
+
+from docarray import Document
+
+
+class ResultCache:
+    """
+    In-process LRU cache of search results, i.e. the matches and facets of a query, with a
+    time-to-live and a limit on the total size of the cached results. Every entry stores the index generation it was computed at, and it is
+    only returned for the same generation. This way, all entries are invalidated when the index
+    changes and the generation is bumped.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float):
+        """
+        :param max_entries: maximum number of cached results.
+        :param max_bytes: maximum total size of the serialized cached results in bytes.
+        :param ttl: time in seconds after which a cached result expires.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._num_bytes = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str, generation: int) -> Optional[Document]:
+        """Returns the cached result for the key, or `None` if it is not cached.
+
+        :param key: cache key of the query.
+        :param generation: the current index generation.
+        :return: document with the cached matches and tags.
+        """
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is not None:
+                entry_generation, expires_at, value = entry
+                if entry_generation == generation and expires_at > monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return Document.from_bytes(value)
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def put(self, key: str, result: Document, generation: int):
+        """Caches the result of a query.
+
+        :param key: cache key of the query.
+        :param result: document with the matches of the query and, e.g., its facets in the tags.
+        :param generation: the index generation when the search started. If the index changed
+            during the search, the entry is never returned.
+        """
+        value = result.to_bytes()
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (generation, monotonic() + self.ttl, value)
+            self._num_bytes += len(value)
+            while (
+                len(self._entries) > self.max_entries
+                or self._num_bytes > self.max_bytes
+            ):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: str):
+        _, _, value = self._entries.pop(key)
+        self._num_bytes -= len(value)
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._num_bytes,
+            }
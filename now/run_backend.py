@@ -108,14 +108,27 @@ def index_docs(user_input, dataset, client, print_callback, **kwargs):
     params = {'access_paths': ACCESS_PATHS}
     if user_input.secured:
         params['jwt'] = user_input.jwt
-    call_flow(
-        client=client,
-        dataset=dataset,
-        max_request_size=user_input.app_instance.max_request_size,
+    # the indexer defers the refresh of the index until all documents are loaded
+    client.post(
+        on='/bulk_load/start',
         parameters=deepcopy(params),
-        return_results=False,
-        **kwargs,
+        target_executor=r'\Aindexer\Z',
     )
+    try:
+        call_flow(
+            client=client,
+            dataset=dataset,
+            max_request_size=user_input.app_instance.max_request_size,
+            parameters=deepcopy(params),
+            return_results=False,
+            **kwargs,
+        )
+    finally:
+        client.post(
+            on='/bulk_load/end',
+            parameters=deepcopy(params),
+            target_executor=r'\Aindexer\Z',
+        )
     print_callback('⭐ Success - your data is indexed')
 
 
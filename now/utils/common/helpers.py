@@ -6,8 +6,9 @@ from collections.abc import MutableMapping
 def flatten_dict(d, parent_key='', sep='__'):
     """
     This function converts a nested dictionary into a dictionary of attirbutes using '__' as a separator.
+    The values keep their original types, such that numeric and boolean tags can be mapped accordingly.
     Example:
-        {'a': {'b': {'c': 1, 'd': 2}}} -> {'a__b__c': 1, 'a__b__c': 2}
+        {'a': {'b': {'c': 1, 'd': 2}}} -> {'a__b__c': 1, 'a__b__d': 2}
     """
     items = []
     for k, v in d.items():
@@ -15,8 +16,7 @@ def flatten_dict(d, parent_key='', sep='__'):
         if isinstance(v, MutableMapping):
             items.extend(flatten_dict(v, new_key, sep=sep).items())
         else:
-            # TODO for now, we just have string values, str(v) should be removed once we support numeric values
-            items.append((new_key, str(v)))
+            items.append((new_key, v))
     return dict(items)
 
 
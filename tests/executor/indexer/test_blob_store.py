@@ -0,0 +1,68 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from docarray import Document, DocumentArray
+
+from now.executor.indexer.elastic.blob_store import (
+    BLOB_REF_TAG,
+    LocalBlobStore,
+    create_blob_store,
+)
+
+
+def test_local_blob_store_externalize_and_resolve(tmpdir):
+    blob_store = create_blob_store({'type': 'local', 'path': str(tmpdir)})
+    assert isinstance(blob_store, LocalBlobStore)
+    tags = {'color': 'red'}
+    docs = DocumentArray(
+        [
+            Document(
+                chunks=[
+                    Document(
+                        chunks=[
+                            Document(blob=b'frame', tags=tags),
+                            Document(blob=b'frame', tags=tags),
+                            Document(text='no blob'),
+                        ]
+                    )
+                ]
+            )
+        ]
+    )
+
+    blob_store.externalize(docs)
+
+    frames = docs[0].chunks[0].chunks
+    assert frames[0].blob == b''
+    assert frames[0].tags[BLOB_REF_TAG] == frames[1].tags[BLOB_REF_TAG]
+    assert BLOB_REF_TAG not in tags
+    assert BLOB_REF_TAG not in frames[2].tags
+    # equal blobs are stored only once
+    assert len(tmpdir.listdir()) == 1
+
+    # the references survive the serialization of the documents
+    docs = DocumentArray.from_protobuf(docs.to_protobuf())
+    blob_store.resolve(docs, by_reference=True)
+
+    frames = docs[0].chunks[0].chunks
+    assert [frame.blob for frame in frames] == [b'frame', b'frame', b'']
+    assert frames[0].tags == {'color': 'red'}
+
+
+def test_local_blob_store_concurrent_put(tmpdir):
+    blob_store = LocalBlobStore(str(tmpdir))
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(lambda _: blob_store.put('abcd', b'blob'), range(32)))
+
+    assert blob_store.get('abcd') == b'blob'
+    # no temporary file is left behind
+    assert [f.basename for f in tmpdir.join('ab').listdir()] == ['abcd']
+
+
+def test_create_blob_store():
+    assert create_blob_store(None) is None
+    with pytest.raises(ValueError):
+        create_blob_store({'type': 'ftp'})
+    # the local blob store has no default path, since it must be shared by all replicas
+    with pytest.raises(ValueError):
+        create_blob_store({'type': 'local'})
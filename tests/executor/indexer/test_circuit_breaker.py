@@ -0,0 +1,51 @@
+import pytest
+
+from now.executor.indexer.elastic.circuit_breaker import (
+    CircuitBreaker,
+    CircuitOpenError,
+)
+
+
+def _fail(circuit_breaker, exception=ConnectionError('unavailable')):
+    with pytest.raises(type(exception)):
+        with circuit_breaker:
+            raise exception
+
+
+def test_circuit_breaker_opens_after_consecutive_failures():
+    circuit_breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    _fail(circuit_breaker)
+    assert circuit_breaker.get_state()['state'] == 'closed'
+    _fail(circuit_breaker)
+    assert circuit_breaker.get_state()['state'] == 'open'
+    with pytest.raises(CircuitOpenError):
+        with circuit_breaker:
+            pass
+    assert circuit_breaker.get_state()['rejected'] == 1
+
+
+def test_circuit_breaker_closes_after_successful_trial():
+    circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    _fail(circuit_breaker)
+    assert circuit_breaker.get_state()['state'] == 'open'
+    with circuit_breaker:
+        assert circuit_breaker.get_state()['state'] == 'half_open'
+    assert circuit_breaker.get_state()['state'] == 'closed'
+    assert circuit_breaker.get_state()['consecutive_failures'] == 0
+
+
+def test_circuit_breaker_reopens_after_failed_trial():
+    circuit_breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0)
+    for _ in range(3):
+        _fail(circuit_breaker)
+    _fail(circuit_breaker)
+    assert circuit_breaker.get_state()['state'] == 'open'
+
+
+def test_circuit_breaker_ignores_other_exceptions():
+    circuit_breaker = CircuitBreaker(
+        failure_threshold=1,
+        is_failure=lambda e: isinstance(e, ConnectionError),
+    )
+    _fail(circuit_breaker, ValueError('invalid query'))
+    assert circuit_breaker.get_state()['state'] == 'closed'
@@ -1,13 +1,17 @@
 import os
 
 import numpy as np
-from docarray import Document
+import pytest
+from docarray import Document, DocumentArray
 from docarray.score import NamedScore
 
 from now.executor.indexer.elastic.elastic_indexer import aggregate_embeddings
 from now.executor.indexer.elastic.es_converter import (
     calculate_score_breakdown,
+    calculate_score_breakdowns,
+    coerce_boolean_tags,
     convert_doc_map_to_es,
+    convert_es_to_da,
 )
 
 
@@ -36,6 +40,15 @@ def test_convert_doc_map_to_es(es_inputs, random_index_name):
     assert first_result['id'] == first_doc_clip.id
     assert first_result['title'] == first_doc_clip.title.text
     assert first_result['_op_type'] == 'index'
+    # embeddings are stored in separate fields, but not in the serialized document
+    assert first_doc_clip.title.embedding is not None
+    stored_doc = convert_es_to_da(
+        {'_id': first_doc_clip.id, '_source': first_result},
+        get_score_breakdown=False,
+    )[0]
+    assert stored_doc.id == first_doc_clip.id
+    assert stored_doc.title.text == first_doc_clip.title.text
+    assert stored_doc.title.embedding is None
 
 
 def test_calculate_score_breakdown(es_inputs):
@@ -79,3 +92,175 @@ def test_calculate_score_breakdown(es_inputs):
     }
     for score, val in scores.items():
         assert doc_score_breakdown.scores[score].value == val['value']
+
+
+def test_calculate_score_breakdowns(es_inputs):
+    """
+    This test tests that the batched score breakdown of several retrieved documents
+    equals the score breakdown of each single document.
+    """
+    default_score_calculation = es_inputs.default_score_calculation
+    metric = 'cosine'
+    np.random.seed(0)
+    query_embedding = np.random.random(8)
+
+    def get_docs():
+        query_doc = Document(tags={'embeddings': {'query_text-clip': query_embedding}})
+        retrieved_docs = [
+            Document(
+                id=str(i),
+                tags={
+                    'embeddings': {
+                        'title-clip.embedding': np.arange(8) + i,
+                        'gif-clip.embedding': np.arange(8)[::-1] + i,
+                    }
+                },
+                scores={metric: NamedScore(value=3.0 + i)},
+            )
+            for i in range(3)
+        ]
+        return query_doc, retrieved_docs
+
+    query_doc, retrieved_docs = get_docs()
+    batched = calculate_score_breakdowns(
+        query_doc, retrieved_docs, default_score_calculation, metric
+    )
+    query_doc, retrieved_docs = get_docs()
+    for batched_doc, retrieved_doc in zip(batched, retrieved_docs):
+        single = calculate_score_breakdown(
+            query_doc, retrieved_doc, default_score_calculation, metric
+        )
+        assert {k: v.value for k, v in batched_doc.scores.items()} == {
+            k: v.value for k, v in single.scores.items()
+        }
+        assert 'embeddings' not in batched_doc.tags
+
+
+def test_calculate_score_breakdowns_from_similarities(es_inputs):
+    """
+    This test tests that the similarities computed by the script fields of Elasticsearch
+    are used for the score breakdown instead of the embeddings.
+    """
+    default_score_calculation = es_inputs.default_score_calculation
+    metric = 'cosine'
+    query_doc = Document(tags={'embeddings': {}})
+    retrieved_doc = Document(
+        tags={
+            'similarities': {
+                'query_text-title-clip': 0.5,
+                'query_text-gif-clip': 0.25,
+            }
+        },
+        scores={metric: NamedScore(value=3.0)},
+    )
+    [retrieved_doc] = calculate_score_breakdowns(
+        query_doc, [retrieved_doc], default_score_calculation, metric
+    )
+    assert retrieved_doc.scores['query_text-title-clip-1'].value == 0.5
+    assert retrieved_doc.scores['query_text-gif-clip-1'].value == 0.25
+    assert retrieved_doc.scores['total'].value == 3.0
+    assert 'similarities' not in retrieved_doc.tags
+
+
+def test_convert_doc_map_to_es_with_normalized_embeddings(es_inputs):
+    """
+    This test tests that the embeddings are stored with unit length if they are normalized.
+    """
+    index_docs_map = es_inputs.index_docs_map
+    document_mappings = es_inputs.document_mappings[0]
+    encoder_to_fields = {document_mappings[0]: document_mappings[2]}
+    aggregate_embeddings(index_docs_map)
+    es_doc = convert_doc_map_to_es(
+        docs_map=index_docs_map,
+        index_name='now-index',
+        encoder_to_fields=encoder_to_fields,
+        normalize_embeddings=True,
+    )[0]
+    for field in document_mappings[2]:
+        embedding = es_doc[f'{field}-clip.embedding']
+        assert np.linalg.norm(embedding) == pytest.approx(1.0)
+
+
+def test_convert_doc_map_to_es_with_byte_quantization(es_inputs):
+    """
+    This test tests that the embeddings of encoders with byte quantization are stored as bytes
+    next to the original embeddings.
+    """
+    index_docs_map = es_inputs.index_docs_map
+    document_mappings = es_inputs.document_mappings[0]
+    encoder_to_fields = {document_mappings[0]: document_mappings[2]}
+    aggregate_embeddings(index_docs_map)
+    original_embedding = index_docs_map['clip'][0].title.embedding
+    es_doc = convert_doc_map_to_es(
+        docs_map=index_docs_map,
+        index_name='now-index',
+        encoder_to_fields=encoder_to_fields,
+        encoder_to_quantization={'clip': 'byte'},
+    )[0]
+    quantized = np.array(es_doc['title-clip.embedding'])
+    assert np.abs(quantized).max() == 127
+    np.testing.assert_array_equal(
+        es_doc['title-clip.embedding_full'], original_embedding
+    )
+    cosine = (
+        quantized
+        @ original_embedding
+        / (np.linalg.norm(quantized) * np.linalg.norm(original_embedding))
+    )
+    assert cosine > 0.99
+
+
+def test_coerce_boolean_tags():
+    """
+    This test tests that values of boolean tags which Elasticsearch can not index are removed.
+    """
+    tags = {'a': True, 'b': 'False', 'c': 'N/A', 'd': 1, 'e': 'N/A'}
+    assert coerce_boolean_tags(tags, ['a', 'b', 'c', 'd', 'f']) == {
+        'a': True,
+        'b': False,
+        'e': 'N/A',
+    }
+    assert tags['b'] == 'False'
+
+
+@pytest.mark.parametrize('aggregation', ['mean', 'max', 'weighted'])
+def test_aggregate_embeddings(aggregation):
+    """
+    This test tests that the batched aggregation of the sentence embeddings equals
+    the aggregation of each field on its own.
+    """
+    rng = np.random.default_rng(0)
+    docs = DocumentArray(
+        [
+            Document(
+                chunks=[
+                    Document(
+                        chunks=[
+                            Document(
+                                text=f'sentence {j}',
+                                embedding=rng.random(4).astype(np.float32),
+                                weight=j + 1,
+                            )
+                            for j in range(i + 1)
+                        ]
+                    )
+                ]
+            )
+            for i in range(3)
+        ]
+    )
+    sentence_embeddings = [d.chunks[0].chunks.embeddings for d in docs]
+    sentence_weights = [[cc.weight for cc in d.chunks[0].chunks] for d in docs]
+
+    aggregate_embeddings({'clip': docs}, aggregation=aggregation)
+
+    for doc, embeddings, weights in zip(docs, sentence_embeddings, sentence_weights):
+        if aggregation == 'mean':
+            expected = embeddings.mean(axis=0)
+        elif aggregation == 'max':
+            expected = embeddings.max(axis=0)
+        else:
+            expected = np.average(embeddings, axis=0, weights=weights)
+        np.testing.assert_allclose(doc.chunks[0].embedding, expected, rtol=1e-5)
+        assert doc.chunks[0].text == 'sentence 0'
+        assert len(doc.chunks[0].chunks) == 0
@@ -1,10 +1,19 @@
+import numpy as np
 import pytest
 
 from now.executor.indexer.elastic.elastic_indexer import aggregate_embeddings
 from now.executor.indexer.elastic.es_query_building import (
+    MAX_UNROLLED_SCORE_TERMS,
+    build_es_knn_queries,
     build_es_queries,
+    build_score_breakdown_script_fields,
     generate_score_calculation,
+    get_score_script,
     process_filter,
+    similarity_script_ids,
+    stored_script_ids,
+    stored_scripts,
+    unrolled_score_script_ids,
 )
 
 
@@ -51,7 +60,7 @@ def test_build_es_queries(es_inputs):
         get_score_breakdown=False,
         score_calculation=default_score_calculation,
     )[0]
-    print(es_query)
+    query_embedding = query_docs_map['clip'][0].query_text.embedding
     assert es_query == {
         'script_score': {
             'query': {
@@ -63,17 +72,207 @@ def test_build_es_queries(es_inputs):
                 }
             },
             'script': {
-                'source': "1.0 + _score / (_score + 10.0) + 1.0*cosineSimilarity(params.query_query_text_clip, 'title-clip.embedding') + 1.0*cosineSimilarity(params.query_query_text_clip, 'gif-clip.embedding')",
+                'id': 'now-cosine-score-2-v2',
                 'params': {
-                    'query_query_text_clip': query_docs_map['clip'][
-                        0
-                    ].query_text.embedding,
+                    'bm25': True,
+                    'f0': 'title-clip.embedding',
+                    'q0': query_embedding,
+                    'w0': 1.0,
+                    'f1': 'gif-clip.embedding',
+                    'q1': query_embedding,
+                    'w1': 1.0,
                 },
             },
         }
     }
 
 
+def test_build_es_queries_with_dot_product(es_inputs):
+    """
+    This test tests that the query embeddings are normalized once for the dot_product
+    similarity, such that the results equal the cosine similarity.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        _,
+    ) = es_inputs
+    aggregate_embeddings(query_docs_map)
+    _, es_query = build_es_queries(
+        docs_map=query_docs_map,
+        get_score_breakdown=False,
+        score_calculation=default_score_calculation,
+        metric='dot_product',
+    )[0]
+    query_embedding = query_docs_map['clip'][0].query_text.embedding
+    script = es_query['script_score']['script']
+    assert script['id'] == 'now-dot-product-score-2-v2'
+    np.testing.assert_allclose(
+        script['params']['q0'], query_embedding / np.linalg.norm(query_embedding)
+    )
+
+
+def test_get_score_script():
+    """
+    This test tests that each vector term is scored by its own native function call, and
+    that score calculations with too many terms fall back to the generic script.
+    """
+    terms = [(f'field{i}-clip.embedding', 'query', [1.0, 0.0], 1.0) for i in range(3)]
+    script = get_score_script(terms, bm25=False, metric='l2_norm')
+    assert script['id'] == unrolled_score_script_ids['l2_norm'][3]
+    source = stored_scripts[script['id']]
+    assert source.count('l2norm(') == 3
+    assert 'l2norm(params.q2, params.f2)' in source
+
+    terms = terms * (MAX_UNROLLED_SCORE_TERMS // 3 + 1)
+    script = get_score_script(terms, bm25=True)
+    assert script['id'] == stored_script_ids['cosine']
+    assert len(script['params']['fields']) == len(terms)
+    assert script['params']['query_norms'] == {'query': pytest.approx(1.0)}
+
+
+def test_build_es_queries_with_candidate_ids(es_inputs):
+    """
+    This test tests that the script-score query only scores the given candidates
+    when candidate ids are passed to build_es_queries.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        _,
+    ) = es_inputs
+    aggregate_embeddings(query_docs_map)
+    query_doc_id = query_docs_map['clip'][0].id
+    _, es_query = build_es_queries(
+        docs_map=query_docs_map,
+        get_score_breakdown=False,
+        score_calculation=default_score_calculation,
+        filter={'tags__color': ['red']},
+        candidate_ids={query_doc_id: ['0', '1']},
+    )[0]
+    assert es_query['script_score']['query']['bool']['filter'] == [
+        {'terms': {'tags.color': ['red']}},
+        {'ids': {'values': ['0', '1']}},
+    ]
+
+
+def test_build_es_knn_queries(es_inputs):
+    """
+    This test tests the build_es_knn_queries function from es_query_building.
+    It should return one kNN clause per query-doc field pair that is in the same
+    vector space, boosted by its linear weight, and a bm25 query for the text fields.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        _,
+    ) = es_inputs
+    aggregate_embeddings(query_docs_map)
+    _, es_body = build_es_knn_queries(
+        docs_map=query_docs_map,
+        get_score_breakdown=False,
+        score_calculation=default_score_calculation,
+        k=10,
+        num_candidates=5,
+        filter={'tags__color': ['red']},
+    )[0]
+    query_embedding = query_docs_map['clip'][0].query_text.embedding
+    assert es_body == {
+        'knn': [
+            {
+                'field': 'title-clip.embedding',
+                'query_vector': query_embedding,
+                'k': 10,
+                'num_candidates': 10,
+                'boost': 1.0,
+                'filter': [{'terms': {'tags.color': ['red']}}],
+            },
+            {
+                'field': 'gif-clip.embedding',
+                'query_vector': query_embedding,
+                'k': 10,
+                'num_candidates': 10,
+                'boost': 1.0,
+                'filter': [{'terms': {'tags.color': ['red']}}],
+            },
+        ],
+        'query': {
+            'bool': {
+                'should': [{'multi_match': {'query': 'cat', 'fields': ['title^10']}}],
+                'minimum_should_match': 1,
+                'filter': [{'terms': {'tags.color': ['red']}}],
+            }
+        },
+    }
+
+
+def test_build_es_knn_queries_with_byte_quantization(es_inputs):
+    """
+    This test tests that the query vectors of encoders with byte quantization are quantized.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        _,
+    ) = es_inputs
+    aggregate_embeddings(query_docs_map)
+    _, es_body = build_es_knn_queries(
+        docs_map=query_docs_map,
+        get_score_breakdown=False,
+        score_calculation=default_score_calculation,
+        k=10,
+        num_candidates=5,
+        encoder_to_quantization={'clip': 'byte'},
+    )[0]
+    for knn_clause in es_body['knn']:
+        assert all(isinstance(value, int) for value in knn_clause['query_vector'])
+        assert max(abs(value) for value in knn_clause['query_vector']) == 127
+
+
+def test_build_score_breakdown_script_fields(es_inputs):
+    """
+    This test tests that one script field per vector term of the score calculation
+    is built from the query embeddings in the tags of the query document.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        _,
+    ) = es_inputs
+    aggregate_embeddings(query_docs_map)
+    query_doc, _ = build_es_queries(
+        docs_map=query_docs_map,
+        get_score_breakdown=True,
+        score_calculation=default_score_calculation,
+    )[0]
+    script_fields = build_score_breakdown_script_fields(
+        query_doc, default_score_calculation
+    )
+    query_embedding = query_docs_map['clip'][0].query_text.embedding
+    assert list(script_fields.keys()) == [
+        'query_text-title-clip',
+        'query_text-gif-clip',
+    ]
+    script = script_fields['query_text-gif-clip']['script']
+    assert script['id'] == similarity_script_ids['cosine']
+    assert script['params']['field'] == 'gif-clip.embedding'
+    assert script['params']['query_name'] == 'query_text'
+    assert script['params']['queries']['query_text'] is query_embedding
+    assert script['params']['query_norms']['query_text'] == pytest.approx(
+        np.linalg.norm(query_embedding)
+    )
+
+
 TEST_FILTERS = [
     ({'tags__price': {'gt': 10, 'lt': 100}}, None),
     ({'tags__price': {'gt': 10}}, None),
@@ -1,7 +1,17 @@
+import asyncio
+import hashlib
 import os
+from concurrent.futures import ThreadPoolExecutor
+from copy import deepcopy
+from time import time
 
+import numpy as np
+import pytest
+from docarray import Document, DocumentArray
 from docarray.typing import Text
 
+from now.executor.indexer.elastic.blob_store import BLOB_REF_TAG
+from now.executor.indexer.elastic.circuit_breaker import CircuitOpenError
 from now.executor.indexer.elastic.elastic_indexer import (
     FieldEmbedding,
     NOWElasticIndexer,
@@ -27,6 +37,7 @@ def test_generate_es_mappings(setup_service_running, random_index_name):
     expected_mapping = {
         'properties': {
             'id': {'type': 'keyword'},
+            'serialized_doc_v2': {'type': 'binary'},
             'text_0': {'type': 'text', 'analyzer': 'standard'},
             'title-clip': {
                 'properties': {
@@ -44,6 +55,63 @@ def test_generate_es_mappings(setup_service_running, random_index_name):
     assert result == expected_mapping
 
 
+def test_generate_es_mappings_with_quantization(
+    setup_service_running, random_index_name
+):
+    """
+    This test tests that the vector index of encoders with byte quantization stores bytes,
+    while the original embeddings are stored in a field that is not indexed.
+    """
+    document_mappings = [FieldEmbedding('clip', 8, ['title'], 'byte')]
+    user_input = UserInput()
+    user_input.index_fields = ['title']
+    user_input.index_field_candidates_to_modalities = {'title': Text}
+    user_input.field_names_to_dataclass_fields = {'title': 'text_0'}
+    es_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+        rescore_quantized=True,
+    )
+    result = es_indexer.generate_es_mapping()
+    assert result['properties']['title-clip'] == {
+        'properties': {
+            'embedding': {
+                'type': 'dense_vector',
+                'dims': '8',
+                'similarity': 'cosine',
+                'index': 'true',
+                'element_type': 'byte',
+            },
+            'embedding_full': {
+                'type': 'dense_vector',
+                'dims': '8',
+                'index': 'false',
+            },
+        }
+    }
+    vector_config = es_indexer.vector_config()[0].tags
+    assert vector_config['clip']['quantization'] == 'byte'
+    assert vector_config['clip']['rescore']
+
+
+def test_int8_hnsw_quantization_requires_elasticsearch_8_12(
+    setup_service_running, random_index_name
+):
+    """
+    This test tests that the indexer refuses `int8_hnsw` quantization at startup, since the
+    test cluster runs Elasticsearch 8.7.
+    """
+    user_input = UserInput()
+    user_input.index_fields = ['title']
+    user_input.index_field_candidates_to_modalities = {'title': Text}
+    user_input.field_names_to_dataclass_fields = {'title': 'text_0'}
+    with pytest.raises(ValueError, match='requires Elasticsearch 8.12'):
+        NOWElasticIndexer(
+            document_mappings=[FieldEmbedding('sbert', 4, ['title'], 'int8_hnsw')],
+            user_input_dict=user_input.to_safe_dict(),
+        )
+
+
 def test_index_and_search_with_multimodal_docs(
     setup_service_running, es_inputs, random_index_name
 ):
@@ -146,12 +214,10 @@ def test_count_endpoint(setup_service_running, es_inputs, random_index_name):
     es_indexer.index(index_docs_map)
     result = es_indexer.count()
     assert result[0].tags['count'] == len(index_docs_map['clip'])
-    limit = 1
-    result_with_limit = es_indexer.count(parameters={'limit': limit})
-    assert result_with_limit[0].tags['count'] == limit
-    offset = 1
-    result_with_offset = es_indexer.count(parameters={'offset': offset})
-    assert result_with_offset[0].tags['count'] == len(index_docs_map['clip']) - offset
+    result_with_filter = es_indexer.count(
+        parameters={'filter': {'tags__price': {'lte': 1}}}
+    )
+    assert result_with_filter[0].tags['count'] == 1
 
 
 def test_delete_by_id(setup_service_running, es_inputs, random_index_name):
@@ -172,7 +238,12 @@ def test_delete_by_id(setup_service_running, es_inputs, random_index_name):
     es_indexer.index(index_docs_map)
     # delete by id
     ids = [doc.id for doc in index_docs_map['clip']]
-    es_indexer.delete(parameters={'ids': ids})
+    result = es_indexer.delete(parameters={'ids': ids + ['not_indexed']})
+    assert result[0].tags['deleted'] == len(ids)
+    assert result[0].tags['results'] == {
+        **{id: 'deleted' for id in ids},
+        'not_indexed': 'not_found',
+    }
 
     es = es_indexer.es
     res = es.search(index=os.getenv('ES_INDEX_NAME'), size=100, query={'match_all': {}})
@@ -324,3 +395,1027 @@ def test_search_with_multiple_filters(
     assert len(res[0].matches) == 1
     assert res[0].matches[0].tags['color'] in ['red', 'blue', 'green']
     assert res[0].matches[0].tags['price'] < 1
+
+
+def test_search_with_multiple_queries(
+    setup_service_running, es_inputs, random_index_name
+):
+    """
+    This test tests that all query documents of a request get their own matches
+    when they are sent to Elasticsearch in a single multi-search request.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        user_input,
+    ) = es_inputs
+    es_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+    )
+    es_indexer.index(index_docs_map)
+
+    second_query = Document(query_docs_map['clip'][0], copy=True)
+    second_query.id = 'second_query'
+    query_docs_map['clip'].append(second_query)
+    res = es_indexer.search(
+        query_docs_map,
+        parameters={'score_calculation': default_score_calculation},
+    )
+    assert len(res) == 2
+    assert [doc.id for doc in res] == [query_docs_map['clip'][0].id, 'second_query']
+    for query_doc in res:
+        assert len(query_doc.matches) == len(index_docs_map['clip'])
+
+
+def test_search_with_knn_retrieval_mode(
+    setup_service_running, es_inputs, random_index_name
+):
+    """
+    This test tests the search endpoint of the NOWElasticIndexer using approximate kNN retrieval.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        user_input,
+    ) = es_inputs
+    es_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+        retrieval_mode='knn',
+        knn_num_candidates=10,
+    )
+    es_indexer.index(index_docs_map)
+
+    res = es_indexer.search(
+        query_docs_map,
+        parameters={
+            'score_calculation': default_score_calculation,
+            'filter': {'tags__price': {'lte': 1}},
+        },
+    )
+    assert len(res[0].matches) == 1
+    assert res[0].matches[0].tags['price'] < 1
+
+
+def test_search_with_two_stage_retrieval_mode(
+    setup_service_running, es_inputs, random_index_name
+):
+    """
+    This test tests that the two-stage retrieval returns the same ranking as the
+    exact script-score search when all documents fit into the rescore window.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        user_input,
+    ) = es_inputs
+    es_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+        retrieval_mode='two_stage',
+    )
+    es_indexer.index(index_docs_map)
+
+    res = es_indexer.search(
+        query_docs_map,
+        parameters={
+            'score_calculation': default_score_calculation,
+            'rescore_window': 10,
+        },
+    )
+    assert len(res[0].matches) == 2
+    assert res[0].matches[0].id == '0'
+    assert res[0].matches[1].id == '1'
+
+
+def test_script_stats_endpoint(setup_service_running, es_inputs, random_index_name):
+    """
+    This test tests that searches use the stored score scripts and that
+    the script_stats endpoint reports them as cache hits. kNN searches run no
+    score script and are not counted.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        user_input,
+    ) = es_inputs
+    es_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+    )
+    es_indexer.index(index_docs_map)
+    es_indexer.search(
+        query_docs_map,
+        parameters={'score_calculation': default_score_calculation},
+    )
+    es_indexer.search(
+        deepcopy(query_docs_map),
+        parameters={
+            'score_calculation': default_score_calculation,
+            'retrieval_mode': 'knn',
+        },
+    )
+    stats = es_indexer.script_stats()[0].tags
+    assert stats['cache_hits'] + stats['cache_misses'] >= 1
+    assert es_indexer.num_stored_script_queries == 1
+
+
+def test_bulk_load(setup_service_running, es_inputs, random_index_name):
+    """
+    This test tests that documents indexed during a bulk load become searchable
+    once the bulk load is finished and that the index settings are restored, also if
+    another executor replica ends the bulk load.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        user_input,
+    ) = es_inputs
+    es_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+        bulk_chunk_size=1,
+        bulk_thread_count=2,
+    )
+    es = es_indexer.es
+    index_name = os.getenv('ES_INDEX_NAME')
+    es_indexer.start_bulk_load()
+    settings = es.indices.get_settings(index=index_name)[index_name]['settings']
+    assert settings['index']['refresh_interval'] == '-1'
+
+    es_indexer.index(index_docs_map)
+    NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+    ).end_bulk_load()
+    settings = es.indices.get_settings(index=index_name)[index_name]['settings']
+    assert 'refresh_interval' not in settings['index']
+    res = es.search(index=index_name, size=100, query={'match_all': {}})
+    assert len(res['hits']['hits']) == len(index_docs_map['clip'])
+
+
+def test_tags_are_updated_incrementally(
+    setup_service_running, es_inputs, random_index_name
+):
+    """
+    This test tests that the tag values of indexed documents are added without
+    aggregating over the whole index, and that the tags endpoint can refresh them.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        user_input,
+    ) = es_inputs
+    user_input.filter_fields = ['color']
+    es_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+        tags_max_staleness=3600,
+    )
+    es_indexer.tags_aggregated_at = time()
+    es_indexer.index(index_docs_map)
+    expected_colors = {doc.tags['color'] for doc in index_docs_map['clip']}
+    tags = es_indexer.tags()[0].tags
+    assert set(tags['tags']['color']) == expected_colors
+    assert tags['max_staleness'] == 3600
+
+    es_indexer.delete(parameters={'ids': [doc.id for doc in index_docs_map['clip']]})
+    tags = es_indexer.tags(parameters={'refresh': True})[0].tags
+    assert tags['tags'] == {'color': []}
+    assert tags['seconds_since_aggregation'] < 60
+
+
+def test_list_endpoint_with_cursor(setup_service_running, es_inputs, random_index_name):
+    """
+    This test tests the cursor-based pagination of the NOWElasticIndexer.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        user_input,
+    ) = es_inputs
+    es_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+    )
+    es_indexer.index(index_docs_map)
+    listed_ids = []
+    cursor = ''
+    while cursor is not None:
+        result = es_indexer.list(parameters={'limit': 1, 'cursor': cursor})
+        assert len(result[0].matches) <= 1
+        listed_ids += [doc.id for doc in result[0].matches]
+        cursor = result[0].tags['cursor']
+    assert sorted(listed_ids) == sorted(doc.id for doc in index_docs_map['clip'])
+
+    result = es_indexer.list(parameters={'limit': 10, 'cursor': '', 'fields': ['tags']})
+    assert len(result[0].matches) == len(index_docs_map['clip'])
+    assert all(list(doc.tags.keys()) == ['tags'] for doc in result[0].matches)
+    assert result[0].tags['cursor'] is None
+
+
+def test_search_with_fields(setup_service_running, es_inputs, random_index_name):
+    """
+    This test tests that only the requested fields are returned when searching with `fields`.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        user_input,
+    ) = es_inputs
+    es_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+    )
+    es_indexer.index(index_docs_map)
+
+    res = es_indexer.search(
+        query_docs_map,
+        parameters={
+            'score_calculation': default_score_calculation,
+            'fields': ['title', 'tags.color'],
+        },
+    )
+    for match in res[0].matches:
+        assert set(match.tags.keys()) == {'title', 'tags'}
+        assert list(match.tags['tags'].keys()) == ['color']
+
+
+def test_search_with_embeddings_excluded_from_source(
+    setup_service_running, es_inputs, random_index_name
+):
+    """
+    This test tests that the score breakdown is computed from the vector index if the
+    embeddings are not stored in the `_source` of the Elasticsearch documents.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        user_input,
+    ) = es_inputs
+    es_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+        exclude_embeddings_from_source=True,
+    )
+    es_indexer.index(index_docs_map)
+    hit = es_indexer.es.search(index=os.getenv('ES_INDEX_NAME'), size=1)['hits'][
+        'hits'
+    ][0]
+    assert not any(key.startswith('title-clip') for key in hit['_source'])
+
+    res = es_indexer.search(
+        query_docs_map,
+        parameters={
+            'score_calculation': default_score_calculation,
+            'get_score_breakdown': True,
+        },
+    )
+    match = res[0].matches[0]
+    assert -1 <= match.scores['query_text-title-clip-1'].value <= 1
+    assert -1 <= match.scores['query_text-gif-clip-1'].value <= 1
+    assert 'bm25_raw' in match.scores
+    assert 'similarities' not in match.tags
+
+
+def test_search_with_normalized_embeddings(
+    setup_service_running, es_inputs, random_index_name
+):
+    """
+    This test tests that an index with normalized embeddings and the dot_product similarity
+    returns the same scores as the cosine index, and that a cosine index can be migrated to it.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        user_input,
+    ) = es_inputs
+    es_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+    )
+    es_indexer.index(index_docs_map)
+    parameters = {'score_calculation': default_score_calculation}
+    cosine_scores = [
+        m.scores['cosine'].value
+        for m in es_indexer.search(query_docs_map, parameters=parameters)[0].matches
+    ]
+
+    es_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+        normalize_embeddings=True,
+    )
+    # the existing cosine index keeps its similarity until it is migrated
+    assert es_indexer.similarity == 'cosine'
+    response = es_indexer.migrate_to_normalized_embeddings()
+    assert response[0].tags['migrated'] == len(index_docs_map['clip'])
+    assert es_indexer.similarity == 'dot_product'
+    assert es_indexer._get_index_similarity() == 'dot_product'
+    # the index name is switched to an alias of the migrated, versioned index
+    index_name = os.getenv('ES_INDEX_NAME')
+    assert list(es_indexer.es.indices.get_alias(name=index_name)) == [
+        f'{index_name}-v1'
+    ]
+    assert es_indexer.es.count(index=index_name)['count'] == len(index_docs_map['clip'])
+
+    dot_product_scores = [
+        m.scores['cosine'].value
+        for m in es_indexer.search(query_docs_map, parameters=parameters)[0].matches
+    ]
+    assert dot_product_scores == pytest.approx(cosine_scores, abs=1e-5)
+
+
+def test_migrate_to_normalized_embeddings_excluded_from_source(
+    setup_service_running, es_inputs, random_index_name
+):
+    """
+    This test tests that the embeddings are kept when a cosine index is migrated to
+    normalized embeddings which are excluded from the `_source`.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        user_input,
+    ) = es_inputs
+    es_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+    )
+    es_indexer.index(index_docs_map)
+    parameters = {'score_calculation': default_score_calculation}
+    cosine_scores = [
+        m.scores['cosine'].value
+        for m in es_indexer.search(query_docs_map, parameters=parameters)[0].matches
+    ]
+
+    es_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+        normalize_embeddings=True,
+        exclude_embeddings_from_source=True,
+    )
+    response = es_indexer.migrate_to_normalized_embeddings()
+    assert response[0].tags['migrated'] == len(index_docs_map['clip'])
+    hit = es_indexer.es.search(index=os.getenv('ES_INDEX_NAME'), size=1)['hits'][
+        'hits'
+    ][0]
+    assert not any(key.startswith('title-clip') for key in hit['_source'])
+
+    dot_product_scores = [
+        m.scores['cosine'].value
+        for m in es_indexer.search(query_docs_map, parameters=parameters)[0].matches
+    ]
+    assert dot_product_scores == pytest.approx(cosine_scores, abs=1e-5)
+
+
+@pytest.mark.parametrize('retrieval_mode', ['script_score', 'knn'])
+def test_search_with_byte_quantization(
+    setup_service_running, es_inputs, random_index_name, retrieval_mode
+):
+    """
+    This test tests that documents are found in the byte vector index and that they are
+    scored with the original embeddings.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        user_input,
+    ) = es_inputs
+    es_indexer = NOWElasticIndexer(
+        document_mappings=[[*dm, 'byte'] for dm in document_mappings],
+        user_input_dict=user_input.to_safe_dict(),
+        retrieval_mode=retrieval_mode,
+        rescore_quantized=True,
+    )
+    es_indexer.index(index_docs_map)
+    res = es_indexer.search(
+        query_docs_map,
+        parameters={
+            'score_calculation': default_score_calculation,
+            'get_score_breakdown': True,
+        },
+    )
+    assert len(res[0].matches) == len(index_docs_map['clip'])
+    match = res[0].matches[0]
+    assert -1 <= match.scores['query_text-title-clip-1'].value <= 1
+
+
+def test_search_with_projection(setup_service_running, es_inputs, random_index_name):
+    """
+    This test tests that embeddings are projected to fewer dimensions with a projection
+    which is fitted on the staged documents at the end of the bulk load and shared with the
+    other replicas through Elasticsearch.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        user_input,
+    ) = es_inputs
+    es_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+        projections={'clip': {'method': 'pca', 'dims': 2}},
+    )
+    assert (
+        es_indexer.es_mapping['properties']['title-clip']['properties']['embedding'][
+            'dims'
+        ]
+        == '2'
+    )
+    replica = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+        projections={'clip': {'method': 'pca', 'dims': 2}},
+    )
+    es_indexer.index(deepcopy(index_docs_map))
+    # fewer embeddings than `num_samples` are indexed, so the documents are staged
+    assert not es_indexer.projections['clip'].is_fitted
+    assert es_indexer.es.count(index=es_indexer.index_name)['count'] == 0
+    es_indexer.end_bulk_load()
+    assert es_indexer.es.exists(index=es_indexer.projection_index_name, id='clip')
+    assert es_indexer.es.count(index=es_indexer.index_name)['count'] == len(
+        index_docs_map['clip']
+    )
+
+    # the replica loads the projection fitted by the other one
+    res = replica.search(
+        query_docs_map,
+        parameters={'score_calculation': default_score_calculation},
+    )
+    assert len(res[0].matches) == len(index_docs_map['clip'])
+    np.testing.assert_allclose(
+        replica.projections['clip'].components,
+        es_indexer.projections['clip'].components,
+    )
+
+    # the index is not empty, so a lost projection is not fitted again
+    es_indexer.es.delete(index=es_indexer.projection_index_name, id='clip')
+    restarted_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+        projections={'clip': {'method': 'pca', 'dims': 2}},
+    )
+    restarted_indexer.index(deepcopy(index_docs_map))
+    with pytest.raises(RuntimeError):
+        restarted_indexer.end_bulk_load()
+
+
+def test_projection_is_fitted_on_several_batches(
+    setup_service_running, es_inputs, random_index_name
+):
+    """
+    This test tests that a projection is fitted on the embeddings of several small index
+    requests once `num_samples` embeddings are staged, and that the staged documents are
+    indexed with it.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        user_input,
+    ) = es_inputs
+    # every document has a title and a gif embedding
+    es_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+        projections={'clip': {'method': 'pca', 'dims': 2, 'num_samples': 6}},
+    )
+    batches = []
+    for i in range(4):
+        doc = deepcopy(index_docs_map['clip'][i % 2])
+        doc.id = str(i)
+        batches.append({'clip': DocumentArray([doc])})
+
+    for batch in batches[:2]:
+        es_indexer.index(deepcopy(batch))
+        assert not es_indexer.projections['clip'].is_fitted
+        assert es_indexer.es.count(index=es_indexer.index_name)['count'] == 0
+
+    es_indexer.index(deepcopy(batches[2]))
+    assert es_indexer.projections['clip'].is_fitted
+    assert es_indexer.es.count(index=es_indexer.index_name)['count'] == 3
+    assert (
+        es_indexer.es.count(index=es_indexer.projection_sample_index_name)['count'] == 0
+    )
+
+    es_indexer.index(deepcopy(batches[3]))
+    res = es_indexer.search(
+        query_docs_map,
+        parameters={'score_calculation': default_score_calculation, 'limit': 10},
+    )
+    assert sorted(match.id for match in res[0].matches) == ['0', '1', '2', '3']
+
+
+def test_concurrent_index_requests_fit_one_projection(
+    setup_service_running, es_inputs, random_index_name
+):
+    """
+    This test tests that concurrent index requests do not fit different projections.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        user_input,
+    ) = es_inputs
+    es_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+        projections={'clip': {'method': 'pca', 'dims': 2, 'num_samples': 4}},
+    )
+    batches = [{'clip': DocumentArray([doc])} for doc in index_docs_map['clip']]
+    with ThreadPoolExecutor(max_workers=len(batches)) as pool:
+        list(pool.map(es_indexer.index, batches))
+
+    res = es_indexer.search(
+        query_docs_map,
+        parameters={'score_calculation': default_score_calculation},
+    )
+    assert len(res[0].matches) == len(index_docs_map['clip'])
+
+
+def test_search_with_result_cache(setup_service_running, es_inputs, random_index_name):
+    """
+    This test tests that repeated searches are answered from the result cache and that
+    indexing new documents invalidates the cached results.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        user_input,
+    ) = es_inputs
+    es_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+        result_cache_size=10,
+    )
+    es_indexer.index(index_docs_map)
+    parameters = {'score_calculation': default_score_calculation}
+    first = es_indexer.search(deepcopy(query_docs_map), parameters=parameters)
+    second = es_indexer.search(deepcopy(query_docs_map), parameters=parameters)
+    assert second[0].matches[:, 'id'] == first[0].matches[:, 'id']
+    stats = es_indexer.cache_stats()[0].tags
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+
+    es_indexer.delete(parameters={'ids': [first[0].matches[0].id]})
+    third = es_indexer.search(deepcopy(query_docs_map), parameters=parameters)
+    assert first[0].matches[0].id not in third[0].matches[:, 'id']
+    assert es_indexer.cache_stats()[0].tags['misses'] == 2
+
+
+@pytest.mark.asyncio
+async def test_index_and_search_with_async_client(
+    setup_service_running, es_inputs, random_index_name
+):
+    """
+    This test tests that documents are indexed and searched concurrently with the async client
+    and that the results are the same as with the sync client.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        user_input,
+    ) = es_inputs
+    es_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+        async_client=True,
+        es_connections_per_node=4,
+    )
+    await es_indexer.handle_index(docs_map=index_docs_map)
+    parameters = {'score_calculation': default_score_calculation}
+    expected = es_indexer.search(deepcopy(query_docs_map), parameters=parameters)
+    results = await asyncio.gather(
+        *[
+            es_indexer.handle_search(
+                docs_map=deepcopy(query_docs_map), parameters=parameters
+            )
+            for _ in range(5)
+        ]
+    )
+    for res in results:
+        assert res[0].matches[:, 'id'] == expected[0].matches[:, 'id']
+    await es_indexer.async_es.close()
+
+
+def test_circuit_breaker_endpoint(setup_service_running, es_inputs, random_index_name):
+    """
+    This test tests that successful searches keep the circuit breaker closed and that the
+    search timeout is taken from the executor configuration.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        user_input,
+    ) = es_inputs
+    es_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+        search_timeout=5,
+        health_check_timeout=10,
+    )
+    es_indexer.index(index_docs_map)
+    es_indexer.search(
+        query_docs_map, parameters={'score_calculation': default_score_calculation}
+    )
+    state = es_indexer.circuit_breaker_state()[0].tags
+    assert state['state'] == 'closed'
+    assert state['consecutive_failures'] == 0
+    assert state['rejected'] == 0
+
+
+def test_open_circuit_breaker_fails_requests_immediately(
+    setup_service_running, es_inputs, random_index_name, mocker
+):
+    """
+    This test tests that the curation check before searches and the bulk load check after
+    indexing are not sent to Elasticsearch while the circuit breaker is open.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        user_input,
+    ) = es_inputs
+    es_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+        circuit_breaker_failure_threshold=1,
+        circuit_breaker_reset_timeout=60,
+    )
+    with pytest.raises(ConnectionError):
+        with es_indexer.circuit_breaker:
+            raise ConnectionError('unavailable')
+    get = mocker.spy(es_indexer.es, 'get')
+    get_mapping = mocker.spy(es_indexer.es.indices, 'get_mapping')
+    es_indexer.curation_checked_at = 0.0
+    with pytest.raises(CircuitOpenError):
+        es_indexer.search(
+            query_docs_map, parameters={'score_calculation': default_score_calculation}
+        )
+    with pytest.raises(CircuitOpenError):
+        es_indexer.index(index_docs_map)
+    get.assert_not_called()
+    get_mapping.assert_not_called()
+
+
+def test_curation_is_persisted_and_updated(
+    setup_service_running, es_inputs, random_index_name
+):
+    """
+    This test tests that curation rules are restored by a new indexer and that the pinned IDs
+    are updated when documents are indexed or deleted.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        user_input,
+    ) = es_inputs
+    es_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+    )
+    es_indexer.index({'clip': index_docs_map['clip'][:1]})
+    es_indexer.curate(
+        parameters={'query_to_filter': {'cat': [{'tags__price': {'gte': 1}}]}}
+    )
+    assert es_indexer.query_to_curated_ids == {'cat': []}
+
+    es_indexer.index({'clip': index_docs_map['clip'][1:]})
+    assert es_indexer.query_to_curated_ids == {'cat': ['1']}
+
+    restarted_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+    )
+    assert restarted_indexer.query_to_curated_ids == {'cat': ['1']}
+    res = restarted_indexer.search(
+        query_docs_map,
+        parameters={'score_calculation': default_score_calculation},
+    )
+    assert res[0].matches[0].id == '1'
+
+    restarted_indexer.delete(parameters={'ids': ['1']})
+    assert restarted_indexer.query_to_curated_ids == {'cat': []}
+
+
+def test_curated_ids_are_added_with_one_request(
+    setup_service_running, es_inputs, random_index_name, mocker
+):
+    """
+    This test tests that the documents of an indexed batch are checked against all curation
+    filters in a single request, and that filters on tags which the batch does not set are
+    skipped.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        user_input,
+    ) = es_inputs
+    es_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+    )
+    es_indexer.curate(
+        parameters={
+            'query_to_filter': {
+                'cat': [{'tags__price': {'gte': 1}}, {'tags__unknown': ['red']}],
+                'dog': [{'tags__price': {'lt': 1}}],
+            }
+        }
+    )
+    msearch = mocker.spy(es_indexer, '_msearch')
+    es_indexer.index(index_docs_map)
+
+    msearch.assert_called_once()
+    (bodies,) = msearch.call_args.args
+    assert len(bodies) == 1
+    assert len(bodies[0]['aggs']['curation_filters']['filters']['filters']) == 2
+    assert es_indexer.query_to_curated_ids == {'cat': ['1'], 'dog': ['0']}
+
+
+def test_curation_is_shared_between_replicas(
+    setup_service_running, es_inputs, random_index_name
+):
+    """
+    This test tests that a replica reloads the curation rules changed by another replica before
+    searching, and that concurrent curations of the same query are merged.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        user_input,
+    ) = es_inputs
+    replicas = [
+        NOWElasticIndexer(
+            document_mappings=document_mappings,
+            user_input_dict=user_input.to_safe_dict(),
+            curation_check_interval=0,
+        )
+        for _ in range(2)
+    ]
+    replicas[0].index(index_docs_map)
+    replicas[0].curate(
+        parameters={'query_to_filter': {'cat': [{'tags__price': {'gte': 1}}]}}
+    )
+    res = replicas[1].search(
+        deepcopy(query_docs_map),
+        parameters={'score_calculation': default_score_calculation},
+    )
+    assert replicas[1].query_to_curated_ids == {'cat': ['1']}
+    assert res[0].matches[0].id == '1'
+
+    # the second replica curates without knowing the new rule of the first one
+    replicas[0].curate(
+        parameters={'query_to_filter': {'cat': [{'tags__price': {'lte': 1}}]}}
+    )
+    replicas[1].curate(
+        parameters={'query_to_filter': {'cat': [{'tags__price': {'gte': 100}}]}}
+    )
+    assert replicas[1].query_to_filters['cat'] == [
+        {'tags__price': {'gte': 1}},
+        {'tags__price': {'lte': 1}},
+        {'tags__price': {'gte': 100}},
+    ]
+    replicas[0].search(
+        deepcopy(query_docs_map),
+        parameters={'score_calculation': default_score_calculation},
+    )
+    assert replicas[0].query_to_filters == replicas[1].query_to_filters
+
+
+def test_search_with_typed_filter_fields(
+    setup_service_running, es_inputs, random_index_name
+):
+    """
+    This test tests that numeric filter fields are mapped with their type and that range
+    filters on them compare numbers, also if the type was detected from an integer. Values
+    which do not match the type of their field do not fail the index request.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        user_input,
+    ) = es_inputs
+    user_input.filter_fields = ['price', 'color', 'released', 'stock', 'in_stock']
+    user_input.filter_field_candidates_to_modalities = {
+        'price': 'int',
+        'color': 'str',
+        'released': 'date',
+        'stock': 'int',
+        'in_stock': 'bool',
+    }
+    es_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+        filter_field_types={'stock': 'long'},
+    )
+    tag_mappings = es_indexer.es_mapping['properties']['tags']['properties']
+    assert tag_mappings == {
+        'price': {'type': 'double', 'ignore_malformed': True},
+        'color': {'type': 'keyword'},
+        'released': {'type': 'date', 'ignore_malformed': True},
+        'stock': {'type': 'long', 'ignore_malformed': True},
+        'in_stock': {'type': 'boolean'},
+    }
+    index_docs_map['clip'][0].tags.update(
+        {'released': 'not a date', 'stock': 'N/A', 'in_stock': 'N/A'}
+    )
+    index_docs_map['clip'][1].tags.update(
+        {'released': '2023-01-01', 'stock': 3, 'in_stock': 'true'}
+    )
+    es_indexer.index(index_docs_map)
+    assert es_indexer.es.count(index=os.getenv('ES_INDEX_NAME'))['count'] == 2
+    for tag in ['stock', 'in_stock']:
+        assert (
+            es_indexer.es.count(
+                index=os.getenv('ES_INDEX_NAME'),
+                query={'exists': {'field': f'tags.{tag}'}},
+            )['count']
+            == 1
+        )
+    assert sorted(es_indexer.doc_id_tags['price']) == [0.5, 1.5]
+
+    res = es_indexer.search(
+        query_docs_map,
+        parameters={
+            'score_calculation': default_score_calculation,
+            'filter': {'tags__price': {'gt': 1.2, 'lte': 10}},
+        },
+    )
+    assert [m.tags['price'] for m in res[0].matches] == [1.5]
+
+
+def test_search_with_facets(setup_service_running, es_inputs, random_index_name):
+    """
+    This test tests that the facet counts are returned with the matches and that they are
+    restricted to the filtered results.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        user_input,
+    ) = es_inputs
+    es_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+    )
+    es_indexer.index(index_docs_map)
+
+    res = es_indexer.search(
+        deepcopy(query_docs_map),
+        parameters={
+            'score_calculation': default_score_calculation,
+            'facets': ['color'],
+        },
+    )
+    colors = [doc.tags['color'] for doc in index_docs_map['clip']]
+    assert {
+        facet['value']: facet['count'] for facet in res[0].tags['facets']['color']
+    } == {color: colors.count(color) for color in colors}
+
+    res = es_indexer.search(
+        deepcopy(query_docs_map),
+        parameters={
+            'score_calculation': default_score_calculation,
+            'facets': ['color'],
+            'filter': {'tags__price': {'lte': 1}},
+        },
+    )
+    assert res[0].tags['facets']['color'] == [
+        {'value': res[0].matches[0].tags['color'], 'count': 1}
+    ]
+
+
+@pytest.mark.parametrize('retrieval_mode', ['script_score', 'knn'])
+def test_search_by_document_id(
+    setup_service_running, es_inputs, random_index_name, retrieval_mode
+):
+    """
+    This test tests that similar documents are searched with the stored embeddings of an
+    indexed document, with the score calculation and filters of the request.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        user_input,
+    ) = es_inputs
+    es_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+        exclude_embeddings_from_source=True,
+    )
+    es_indexer.index(deepcopy(index_docs_map))
+
+    res = es_indexer.search(
+        parameters={'document_id': '0', 'retrieval_mode': retrieval_mode}
+    )
+    assert len(res) == 1
+    assert res[0].id == '0'
+    assert [match.id for match in res[0].matches] == ['1']
+
+    res = es_indexer.search(
+        parameters={
+            'document_id': '0',
+            'retrieval_mode': retrieval_mode,
+            'score_calculation': [['title', 'title', 'clip', 1]],
+            'get_score_breakdown': True,
+        },
+    )
+    assert 'title-title-clip-1' in res[0].matches[0].scores
+
+    res = es_indexer.search(
+        parameters={
+            'document_id': '0',
+            'retrieval_mode': retrieval_mode,
+            'filter': {'tags__price': {'lte': 1}},
+        },
+    )
+    assert len(res[0].matches) == 0
+
+
+def test_index_and_search_with_blob_store(
+    setup_service_running, es_inputs, random_index_name, tmpdir
+):
+    """
+    This test tests that blobs are moved to the blob store when documents are indexed, and
+    restored in the matches of searches and in listed documents.
+    """
+    (
+        index_docs_map,
+        query_docs_map,
+        document_mappings,
+        default_score_calculation,
+        user_input,
+    ) = es_inputs
+    for doc in index_docs_map['clip']:
+        doc.gif.chunks[0].blob = f'gif {doc.id}'.encode()
+    es_indexer = NOWElasticIndexer(
+        document_mappings=document_mappings,
+        user_input_dict=user_input.to_safe_dict(),
+        blob_store={'type': 'local', 'path': str(tmpdir)},
+    )
+    es_indexer.index(deepcopy(index_docs_map))
+    key = hashlib.sha256(b'gif 0').hexdigest()
+    assert es_indexer.blob_store.get(key) == b'gif 0'
+
+    res = es_indexer.search(
+        query_docs_map, parameters={'score_calculation': default_score_calculation}
+    )
+    assert len(res[0].matches) == len(index_docs_map['clip'])
+    for match in res[0].matches:
+        assert match.gif.chunks[0].blob == f'gif {match.id}'.encode()
+        assert BLOB_REF_TAG not in match.gif.chunks[0].tags
+
+    for doc in es_indexer.list():
+        assert doc.gif.chunks[0].blob == f'gif {doc.id}'.encode()
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from now.executor.indexer.elastic.projection import Projection, create_projections
+
+
+@pytest.mark.parametrize('method', ['pca', 'random_projection'])
+def test_projection_fit_and_serialize(method):
+    embeddings = np.random.default_rng(0).standard_normal((50, 16))
+    projection = Projection(method=method, dims=4)
+    assert not projection.is_fitted
+    projection.fit(embeddings)
+    projected = projection.transform(embeddings)
+    assert projected.shape == (50, 4)
+
+    loaded = Projection(method=method, dims=4)
+    loaded.from_bytes(projection.to_bytes())
+    np.testing.assert_allclose(loaded.transform(embeddings[0]), projected[0], rtol=1e-5)
+
+
+def test_random_projection_without_embeddings():
+    embeddings = np.random.default_rng(0).standard_normal((50, 16))
+    projection = Projection(method='random_projection', dims=4)
+    projection.fit(embeddings)
+    drawn = Projection(method='random_projection', dims=4)
+    drawn.fit_random_projection(16)
+    np.testing.assert_array_equal(drawn.components, projection.components)
+    with pytest.raises(ValueError):
+        drawn.fit_random_projection(2)
+
+
+def test_pca_with_fewer_samples_than_dims():
+    embeddings = np.random.default_rng(0).standard_normal((2, 16))
+    projection = Projection(method='pca', dims=4)
+    projection.fit(embeddings)
+    # the components are orthonormal
+    np.testing.assert_allclose(
+        projection.components @ projection.components.T, np.eye(4), atol=1e-5
+    )
+
+
+def test_create_projections():
+    projections = create_projections({'clip': {'method': 'pca', 'dims': 4}})
+    assert projections['clip'].dims == 4
+    assert create_projections(None) == {}
+    with pytest.raises(ValueError):
+        create_projections({'clip': {'method': 'umap', 'dims': 4}})
@@ -0,0 +1,60 @@
+from docarray import Document, DocumentArray
+
+from now.executor.indexer.elastic.result_cache import ResultCache
+
+
+def _result(n=3):
+    return Document(
+        matches=DocumentArray(
+            [Document(id=f'doc{i}', text=f'text {i}') for i in range(n)]
+        ),
+        tags={'facets': {'color': [{'value': 'red', 'count': n}]}},
+    )
+
+
+def test_result_cache_hit_and_miss():
+    cache = ResultCache(max_entries=10, max_bytes=10**6, ttl=60)
+    assert cache.get('query', generation=0) is None
+    cache.put('query', _result(), generation=0)
+    cached = cache.get('query', generation=0)
+    assert cached.matches[:, 'id'] == ['doc0', 'doc1', 'doc2']
+    assert cached.tags['facets']['color'][0]['count'] == 3
+    assert cache.get_stats()['hits'] == 1
+    assert cache.get_stats()['misses'] == 1
+
+
+def test_result_cache_is_invalidated_by_generation():
+    cache = ResultCache(max_entries=10, max_bytes=10**6, ttl=60)
+    cache.put('query', _result(), generation=0)
+    assert cache.get('query', generation=1) is None
+    assert cache.get_stats()['entries'] == 0
+
+
+def test_result_cache_expires():
+    cache = ResultCache(max_entries=10, max_bytes=10**6, ttl=0)
+    cache.put('query', _result(), generation=0)
+    assert cache.get('query', generation=0) is None
+
+
+def test_result_cache_evicts_least_recently_used():
+    cache = ResultCache(max_entries=2, max_bytes=10**6, ttl=60)
+    cache.put('a', _result(), generation=0)
+    cache.put('b', _result(), generation=0)
+    cache.get('a', generation=0)
+    cache.put('c', _result(), generation=0)
+    assert cache.get('b', generation=0) is None
+    assert cache.get('a', generation=0) is not None
+    assert cache.get_stats()['evictions'] == 1
+
+
+def test_result_cache_byte_limit():
+    size = len(_result().to_bytes())
+    cache = ResultCache(max_entries=10, max_bytes=size * 2, ttl=60)
+    for key in ['a', 'b', 'c']:
+        cache.put(key, _result(), generation=0)
+    stats = cache.get_stats()
+    assert stats['entries'] == 2
+    assert stats['bytes'] <= size * 2
+    # results larger than the limit are not cached
+    cache.put('large', _result(100), generation=0)
+    assert cache.get('large', generation=0) is None
@@ -182,3 +182,65 @@ def test_text_search_with_filters(
     results = DocumentArray.from_json(response.content)
     # the mock writes the call args into the response tags
     assert results[0].tags['parameters']['filter']
+
+
+@pytest.mark.parametrize('dump_user_input', [get_user_input()], indirect=True)
+def test_text_search_with_facets(
+    mock_hubble_billing_report,
+    dump_user_input,
+    client_with_mocked_jina_client: Callable[[DocumentArray], requests.Session],
+    sample_search_response_text: DocumentArray,
+):
+    """
+    Test that facets are passed to the search endpoint and that their counts are returned
+    with the results.
+    """
+    facets = {'color': [{'value': 'blue', 'count': 1}]}
+    sample_search_response_text[0].tags['facets'] = facets
+    response = client_with_mocked_jina_client(sample_search_response_text).post(
+        '/api/v1/search-app/search',
+        json={
+            'query': [
+                {'name': 'text', 'value': 'this crazy text', 'modality': 'text'},
+            ],
+            'facets': ['color'],
+            'facet_size': 5,
+        },
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    result = response.json()
+    assert result['facets'] == facets
+    assert len(result['matches']) == len(sample_search_response_text[0].matches)
+    # the mock writes the call args into the response tags
+    parameters = result['matches'][0]['tags']['parameters']
+    assert parameters['facets'] == ['color']
+    assert parameters['facet_size'] == 5
+
+
+@pytest.mark.parametrize('dump_user_input', [get_user_input()], indirect=True)
+def test_search_by_document_id(
+    mock_hubble_billing_report,
+    dump_user_input,
+    client_with_mocked_jina_client: Callable[[DocumentArray], requests.Session],
+    sample_search_response_text: DocumentArray,
+):
+    """
+    Test that documents similar to an indexed document can be searched without a query, and
+    that the query fields of the score calculation are mapped as index fields.
+    """
+    response = client_with_mocked_jina_client(sample_search_response_text).post(
+        '/api/v1/search-app/search',
+        json={
+            'document_id': '123',
+            'score_calculation': [['product_description', 'product_image', 'clip', 1]],
+        },
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    results = DocumentArray.from_json(response.content)
+    # the mock writes the call args into the response tags
+    assert results[0].tags['parameters']['document_id'] == '123'
+    assert results[0].tags['parameters']['score_calculation'] == [
+        ['product_description', 'product_image', 'clip', 1]
+    ]
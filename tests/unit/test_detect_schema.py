@@ -168,3 +168,27 @@ def test_create_candidate_index_fields():
     assert index_field_candidates_to_modalities['test.txt'] == Text
 
     assert len(filter_field_candidates_to_modalities.keys()) == 5
+
+
+def test_create_candidate_filter_fields_with_types():
+    (
+        index_field_candidates_to_modalities,
+        filter_field_candidates_to_modalities,
+    ) = _create_candidate_index_filter_fields(
+        {
+            'image.png': 'image.png',
+            'color': 'red',
+            'price': 1.5,
+            'stock': 3,
+            'available': True,
+            'released': '2023-01-31',
+        }
+    )
+    assert index_field_candidates_to_modalities['price'] == Text
+    assert filter_field_candidates_to_modalities == {
+        'color': 'str',
+        'price': 'float',
+        'stock': 'int',
+        'available': 'bool',
+        'released': 'date',
+    }
@@ -4,7 +4,7 @@ import pytest
 from docarray import Document, dataclass
 from docarray.typing import Image, Text, Video
 
-from now.utils.common.helpers import hide_string_chars, to_camel_case
+from now.utils.common.helpers import flatten_dict, hide_string_chars, to_camel_case
 from now.utils.docarray.helpers import (
     docarray_typing_to_modality_string,
     get_chunk_by_field_name,
@@ -84,3 +84,11 @@ def test_modality_string_to_docarray_typing(input_string, expected_type):
 )
 def test_hide_string_chars(input_string, hidden_string):
     assert hide_string_chars(input_string) == hidden_string
+
+
+def test_flatten_dict_keeps_value_types():
+    assert flatten_dict({'a': {'b': 1.5, 'c': True}, 'd': 'text'}) == {
+        'a__b': 1.5,
+        'a__c': True,
+        'd': 'text',
+    }